@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import shlex
+import socket
+import ntpath
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+GEN_MASTER_DATA = os.path.join(SCRIPT_DIR, 'gen_muts_master_data.py')
+MUTS2XLS = os.path.join(SCRIPT_DIR, 'muts2xls.py')
+
+# number of master data columns written by gen_muts_master_data.py
+N_MASTER_COLS = 25
+
+REPORTED_STAGES = ['open', 'parse', 'annotate', 'color', 'write', 'close']
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to benchmark muts2xls.py on synthetic mutations master data of several sizes")
+argp.add_argument('-o', dest='out_file',
+                        metavar='FILE',
+                        help='output benchmark results in JSON format',
+                        required=True)
+argp.add_argument('-n', dest='n_variants_list',
+                        metavar='COUNTS',
+                        help='comma-separated numbers of variants (default: 10000,100000,1000000)',
+                        default='10000,100000,1000000')
+argp.add_argument('-p', dest='n_samples_list',
+                        metavar='COUNTS',
+                        help='comma-separated numbers of samples (default: 50,500)',
+                        default='50,500')
+argp.add_argument('-f', dest='family_size',
+                        metavar='COUNT',
+                        help='number of members in each family (default: 2)',
+                        default='2')
+argp.add_argument('-m', dest='missing_freq_rate',
+                        metavar='RATIO',
+                        help='ratio of missing values in frequency columns (default: 0.3)',
+                        default='0.3')
+argp.add_argument('-c', dest='region_density',
+                        metavar='COUNT',
+                        help='number of color regions per 1000 variants (default: 1)',
+                        default='1')
+argp.add_argument('-r', dest='n_repeats',
+                        metavar='COUNT',
+                        type=int,
+                        help='number of runs of each size (default: 1)',
+                        default=1)
+argp.add_argument('-a', dest='muts2xls_args',
+                        metavar='ARGUMENTS',
+                        help='additional muts2xls.py arguments, e.g. "-F OAF:0.2,1000G:0.1 -E rare"',
+                        default='')
+argp.add_argument('-w', dest='work_dir',
+                        metavar='DIRECTORY',
+                        help='directory to keep the generated data, which are reused by later benchmarks (default: a temporary directory)',
+                        default=None)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=SCRIPT_DIR,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def gen_master_data(work_dir, n_variants, n_samples):
+    data_file = os.path.join(work_dir,
+                             "muts_" + str(n_variants) + "x" + str(n_samples) +
+                             "_f" + args.family_size +
+                             "_m" + args.missing_freq_rate +
+                             "_c" + args.region_density + ".tsv")
+    if os.path.isfile(data_file) and os.path.isfile(data_file + ".regions"):
+        info("reusing " + data_file)
+        return data_file
+    subprocess.check_call([sys.executable,
+                           GEN_MASTER_DATA,
+                           '-o', data_file,
+                           '-n', str(n_variants),
+                           '-p', str(n_samples),
+                           '-f', args.family_size,
+                           '-m', args.missing_freq_rate,
+                           '-c', args.region_density])
+    return data_file
+
+def run_muts2xls(work_dir, data_file, run_key):
+    out_file = os.path.join(work_dir, run_key + ".xlsx")
+    metrics_file = os.path.join(work_dir, run_key + ".json")
+    with open(data_file + ".regions") as regions_file:
+        color_regions = regions_file.read().strip()
+    cmd = [sys.executable,
+           MUTS2XLS,
+           '-o', out_file,
+           '-s', 'all,' + data_file,
+           '-N', str(N_MASTER_COLS),
+           '-l', os.path.join(work_dir, "bench.log"),
+           '--metrics', metrics_file]
+    if len(color_regions) > 0:
+        cmd += ['-C', color_regions]
+    cmd += shlex.split(args.muts2xls_args)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(cmd, stderr=devnull)
+    with open(metrics_file) as in_file:
+        metrics = json.load(in_file, object_pairs_hook=OrderedDict)
+    os.remove(out_file)
+    return metrics
+
+def summarize_metrics(metrics):
+    summary = OrderedDict()
+    summary['wall'] = metrics['wall']
+    summary['cpu'] = metrics['cpu']
+    summary['peak_rss_kb'] = metrics['peak_rss_kb']
+    summary['counters'] = metrics['counters']
+    stages = OrderedDict()
+    for stage in REPORTED_STAGES:
+        if stage in metrics['stages']:
+            stages[stage] = metrics['stages'][stage]['wall']
+    summary['stages'] = stages
+    return summary
+
+# ****************************** main codes ******************************
+n_variants_list = map(int, args.n_variants_list.split(','))
+n_samples_list = map(int, args.n_samples_list.split(','))
+if args.work_dir is not None:
+    work_dir = args.work_dir
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+else:
+    work_dir = tempfile.mkdtemp(prefix='bench_muts2xls.')
+
+results = OrderedDict()
+results['script'] = script_name
+results['revision'] = get_revision()
+results['host'] = socket.gethostname()
+results['python'] = sys.version.split()[0]
+results['timestamp'] = datetime.datetime.now().isoformat()
+results['parameters'] = sys.argv[1:]
+results['runs'] = []
+try:
+    for n_variants in n_variants_list:
+        for n_samples in n_samples_list:
+            data_file = gen_master_data(work_dir, n_variants, n_samples)
+            for repeat_idx in xrange(args.n_repeats):
+                run_key = "run_" + str(n_variants) + "x" + str(n_samples) + "_" + str(repeat_idx+1)
+                info("benchmarking " + str(n_variants) + " variants x " + str(n_samples) + " samples (run " + str(repeat_idx+1) + ")")
+                run = OrderedDict()
+                run['n_variants'] = n_variants
+                run['n_samples'] = n_samples
+                run['repeat'] = repeat_idx + 1
+                run.update(summarize_metrics(run_muts2xls(work_dir, data_file, run_key)))
+                info("done in " + str(round(run['wall'], 2)) + " sec, peak RSS " + str(run['peak_rss_kb']) + " KB")
+                results['runs'].append(run)
+finally:
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+with open(args.out_file, 'w') as out_file:
+    json.dump(results, out_file, indent=2)
+info("benchmark results are written to " + args.out_file)
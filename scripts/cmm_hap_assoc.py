@@ -0,0 +1,455 @@
+""" A sliding windows haplotypes association engine over phased genotypes """
+
+import math
+import numpy as np
+
+from cmm_plink import PHENO_CASE
+from cmm_plink import PHENO_CONTROL
+
+MISSING_ALLELE = '0'
+MISSING_ALLELE_CODE = 0
+
+HAP_ASSOC_HEADER = ['LOCUS', 'HAPLOTYPE', 'F_A', 'F_U', 'CHISQ', 'DF', 'P', 'SNPS']
+HAP_ASSOC_EXT = '.assoc.hap'
+OMNIBUS = 'OMNIBUS'
+STAT_NA = 'NA'
+WINDOW_TAG = 'WIN'
+SNPS_SEP = '|'
+
+# PLINK .assoc.hap column widths, the SNPs are not padded
+HAP_ASSOC_COL_WIDTHS = [10, 12, 8, 8, 8, 4, 12]
+
+IDX_COL_MARKER_CHROM = 0
+IDX_COL_MARKER_SNP = 1
+
+# PLINK defaults of --mhf, --maf and --geno
+DFLT_MHF = 0.01
+DFLT_MAF = 0.0
+DFLT_GENO = 1.0
+
+DFLT_WINDOWS_CHUNK_SIZE = 2048
+
+GAMMA_MAX_ITERS = 1000
+GAMMA_EPS = 3e-14
+GAMMA_FPMIN = 1e-300
+
+# ****************************** define functions ******************************
+def gamma_q(a, x):
+    """ regularized upper incomplete gamma function Q(a, x) """
+    if x <= 0:
+        return 1.0
+    gln = math.lgamma(a)
+    if x < a+1:
+        # series of P(a, x)
+        ap = a
+        term = 1.0/a
+        total = term
+        for n in xrange(GAMMA_MAX_ITERS):
+            ap += 1
+            term *= x/ap
+            total += term
+            if abs(term) < abs(total)*GAMMA_EPS:
+                break
+        return max(0.0, 1.0 - total*math.exp(-x + a*math.log(x) - gln))
+    # continued fraction of Q(a, x)
+    b = x + 1 - a
+    c = 1.0/GAMMA_FPMIN
+    d = 1.0/b
+    h = d
+    for i in xrange(1, GAMMA_MAX_ITERS):
+        an = -i*(i-a)
+        b += 2
+        d = an*d + b
+        if abs(d) < GAMMA_FPMIN:
+            d = GAMMA_FPMIN
+        c = b + an/c
+        if abs(c) < GAMMA_FPMIN:
+            c = GAMMA_FPMIN
+        d = 1.0/d
+        delta = d*c
+        h *= delta
+        if abs(delta-1) < GAMMA_EPS:
+            break
+    return math.exp(-x + a*math.log(x) - gln)*h
+
+def chi2_sf(chisq, df):
+    """ P-value of a chi-square statistic """
+    if df == 1:
+        return math.erfc(math.sqrt(chisq/2.0))
+    return gamma_q(df/2.0, chisq/2.0)
+
+def sum_by_rows(rows, weights, n_rows):
+    """
+    float sums of weights by row, bincount gives integers when there is no
+    weight at all, e.g. without cases or haplotypes above mhf
+    """
+    return np.bincount(rows, weights=weights, minlength=n_rows).astype(np.float64)
+
+def format_stat(value):
+    # PLINK writes its statistics with 4 significant digits
+    if (value is None) or np.isnan(value):
+        return STAT_NA
+    return '%.4g' % value
+
+def encode_phased_gts(gts):
+    """
+    return (allele codes, alleles) of a marker from the "<allele> <allele>"
+    genotypes of its samples, the codes are kept in the order of the phased
+    haplotypes, two of each sample. The missing allele is code 0
+    """
+    alleles = np.array(" ".join(gts).split())
+    (uniq_alleles, codes) = np.unique(alleles, return_inverse=True)
+    uniq_alleles = uniq_alleles.tolist()
+    if MISSING_ALLELE in uniq_alleles:
+        # '0' sorts before the bases
+        return (codes, uniq_alleles)
+    return (codes+1, [MISSING_ALLELE] + uniq_alleles)
+
+def read_phased_tped(tped_reader,
+                     chrom=None,
+                     from_bp=None,
+                     to_bp=None,
+                     fam_ids=None,
+                     phenos=None,
+                     ):
+    """
+    return (markers, allele codes, alleles of each marker, phenotypes of the
+    samples) of a region of a phased PLINK .tped file. phenos map (family
+    ID, individual ID) to phenotypes, which are otherwise read from .tfam
+    """
+    sample_idxs = tped_reader.get_sample_idxs(fam_ids)
+    tfam_recs = tped_reader.tfam_recs
+    sample_phenos = []
+    for sample_idx in sample_idxs:
+        tfam_rec = tfam_recs[sample_idx]
+        if phenos is not None:
+            sample_phenos.append(phenos.get((tfam_rec[0], tfam_rec[1])))
+        else:
+            sample_phenos.append(tfam_rec[5])
+    markers = []
+    codes_blocks = []
+    marker_alleles = []
+    for (block_markers, gts) in tped_reader.iter_marker_blocks(chrom,
+                                                               from_bp,
+                                                               to_bp,
+                                                               sample_idxs):
+        block_codes = np.zeros((len(block_markers), 2*len(sample_idxs)),
+                               dtype=np.uint8)
+        for marker_idx in xrange(len(block_markers)):
+            (codes, alleles) = encode_phased_gts(gts[marker_idx])
+            block_codes[marker_idx] = codes
+            marker_alleles.append(alleles)
+        markers += block_markers
+        codes_blocks.append(block_codes)
+    if len(codes_blocks) == 0:
+        allele_codes = np.zeros((0, 2*len(sample_idxs)), dtype=np.uint8)
+    else:
+        allele_codes = np.concatenate(codes_blocks)
+    return (markers, allele_codes, marker_alleles, sample_phenos)
+
+def format_assoc_hap_row(cols):
+    padded_cols = map(lambda (col, width): col.rjust(width),
+                      zip(cols, HAP_ASSOC_COL_WIDTHS))
+    return " ".join(padded_cols + cols[len(HAP_ASSOC_COL_WIDTHS):])
+
+def get_assoc_hap_file_name(out_prefix, window_size):
+    return out_prefix + "_" + str(window_size) + HAP_ASSOC_EXT
+
+def write_assoc_haps(out_prefix, window_sizes, chunks_results):
+    """
+    write the results of HapAssocEngine.get_chunk_results(), in the order
+    of the chunks, into one .assoc.hap file of each window size, return the
+    file names of the window sizes
+    """
+    out_files = {}
+    for window_size in window_sizes:
+        out_files[window_size] = open(get_assoc_hap_file_name(out_prefix, window_size), 'w')
+        out_files[window_size].write(format_assoc_hap_row(HAP_ASSOC_HEADER) + "\n")
+    try:
+        for results in chunks_results:
+            for window_size in results:
+                out_file = out_files[window_size]
+                for row in results[window_size]:
+                    out_file.write(format_assoc_hap_row(row) + "\n")
+    finally:
+        for window_size in window_sizes:
+            out_files[window_size].close()
+    return dict(map(lambda x: (x, out_files[x].name), window_sizes))
+
+# ****************************** define classes ******************************
+class HapAssocEngine(object):
+    """
+    Case/control association of the haplotypes of every sliding window of
+    several sizes, as "plink --hap-assoc --hap-window" computes it, over
+    already phased haplotypes, so no haplotype is estimated. The haplotypes
+    of a window of size w are numbered from those of the window of size w-1
+    at the same start, the work is shared by all window sizes and every
+    window of a size is counted at once.
+    """
+
+    def __init__(self,
+                 markers,
+                 allele_codes,
+                 marker_alleles,
+                 sample_phenos,
+                 mhf=DFLT_MHF,
+                 maf=DFLT_MAF,
+                 geno=DFLT_GENO,
+                 ):
+        """
+        allele_codes are markers x haplotypes, the two haplotypes of each
+        sample are next to each other
+        """
+        haplo_phenos = np.repeat(np.array(sample_phenos, dtype=object), 2)
+        self.__is_case = (haplo_phenos == PHENO_CASE)
+        self.__is_control = (haplo_phenos == PHENO_CONTROL)
+        self.__mhf = mhf
+        marker_idxs = self.__filter_markers(allele_codes, maf, geno)
+        self.__markers = [markers[idx] for idx in marker_idxs]
+        self.__marker_alleles = [marker_alleles[idx] for idx in marker_idxs]
+        self.__codes = allele_codes[marker_idxs]
+        self.__n_codes = int(self.__codes.max()) + 1 if self.__codes.size > 0 else 1
+        self.__chroms = np.array(map(lambda x: x[IDX_COL_MARKER_CHROM],
+                                     self.__markers),
+                                 dtype=object)
+        self.__n_filtered_markers = len(markers) - len(marker_idxs)
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    def get_raw_repr(self):
+        return {"number of markers": self.n_markers,
+                "number of filtered markers": self.__n_filtered_markers,
+                "number of case haplotypes": int(self.__is_case.sum()),
+                "number of control haplotypes": int(self.__is_control.sum()),
+                "minimum haplotype frequency": self.__mhf,
+                }
+
+    @property
+    def n_markers(self):
+        return len(self.__markers)
+
+    @property
+    def n_filtered_markers(self):
+        return self.__n_filtered_markers
+
+    def __filter_markers(self, allele_codes, maf, geno):
+        """ drop the markers as --maf and --geno do before the windows """
+        n_markers = allele_codes.shape[0]
+        if n_markers == 0:
+            return np.zeros(0, dtype=np.intp)
+        called = (allele_codes != MISSING_ALLELE_CODE)
+        gt_called = called[:, 0::2] & called[:, 1::2]
+        n_samples = gt_called.shape[1]
+        keep = np.ones(n_markers, dtype=bool)
+        if n_samples > 0:
+            keep &= (1.0 - gt_called.mean(axis=1)) <= geno
+        if maf > 0:
+            n_codes = int(allele_codes.max()) + 1
+            offsets = np.arange(n_markers)[:, np.newaxis] * n_codes
+            allele_counts = np.bincount((allele_codes.astype(np.int64) + offsets)[called],
+                                        minlength=n_markers*n_codes)
+            allele_counts = allele_counts.reshape(n_markers, n_codes)[:, 1:]
+            n_alleles = allele_counts.sum(axis=1)
+            # the minor allele is the second most frequent one
+            sorted_counts = np.sort(allele_counts, axis=1)
+            if sorted_counts.shape[1] > 1:
+                minor_counts = sorted_counts[:, -2]
+            else:
+                minor_counts = np.zeros(n_markers, dtype=np.int64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mafs = np.where(n_alleles > 0,
+                                minor_counts / n_alleles.astype(float),
+                                0.0)
+            keep &= mafs >= maf
+        return np.flatnonzero(keep)
+
+    def get_window_starts(self, window_size):
+        """ windows do not span chromosomes """
+        n_windows = self.n_markers - window_size + 1
+        if n_windows <= 0:
+            return np.zeros(0, dtype=np.intp)
+        same_chrom = (self.__chroms[:n_windows] == self.__chroms[window_size-1:])
+        return np.flatnonzero(same_chrom)
+
+    def get_chunks(self, chunk_size=DFLT_WINDOWS_CHUNK_SIZE):
+        """ ranges of window starts which can be computed independently """
+        return [(start, min(start+chunk_size, self.n_markers))
+                for start in xrange(0, self.n_markers, chunk_size)]
+
+    def __count_haplos(self, haplo_ids, valid, rows):
+        """
+        return (rows, first haplotypes, case counts, control counts) of each
+        distinct haplotype of the windows at rows
+        """
+        n_haplos = haplo_ids.shape[1]
+        sub_ids = haplo_ids[rows]
+        counted = valid[rows] & (self.__is_case | self.__is_control)
+        n_ids = int(haplo_ids.max()) + 1 if haplo_ids.size > 0 else 1
+        keys = np.arange(len(rows), dtype=np.int64)[:, np.newaxis]*n_ids + sub_ids
+        flat_idxs = np.flatnonzero(counted)
+        (uniq_keys, first_idxs, inverse) = np.unique(keys.ravel()[flat_idxs],
+                                                     return_index=True,
+                                                     return_inverse=True)
+        haplo_cols = flat_idxs % n_haplos
+        case_counts = np.bincount(inverse,
+                                  weights=self.__is_case[haplo_cols],
+                                  minlength=len(uniq_keys))
+        control_counts = np.bincount(inverse,
+                                     weights=self.__is_control[haplo_cols],
+                                     minlength=len(uniq_keys))
+        return (uniq_keys // n_ids,
+                haplo_cols[first_idxs],
+                case_counts,
+                control_counts)
+
+    def __get_haplo_stats(self, window_rows, case_counts, control_counts, n_rows):
+        case_totals = sum_by_rows(window_rows, case_counts, n_rows)
+        control_totals = sum_by_rows(window_rows, control_counts, n_rows)
+        a = case_counts
+        c = control_counts
+        b = case_totals[window_rows] - a
+        d = control_totals[window_rows] - c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_as = a / case_totals[window_rows]
+            f_us = c / control_totals[window_rows]
+            freqs = (a+c) / (case_totals+control_totals)[window_rows]
+            denoms = (a+b) * (c+d) * (a+c) * (b+d)
+            chisqs = np.where(denoms > 0,
+                              (a+b+c+d) * (a*d-b*c)**2 / denoms,
+                              np.nan)
+        return (f_as, f_us, freqs, chisqs)
+
+    def __get_omnibus_stats(self, window_rows, case_counts, control_counts, n_rows):
+        """ chi-square of the 2 x haplotypes table of each window """
+        case_totals = sum_by_rows(window_rows, case_counts, n_rows)
+        control_totals = sum_by_rows(window_rows, control_counts, n_rows)
+        totals = case_totals + control_totals
+        haplo_totals = case_counts + control_counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exp_cases = haplo_totals * (case_totals/totals)[window_rows]
+            exp_controls = haplo_totals * (control_totals/totals)[window_rows]
+            cells = (np.where(exp_cases > 0, (case_counts-exp_cases)**2/exp_cases, 0) +
+                     np.where(exp_controls > 0, (control_counts-exp_controls)**2/exp_controls, 0))
+        chisqs = sum_by_rows(window_rows, cells, n_rows)
+        dfs = np.bincount(window_rows, minlength=n_rows) - 1
+        no_test = (dfs < 1) | (case_totals == 0) | (control_totals == 0)
+        chisqs[no_test] = np.nan
+        return (chisqs, dfs)
+
+    def __get_haplotype(self, marker_start, window_size, haplo_col):
+        return "".join([self.__marker_alleles[marker_idx][self.__codes[marker_idx, haplo_col]]
+                        for marker_idx in xrange(marker_start, marker_start+window_size)])
+
+    def __get_snps(self, marker_start, window_size):
+        return SNPS_SEP.join([self.__markers[marker_idx][IDX_COL_MARKER_SNP]
+                              for marker_idx in xrange(marker_start, marker_start+window_size)])
+
+    def __format_window(self,
+                        win_no,
+                        marker_start,
+                        window_size,
+                        omnibus_stats,
+                        haplos_stats,
+                        ):
+        locus = WINDOW_TAG + str(win_no)
+        snps = self.__get_snps(marker_start, window_size)
+        (chisq, df) = omnibus_stats
+        if np.isnan(chisq):
+            rows = [[locus, OMNIBUS, STAT_NA, STAT_NA, STAT_NA, str(max(df, 0)), STAT_NA, snps]]
+        else:
+            rows = [[locus, OMNIBUS, STAT_NA, STAT_NA, format_stat(chisq), str(df), format_stat(chi2_sf(chisq, df)), snps]]
+        haplos_rows = []
+        for (haplo_col, f_a, f_u, chisq) in haplos_stats:
+            if np.isnan(chisq):
+                p_value = np.nan
+            else:
+                p_value = chi2_sf(chisq, 1)
+            haplos_rows.append([locus,
+                                self.__get_haplotype(marker_start, window_size, haplo_col),
+                                format_stat(f_a),
+                                format_stat(f_u),
+                                format_stat(chisq),
+                                '1',
+                                format_stat(p_value),
+                                snps])
+        return rows + sorted(haplos_rows, key=lambda x: x[1])
+
+    def get_chunk_results(self, chunk, window_sizes, win_nos):
+        """
+        return {window size: rows} of the windows starting in chunk, in
+        the order of their starts. win_nos map each window size to the
+        window number of every start, see get_window_nos()
+        """
+        (chunk_start, chunk_end) = chunk
+        max_window_size = max(window_sizes)
+        chunk_codes = self.__codes[chunk_start:min(self.n_markers, chunk_end+max_window_size-1)]
+        chunk_called = (chunk_codes != MISSING_ALLELE_CODE)
+        haplo_ids = chunk_codes.astype(np.int64)
+        valid = chunk_called
+        results = {}
+        for window_size in xrange(1, max_window_size+1):
+            n_rows = chunk_codes.shape[0] - window_size + 1
+            if n_rows <= 0:
+                break
+            if window_size > 1:
+                # extend the haplotypes of the windows one marker shorter
+                haplo_ids = (haplo_ids[:n_rows]*self.__n_codes +
+                             chunk_codes[window_size-1:window_size-1+n_rows])
+                valid = valid[:n_rows] & chunk_called[window_size-1:window_size-1+n_rows]
+                # keep the numbers small, they are not compared across rows
+                (uniq_ids, inverse) = np.unique(haplo_ids, return_inverse=True)
+                haplo_ids = inverse.reshape(haplo_ids.shape).astype(np.int64)
+            if window_size not in window_sizes:
+                continue
+            starts = self.get_window_starts(window_size)
+            starts = starts[(starts >= chunk_start) & (starts < chunk_end)]
+            rows = starts - chunk_start
+            results[window_size] = self.__get_windows_rows(window_size,
+                                                           starts,
+                                                           rows,
+                                                           haplo_ids,
+                                                           valid,
+                                                           win_nos[window_size])
+        return results
+
+    def __get_windows_rows(self, window_size, starts, rows, haplo_ids, valid, win_nos):
+        if len(rows) == 0:
+            return []
+        (window_rows, haplo_cols, case_counts, control_counts) = self.__count_haplos(haplo_ids, valid, rows)
+        (f_as, f_us, freqs, chisqs) = self.__get_haplo_stats(window_rows,
+                                                             case_counts,
+                                                             control_counts,
+                                                             len(rows))
+        # rare haplotypes are neither reported nor part of the omnibus test
+        common = freqs >= self.__mhf
+        (omnibus_chisqs, omnibus_dfs) = self.__get_omnibus_stats(window_rows[common],
+                                                                 case_counts[common],
+                                                                 control_counts[common],
+                                                                 len(rows))
+        common_idxs = np.flatnonzero(common)
+        windows_haplos = [[] for row_idx in xrange(len(rows))]
+        for idx in common_idxs.tolist():
+            windows_haplos[window_rows[idx]].append((haplo_cols[idx],
+                                                     f_as[idx],
+                                                     f_us[idx],
+                                                     chisqs[idx]))
+        out_rows = []
+        for row_idx in xrange(len(rows)):
+            marker_start = starts[row_idx]
+            out_rows += self.__format_window(win_nos[marker_start],
+                                             marker_start,
+                                             window_size,
+                                             (omnibus_chisqs[row_idx], omnibus_dfs[row_idx]),
+                                             windows_haplos[row_idx])
+        return out_rows
+
+    def get_window_nos(self, window_sizes):
+        """ number of the window of every start, as PLINK names them """
+        win_nos = {}
+        for window_size in window_sizes:
+            nos = np.zeros(self.n_markers, dtype=np.int64)
+            starts = self.get_window_starts(window_size)
+            nos[starts] = np.arange(1, len(starts)+1)
+            win_nos[window_size] = nos
+        return win_nos
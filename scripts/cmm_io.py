@@ -0,0 +1,330 @@
+""" Input helpers shared by the CMM report scripts """
+
+import os
+import sys
+import stat
+import zlib
+import struct
+import threading
+import Queue
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+GZIP_MAGIC = '\x1f\x8b'
+GZIP_EXTS = ('.gz', '.bgz')
+GZIP_FIXED_HEADER_SIZE = 12
+GZIP_TRAILER_SIZE = 8
+BGZF_SUBFIELD_ID = 'BC'
+# uncompressed data of a BGZF block, as bgzip writes them
+BGZF_BLOCK_DATA_SIZE = 0xff00
+BGZF_HEADER_FMT = '<4sIBBHccHH'
+BGZF_EOF_BLOCK = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+                  '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+STDIN_NAME = '-'
+
+DFLT_QUEUE_SIZE = 32
+DFLT_CHUNK_SIZE = 1 << 20
+DFLT_DECOMPRESS_THREADS = min(4, cpu_count())
+# BGZF blocks submitted ahead of the consumer for each decompression thread
+BGZF_BLOCKS_AHEAD = 4
+
+# ****************************** define functions ******************************
+def is_stream(file_name):
+    """ stdin ('-'), named pipes and process substitutions can only be read once """
+    if file_name == STDIN_NAME:
+        return True
+    return not stat.S_ISREG(os.stat(file_name).st_mode)
+
+def is_gzip_file(file_name):
+    if file_name.endswith(GZIP_EXTS):
+        return True
+    if is_stream(file_name):
+        return False
+    with open(file_name, 'rb') as in_file:
+        magic = in_file.read(len(GZIP_MAGIC))
+    return magic == GZIP_MAGIC
+
+def is_bgzf_file(file_name):
+    if is_stream(file_name):
+        return False
+    with open(file_name, 'rb') as in_file:
+        header = in_file.read(GZIP_FIXED_HEADER_SIZE)
+        if len(header) < GZIP_FIXED_HEADER_SIZE:
+            return False
+        if (header[:2] != GZIP_MAGIC) or not (ord(header[3]) & 4):
+            return False
+        xlen = struct.unpack('<H', header[10:12])[0]
+        return get_bgzf_block_size(in_file.read(xlen)) is not None
+
+def get_bgzf_block_size(extra):
+    """ return BSIZE of a BGZF block, or None if it is a plain gzip member """
+    idx = 0
+    while idx + 4 <= len(extra):
+        (si, slen) = (extra[idx:idx+2], struct.unpack('<H', extra[idx+2:idx+4])[0])
+        if (si == BGZF_SUBFIELD_ID) and (slen == 2):
+            return struct.unpack('<H', extra[idx+4:idx+6])[0]
+        idx += 4 + slen
+    return None
+
+def read_bgzf_blocks(in_file):
+    """ yield the raw deflate payload of every BGZF block """
+    while True:
+        header = in_file.read(GZIP_FIXED_HEADER_SIZE)
+        if len(header) == 0:
+            return
+        if len(header) < GZIP_FIXED_HEADER_SIZE or header[:2] != GZIP_MAGIC:
+            raise IOError("invalid BGZF block header")
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = in_file.read(xlen)
+        bsize = get_bgzf_block_size(extra)
+        if bsize is None:
+            raise IOError("gzip member without BGZF block size")
+        cdata_size = bsize + 1 - GZIP_FIXED_HEADER_SIZE - xlen - GZIP_TRAILER_SIZE
+        cdata = in_file.read(cdata_size)
+        in_file.read(GZIP_TRAILER_SIZE)
+        yield cdata
+
+def inflate_bgzf_block(cdata):
+    return zlib.decompress(cdata, -zlib.MAX_WBITS)
+
+def deflate_bgzf_block(data):
+    """ a whole BGZF block of the data, readable by tabix and bgzip """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                  zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = GZIP_FIXED_HEADER_SIZE + 6 + len(cdata) + GZIP_TRAILER_SIZE - 1
+    header = struct.pack(BGZF_HEADER_FMT,
+                         '\x1f\x8b\x08\x04', 0, 0, 0xff, 6,
+                         BGZF_SUBFIELD_ID[0], BGZF_SUBFIELD_ID[1], 2, bsize)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+    return header + cdata + trailer
+
+def open_raw_input(file_name):
+    if file_name == STDIN_NAME:
+        return os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+    return open(file_name, 'rb')
+
+def open_input(file_name):
+    """
+    open a tab-separated input for reading, transparently decompressing
+    gzip/BGZF files in the background. '-' stands for stdin.
+    """
+    if is_gzip_file(file_name):
+        return BackgroundGzipReader(file_name)
+    return open_raw_input(file_name)
+
+def open_output(file_name):
+    """
+    open a text output for writing, BGZF compressed if the file name ends
+    with .gz or .bgz
+    """
+    if file_name.endswith(GZIP_EXTS):
+        return BgzfWriter(file_name)
+    return open(file_name, 'w')
+
+# ****************************** define classes ******************************
+class BackgroundGzipReader(object):
+    """
+    A line iterator over a gzip/BGZF file. Decompression runs in a
+    background thread (and BGZF blocks are inflated by a thread pool) which
+    feeds decompressed chunks to the reader through a bounded queue
+    """
+
+    def __init__(self,
+                 file_name,
+                 n_threads=DFLT_DECOMPRESS_THREADS,
+                 queue_size=DFLT_QUEUE_SIZE,
+                 chunk_size=DFLT_CHUNK_SIZE):
+        self.__file_name = file_name
+        self.__n_threads = n_threads
+        self.__chunk_size = chunk_size
+        self.__queue = Queue.Queue(maxsize=queue_size)
+        self.__stop = threading.Event()
+        self.__lines = self.__iter_lines()
+        self.__worker = threading.Thread(target=self.__decompress)
+        self.__worker.daemon = True
+        self.__worker.start()
+
+    def __repr__(self):
+        return "<BackgroundGzipReader '" + self.__file_name + "'>"
+
+    def __put(self, item):
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def __decompress(self):
+        try:
+            if (self.__n_threads > 1) and is_bgzf_file(self.__file_name):
+                self.__inflate_bgzf_blocks()
+            else:
+                self.__inflate_gzip_stream()
+            self.__put(None)
+        except Exception as e:
+            self.__put(e)
+
+    def __inflate_gzip_stream(self):
+        # zlib instead of GzipFile, so that non-seekable inputs work as well
+        in_file = open_raw_input(self.__file_name)
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            while True:
+                cdata = in_file.read(self.__chunk_size)
+                if not cdata:
+                    break
+                while cdata:
+                    chunk = inflater.decompress(cdata)
+                    if chunk and not self.__put(chunk):
+                        return
+                    # concatenated gzip members (e.g. BGZF blocks)
+                    cdata = inflater.unused_data
+                    if cdata:
+                        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunk = inflater.flush()
+            if chunk:
+                self.__put(chunk)
+        finally:
+            in_file.close()
+
+    def __inflate_bgzf_blocks(self):
+        """
+        at most n_threads * BGZF_BLOCKS_AHEAD blocks are read ahead of the
+        queue, so that the memory is bounded by the consumer's pace
+        """
+        pool = ThreadPool(self.__n_threads)
+        in_file = open(self.__file_name, 'rb')
+        max_in_flight = self.__n_threads * BGZF_BLOCKS_AHEAD
+        in_flight = deque()
+        try:
+            blocks = read_bgzf_blocks(in_file)
+            while True:
+                for cdata in blocks:
+                    in_flight.append(pool.apply_async(inflate_bgzf_block,
+                                                      (cdata,)))
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if len(in_flight) == 0:
+                    break
+                chunk = in_flight.popleft().get()
+                if chunk and not self.__put(chunk):
+                    break
+        finally:
+            pool.terminate()
+            in_file.close()
+
+    def __iter_chunks(self):
+        while True:
+            chunk = self.__queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def __iter_lines(self):
+        tail = ''
+        for chunk in self.__iter_chunks():
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if tail:
+            yield tail
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.__lines.next()
+
+    def readline(self):
+        try:
+            return self.next()
+        except StopIteration:
+            return ''
+
+    def close(self):
+        self.__stop.set()
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except Queue.Empty:
+            pass
+        self.__worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class BgzfWriter(object):
+    """
+    A BGZF file writer. The data are buffered and written one BGZF block of
+    BGZF_BLOCK_DATA_SIZE at a time, so memory does not grow with the file
+    and the output can be indexed or read back by blocks
+    """
+
+    def __init__(self, file_name):
+        self.__file_name = file_name
+        self.__out_file = open(file_name, 'wb')
+        self.__buffer = []
+        self.__buffer_size = 0
+        self.__n_blocks = 0
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    def get_raw_repr(self):
+        return {"file name": self.__file_name,
+                "number of blocks": self.__n_blocks,
+                }
+
+    @property
+    def name(self):
+        return self.__file_name
+
+    def __write_blocks(self, flush_all=False):
+        data = ''.join(self.__buffer)
+        offset = 0
+        while (len(data)-offset >= BGZF_BLOCK_DATA_SIZE) or (flush_all and offset < len(data)):
+            block_data = data[offset:offset+BGZF_BLOCK_DATA_SIZE]
+            self.__out_file.write(deflate_bgzf_block(block_data))
+            self.__n_blocks += 1
+            offset += len(block_data)
+        data = data[offset:]
+        self.__buffer = [data] if len(data) > 0 else []
+        self.__buffer_size = len(data)
+
+    def write(self, data):
+        self.__buffer.append(data)
+        self.__buffer_size += len(data)
+        if self.__buffer_size >= BGZF_BLOCK_DATA_SIZE:
+            self.__write_blocks()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.__write_blocks(flush_all=True)
+        self.__out_file.flush()
+
+    def close(self):
+        if self.__out_file.closed:
+            return
+        self.__write_blocks(flush_all=True)
+        self.__out_file.write(BGZF_EOF_BLOCK)
+        self.__out_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,104 @@
+""" Local job execution shared by the CMM report scripts """
+
+import os
+import time
+import subprocess
+from collections import OrderedDict
+from multiprocessing import cpu_count
+
+DFLT_POLL_INTERVAL = 0.2
+
+# ****************************** define functions ******************************
+def get_phys_mem_mb():
+    return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')) / (1024 * 1024)
+
+# ****************************** define classes ******************************
+class LocalJobError(Exception):
+    pass
+
+class LocalJobsExecutor(object):
+    """
+    Run shell commands as local subprocesses with at most n_workers of them
+    at a time and with the sum of their estimated memory kept within
+    mem_limit_mb. Jobs are started in submission order, so the longest ones
+    should be submitted first. A job larger than the limit still runs, but
+    alone.
+    """
+
+    def __init__(self, n_workers=None, mem_limit_mb=None):
+        if n_workers is None:
+            n_workers = cpu_count()
+        if mem_limit_mb is None:
+            mem_limit_mb = get_phys_mem_mb()
+        self.__n_workers = n_workers
+        self.__mem_limit_mb = mem_limit_mb
+        self.__pending_jobs = []
+        self.__running_jobs = OrderedDict()
+
+    def get_raw_repr(self):
+        return {"number of workers": self.n_workers,
+                "memory limit (MB)": self.mem_limit_mb,
+                "number of pending jobs": len(self.__pending_jobs),
+                "number of running jobs": len(self.__running_jobs),
+                }
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    @property
+    def n_workers(self):
+        return self.__n_workers
+
+    @property
+    def mem_limit_mb(self):
+        return self.__mem_limit_mb
+
+    @property
+    def running_mem_mb(self):
+        return sum(map(lambda x: x[1], self.__running_jobs.values()))
+
+    def submit(self, job_key, cmd, mem_mb=0):
+        self.__pending_jobs.append((job_key, cmd, mem_mb))
+
+    def __can_start(self, mem_mb):
+        if len(self.__running_jobs) == 0:
+            return True
+        if len(self.__running_jobs) >= self.n_workers:
+            return False
+        return self.running_mem_mb + mem_mb <= self.mem_limit_mb
+
+    def __start_jobs(self):
+        while (len(self.__pending_jobs) > 0) and self.__can_start(self.__pending_jobs[0][2]):
+            (job_key, cmd, mem_mb) = self.__pending_jobs.pop(0)
+            self.__running_jobs[job_key] = (subprocess.Popen(cmd, shell=True), mem_mb)
+
+    def terminate(self):
+        self.__pending_jobs = []
+        for (proc, mem_mb) in self.__running_jobs.values():
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        self.__running_jobs.clear()
+
+    def iter_done_jobs(self, poll_interval=DFLT_POLL_INTERVAL):
+        """
+        yield the key of every job as soon as it finishes, in the order of
+        completion. A failing job terminates the others
+        """
+        try:
+            self.__start_jobs()
+            while len(self.__running_jobs) > 0:
+                done_keys = filter(lambda x: self.__running_jobs[x][0].poll() is not None,
+                                   self.__running_jobs.keys())
+                if len(done_keys) == 0:
+                    time.sleep(poll_interval)
+                    continue
+                for job_key in done_keys:
+                    (proc, mem_mb) = self.__running_jobs.pop(job_key)
+                    if proc.returncode != 0:
+                        raise LocalJobError("job " + str(job_key) + " exited with status " + str(proc.returncode))
+                self.__start_jobs()
+                for job_key in done_keys:
+                    yield job_key
+        finally:
+            self.terminate()
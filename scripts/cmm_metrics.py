@@ -0,0 +1,225 @@
+""" Stage timing and resource metrics shared by the CMM report scripts """
+
+import os
+import re
+import sys
+import json
+import time
+import resource
+import cProfile
+import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# counters
+ROWS_READ = 'rows_read'
+ROWS_WRITTEN = 'rows_written'
+CELLS_WRITTEN = 'cells_written'
+
+PROFILE_EXT = '.prof'
+
+# ****************************** define functions ******************************
+def get_cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def get_peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def count_ws_cells(ws):
+    """ number of cells kept by an xlsxwriter worksheet """
+    table = getattr(ws, 'table', None)
+    if table is None:
+        return 0
+    return sum(len(cols) for cols in table.itervalues())
+
+# ****************************** define classes ******************************
+class ReportMetrics(object):
+    """
+    Wall and CPU time of the report stages and of every sheet, together with
+    rows/cells counters and the peak RSS. Stages are timed with stage(),
+    parts of a row loop can be accumulated (wall time only) with add_time().
+    If profile_prefix is given, every top level stage is also profiled with
+    cProfile into <profile_prefix>[.<sheet>].<stage>[.<n>].prof
+    """
+
+    def __init__(self, script_name, enabled=False, profile_prefix=None):
+        self.__script_name = script_name
+        self.__profile_prefix = profile_prefix
+        self.__enabled = enabled or (profile_prefix is not None)
+        self.__stages = OrderedDict()
+        self.__sheets = OrderedDict()
+        self.__counters = OrderedDict()
+        self.__stage_depth = 0
+        self.__profile_dumps = {}
+        self.__sheet = None
+        self.__start_wall = time.time()
+        self.__start_cpu = get_cpu_time()
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    def get_raw_repr(self):
+        return {"enabled": self.__enabled,
+                "profile prefix": self.__profile_prefix,
+                "stages": self.__stages.keys(),
+                "number of sheets": len(self.__sheets),
+                }
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def __get_stage(self, stages, name):
+        if name not in stages:
+            stages[name] = OrderedDict([('calls', 0),
+                                        ('wall', 0.0),
+                                        ('cpu', None)])
+        return stages[name]
+
+    def __merge_stages(self, stages, other_stages):
+        for name in other_stages:
+            stage_info = self.__get_stage(stages, name)
+            other_stage_info = other_stages[name]
+            stage_info['calls'] += other_stage_info['calls']
+            stage_info['wall'] += other_stage_info['wall']
+            if other_stage_info['cpu'] is not None:
+                stage_info['cpu'] = (stage_info['cpu'] or 0.0) + other_stage_info['cpu']
+
+    def __merge_counters(self, counters, other_counters):
+        for counter in other_counters:
+            counters[counter] = counters.get(counter, 0) + other_counters[counter]
+
+    def __merge_sheet(self, sheet):
+        """ a sheet recorded twice, e.g. computed and then replayed, is summed """
+        if sheet['name'] not in self.__sheets:
+            self.__sheets[sheet['name']] = sheet
+            return
+        old_sheet = self.__sheets[sheet['name']]
+        old_sheet['wall'] += sheet['wall']
+        old_sheet['cpu'] += sheet['cpu']
+        self.__merge_counters(old_sheet['counters'], sheet['counters'])
+        self.__merge_stages(old_sheet['stages'], sheet['stages'])
+
+    def __add_stage_time(self, name, wall, cpu=None):
+        stage_infos = [self.__get_stage(self.__stages, name)]
+        if self.__sheet is not None:
+            stage_infos.append(self.__get_stage(self.__sheet['stages'], name))
+        for stage_info in stage_infos:
+            stage_info['calls'] += 1
+            stage_info['wall'] += wall
+            if cpu is not None:
+                stage_info['cpu'] = (stage_info['cpu'] or 0.0) + cpu
+
+    @contextmanager
+    def stage(self, name):
+        if not self.__enabled:
+            yield
+            return
+        # cProfile cannot nest, only the top level stages are profiled
+        profiler = None
+        if (self.__profile_prefix is not None) and (self.__stage_depth == 0):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self.__stage_depth += 1
+        start_wall = time.time()
+        start_cpu = get_cpu_time()
+        try:
+            yield
+        finally:
+            self.__stage_depth -= 1
+            self.__add_stage_time(name,
+                                  time.time() - start_wall,
+                                  get_cpu_time() - start_cpu)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.__get_profile_file_name(name))
+
+    def __get_profile_file_name(self, stage_name):
+        file_name = self.__profile_prefix
+        if self.__sheet is not None:
+            file_name += '.' + re.sub(r'[^\w.-]', '_', self.__sheet['name'])
+        file_name += '.' + stage_name
+        # a stage can run many times outside of any sheet
+        n_dumps = self.__profile_dumps.get(file_name, 0) + 1
+        self.__profile_dumps[file_name] = n_dumps
+        if n_dumps > 1:
+            file_name += '.' + str(n_dumps)
+        return file_name + PROFILE_EXT
+
+    def add_time(self, name, wall):
+        if self.__enabled:
+            self.__add_stage_time(name, wall)
+
+    def count(self, counter, n=1):
+        if not self.__enabled:
+            return
+        self.__counters[counter] = self.__counters.get(counter, 0) + n
+        if self.__sheet is not None:
+            sheet_counters = self.__sheet['counters']
+            sheet_counters[counter] = sheet_counters.get(counter, 0) + n
+
+    def start_sheet(self, sheet_name, ws):
+        """ a sheet lasts until the next one is started or end_sheet() """
+        if not self.__enabled:
+            return
+        self.end_sheet()
+        self.__sheet = OrderedDict([('name', sheet_name),
+                                    ('wall', 0.0),
+                                    ('cpu', 0.0),
+                                    ('counters', OrderedDict()),
+                                    ('stages', OrderedDict()),
+                                    ])
+        self.__sheet_ws = ws
+        self.__sheet_start_wall = time.time()
+        self.__sheet_start_cpu = get_cpu_time()
+
+    def end_sheet(self):
+        if self.__sheet is None:
+            return
+        sheet = self.__sheet
+        sheet['wall'] = time.time() - self.__sheet_start_wall
+        sheet['cpu'] = get_cpu_time() - self.__sheet_start_cpu
+        n_cells = count_ws_cells(self.__sheet_ws)
+        self.__sheet = None
+        self.__sheet_ws = None
+        self.count(CELLS_WRITTEN, n_cells)
+        sheet['counters'][CELLS_WRITTEN] = sheet['counters'].get(CELLS_WRITTEN, 0) + n_cells
+        self.__merge_sheet(sheet)
+
+    def get_snapshot(self):
+        """
+        the stages, counters and sheets recorded so far, e.g. by a worker
+        process, to be merged into the metrics of the main process
+        """
+        self.end_sheet()
+        return {'stages': self.__stages,
+                'counters': self.__counters,
+                'sheets': self.__sheets.values(),
+                }
+
+    def merge(self, snapshot):
+        if not self.__enabled:
+            return
+        # the merged sheets come after the current one
+        self.end_sheet()
+        self.__merge_stages(self.__stages, snapshot['stages'])
+        self.__merge_counters(self.__counters, snapshot['counters'])
+        for sheet in snapshot['sheets']:
+            self.__merge_sheet(sheet)
+
+    def write(self, file_name):
+        self.end_sheet()
+        metrics = OrderedDict()
+        metrics['script'] = self.__script_name
+        metrics['parameters'] = sys.argv[1:]
+        metrics['timestamp'] = datetime.datetime.now().isoformat()
+        metrics['wall'] = time.time() - self.__start_wall
+        metrics['cpu'] = get_cpu_time() - self.__start_cpu
+        metrics['peak_rss_kb'] = get_peak_rss_kb()
+        metrics['counters'] = self.__counters
+        metrics['stages'] = self.__stages
+        metrics['sheets'] = self.__sheets.values()
+        with open(file_name, 'w') as out_file:
+            json.dump(metrics, out_file, indent=2)
@@ -0,0 +1,563 @@
+""" Readers of PLINK binary (.bed/.bim/.fam) and transposed (.tped/.tfam) files shared by the CMM report scripts """
+
+import os
+import numpy as np
+from operator import itemgetter
+from collections import OrderedDict
+
+BED_EXT = '.bed'
+BIM_EXT = '.bim'
+FAM_EXT = '.fam'
+# the magic number and the SNP-major mode flag
+BED_MAGIC = '\x6c\x1b'
+BED_SNP_MAJOR = '\x01'
+BED_HEADER_SIZE = 3
+
+# 2-bit genotype codes of a .bed file, the first sample of a byte is kept
+# in its two lowest bits
+BED_HOM_A1 = 0
+BED_MISSING = 1
+BED_HET = 2
+BED_HOM_A2 = 3
+SAMPLES_PER_BYTE = 4
+
+IDX_COL_BIM_CHROM = 0
+IDX_COL_BIM_SNP = 1
+IDX_COL_BIM_POS = 3
+IDX_COL_BIM_A1 = 4
+IDX_COL_BIM_A2 = 5
+
+TPED_EXT = '.tped'
+TFAM_EXT = '.tfam'
+PED_EXT = '.ped'
+MAP_EXT = '.map'
+# a sidecar file of the byte ranges of the chromosomes of a .tped file
+TPED_INDEX_EXT = '.cidx'
+N_TPED_MARKER_COLS = 4
+IDX_COL_TPED_CHROM = 0
+IDX_COL_TPED_POS = 3
+
+IDX_COL_FAM_FAM_ID = 0
+IDX_COL_FAM_INDV_ID = 1
+IDX_COL_FAM_PHENO = 5
+
+PHENO_CONTROL = '1'
+PHENO_CASE = '2'
+
+# chromosomes are kept by their numeric codes in .bim files
+CHROM_CODES = {'X': '23',
+               'Y': '24',
+               'XY': '25',
+               'MT': '26',
+               'M': '26',
+               }
+
+SNPS_INFO_HEADER = ['SNP', 'F_MISS_A', 'F_MISS_U', 'CHROM', 'POS']
+F_MISS_NA = 'NA'
+
+DFLT_SNPS_BLOCK_SIZE = 4096
+DFLT_TPED_BLOCK_SIZE = 1024
+
+# ****************************** define functions ******************************
+def get_chrom_code(chrom):
+    chrom = str(chrom).upper()
+    if chrom.startswith('CHR'):
+        chrom = chrom[3:]
+    return CHROM_CODES.get(chrom, chrom)
+
+def parse_region(region):
+    """ return (chrom, from_bp, to_bp) of '<chrom>[:<from bp>-<to bp>]' """
+    if ':' not in region:
+        return (region, None, None)
+    (chrom, bps) = region.split(':', 1)
+    (from_bp, to_bp) = bps.split('-')
+    return (chrom, int(from_bp), int(to_bp))
+
+def read_pheno_file(file_name):
+    """
+    map (family ID, individual ID) to the value of the first phenotype of a
+    PLINK phenotype (or cluster) file
+    """
+    phenos = {}
+    with open(file_name) as pheno_file:
+        for line in pheno_file:
+            cols = line.split()
+            if len(cols) < 3:
+                continue
+            phenos[(cols[0], cols[1])] = cols[2]
+    return phenos
+
+def format_f_miss(n_miss, n_geno):
+    if n_geno == 0:
+        return F_MISS_NA
+    return '%.4g' % (float(n_miss)/n_geno)
+
+def get_snps_info(bed_reader, snp_idxs, sample_idxs, phenos=None):
+    """
+    return the SNPS_INFO_HEADER records of the SNPs, their positions and
+    missing genotyping rates of cases and controls as "plink --missing"
+    computes them for the samples, with the numbers of cases and of
+    controls. phenos map (family ID, individual ID) to phenotypes, which
+    are otherwise read from .fam
+    """
+    if phenos is not None:
+        sample_phenos = map(lambda x: phenos.get(x),
+                            zip(bed_reader.fam_ids, bed_reader.indv_ids))
+    else:
+        sample_phenos = bed_reader.phenos
+    case_idxs = np.array(filter(lambda x: sample_phenos[x] == PHENO_CASE, sample_idxs),
+                         dtype=np.intp)
+    control_idxs = np.array(filter(lambda x: sample_phenos[x] == PHENO_CONTROL, sample_idxs),
+                            dtype=np.intp)
+    missing_counts = bed_reader.get_missing_counts(snp_idxs,
+                                                   [case_idxs, control_idxs])
+    snp_codes = bed_reader.snp_codes
+    chroms = bed_reader.chroms
+    positions = bed_reader.positions
+    snps_info = []
+    for row_idx in xrange(len(snp_idxs)):
+        snp_idx = snp_idxs[row_idx]
+        snps_info.append([snp_codes[snp_idx],
+                          format_f_miss(missing_counts[row_idx, 0], len(case_idxs)),
+                          format_f_miss(missing_counts[row_idx, 1], len(control_idxs)),
+                          chroms[snp_idx],
+                          str(positions[snp_idx]),
+                          ])
+    return (snps_info, len(case_idxs), len(control_idxs))
+
+def write_snps_info(bed_reader, out_file_name, snp_idxs, sample_idxs, phenos=None):
+    """
+    write the records of get_snps_info() in the layout which plink2xls.py
+    reads with -S, return the numbers of cases and of controls
+    """
+    (snps_info, n_cases, n_controls) = get_snps_info(bed_reader,
+                                                     snp_idxs,
+                                                     sample_idxs,
+                                                     phenos)
+    with open(out_file_name, 'w') as out_file:
+        out_file.write("\t".join(SNPS_INFO_HEADER) + "\n")
+        for snp_info in snps_info:
+            out_file.write("\t".join(snp_info) + "\n")
+    return (n_cases, n_controls)
+
+def write_ped_map_blocks(out_prefix, marker_blocks, tfam_recs):
+    """
+    write (marker columns, markers x samples genotypes) blocks of the
+    samples of tfam_recs in the tab-delimited .ped/.map layout which
+    plink2xls.py reads, return the numbers of markers and of samples
+    """
+    # each block is transposed into samples x markers once it is read
+    samples_gts_blocks = []
+    n_markers = 0
+    with open(out_prefix + MAP_EXT, 'w') as map_file:
+        for (markers, gts) in marker_blocks:
+            for marker in markers:
+                map_file.write("\t".join(marker) + "\n")
+            samples_gts_blocks.append(gts.T.copy())
+            n_markers += len(markers)
+    with open(out_prefix + PED_EXT, 'w') as ped_file:
+        for col_idx in xrange(len(tfam_recs)):
+            ped_cols = tfam_recs[col_idx][:]
+            for samples_gts in samples_gts_blocks:
+                ped_cols.extend(samples_gts[col_idx])
+            ped_file.write("\t".join(ped_cols) + "\n")
+    return (n_markers, len(tfam_recs))
+
+# ****************************** define classes ******************************
+class PlinkBedReader(object):
+    """
+    A reader of SNP-major PLINK binary files. The .bim and .fam files are
+    loaded into memory, the .bed file is memory mapped and the genotypes of
+    the selected SNPs and samples are decoded a block of SNPs at a time
+    """
+
+    def __init__(self, bfile_prefix):
+        self.__bfile_prefix = bfile_prefix
+        self.__load_bim(bfile_prefix + BIM_EXT)
+        self.__load_fam(bfile_prefix + FAM_EXT)
+        self.__load_bed(bfile_prefix + BED_EXT)
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    def get_raw_repr(self):
+        return {"bfile prefix": self.__bfile_prefix,
+                "number of SNPs": self.n_snps,
+                "number of samples": self.n_samples,
+                }
+
+    def __load_bim(self, file_name):
+        chroms = []
+        snp_codes = []
+        positions = []
+        alleles1 = []
+        alleles2 = []
+        with open(file_name) as bim_file:
+            for line in bim_file:
+                cols = line.split()
+                chroms.append(get_chrom_code(cols[IDX_COL_BIM_CHROM]))
+                snp_codes.append(cols[IDX_COL_BIM_SNP])
+                positions.append(int(cols[IDX_COL_BIM_POS]))
+                alleles1.append(cols[IDX_COL_BIM_A1])
+                alleles2.append(cols[IDX_COL_BIM_A2])
+        self.__chroms = np.array(chroms, dtype=object)
+        self.__snp_codes = snp_codes
+        self.__positions = np.array(positions, dtype=np.int64)
+        self.__alleles1 = alleles1
+        self.__alleles2 = alleles2
+
+    def __load_fam(self, file_name):
+        self.__fam_ids = []
+        self.__indv_ids = []
+        self.__phenos = []
+        with open(file_name) as fam_file:
+            for line in fam_file:
+                cols = line.split()
+                self.__fam_ids.append(cols[IDX_COL_FAM_FAM_ID])
+                self.__indv_ids.append(cols[IDX_COL_FAM_INDV_ID])
+                self.__phenos.append(cols[IDX_COL_FAM_PHENO])
+
+    def __load_bed(self, file_name):
+        with open(file_name, 'rb') as bed_file:
+            header = bed_file.read(BED_HEADER_SIZE)
+        if header[:len(BED_MAGIC)] != BED_MAGIC:
+            raise IOError(file_name + " is not a PLINK .bed file")
+        if header[len(BED_MAGIC):] != BED_SNP_MAJOR:
+            raise IOError(file_name + " is not in SNP-major mode")
+        self.__bytes_per_snp = (self.n_samples+SAMPLES_PER_BYTE-1) / SAMPLES_PER_BYTE
+        bed_size = BED_HEADER_SIZE + self.n_snps*self.__bytes_per_snp
+        if os.path.getsize(file_name) != bed_size:
+            raise IOError(file_name + " does not match the number of SNPs and samples of its .bim and .fam files")
+        if self.n_snps*self.__bytes_per_snp == 0:
+            self.__bed = np.zeros((self.n_snps, self.__bytes_per_snp),
+                                  dtype=np.uint8)
+            return
+        self.__bed = np.memmap(file_name,
+                               dtype=np.uint8,
+                               mode='r',
+                               offset=BED_HEADER_SIZE,
+                               shape=(self.n_snps, self.__bytes_per_snp))
+
+    @property
+    def n_snps(self):
+        return len(self.__snp_codes)
+
+    @property
+    def n_samples(self):
+        return len(self.__fam_ids)
+
+    @property
+    def chroms(self):
+        return self.__chroms
+
+    @property
+    def snp_codes(self):
+        return self.__snp_codes
+
+    @property
+    def positions(self):
+        return self.__positions
+
+    @property
+    def alleles1(self):
+        return self.__alleles1
+
+    @property
+    def alleles2(self):
+        return self.__alleles2
+
+    @property
+    def fam_ids(self):
+        return self.__fam_ids
+
+    @property
+    def indv_ids(self):
+        return self.__indv_ids
+
+    @property
+    def phenos(self):
+        return self.__phenos
+
+    def get_snp_idxs(self, chrom=None, from_bp=None, to_bp=None):
+        """ SNPs within the region, the bps are inclusive as in PLINK """
+        selected = np.ones(self.n_snps, dtype=bool)
+        if chrom is not None:
+            selected &= (self.__chroms == get_chrom_code(chrom))
+        if from_bp is not None:
+            selected &= (self.__positions >= from_bp)
+        if to_bp is not None:
+            selected &= (self.__positions <= to_bp)
+        return np.flatnonzero(selected)
+
+    def get_sample_idxs(self, fam_ids=None):
+        """ samples of the families, in the order of the .fam file """
+        if fam_ids is None:
+            return np.arange(self.n_samples, dtype=np.intp)
+        fam_ids = set(fam_ids)
+        return np.array([sample_idx for sample_idx in xrange(self.n_samples)
+                         if self.__fam_ids[sample_idx] in fam_ids],
+                        dtype=np.intp)
+
+    def iter_gt_blocks(self,
+                       snp_idxs=None,
+                       sample_idxs=None,
+                       block_size=DFLT_SNPS_BLOCK_SIZE,
+                       ):
+        """
+        yield (SNP indexes, genotype codes) of block_size SNPs at a time, the
+        codes are BED_* of the selected samples
+        """
+        if snp_idxs is None:
+            snp_idxs = np.arange(self.n_snps, dtype=np.intp)
+        if sample_idxs is None:
+            sample_idxs = np.arange(self.n_samples, dtype=np.intp)
+        sample_idxs = np.asarray(sample_idxs, dtype=np.intp)
+        byte_idxs = sample_idxs / SAMPLES_PER_BYTE
+        shifts = ((sample_idxs % SAMPLES_PER_BYTE) * 2).astype(np.uint8)
+        for block_start in xrange(0, len(snp_idxs), block_size):
+            block_snp_idxs = snp_idxs[block_start:block_start+block_size]
+            # a region is a contiguous slice, which is read without a copy
+            first_idx = block_snp_idxs[0]
+            if block_snp_idxs[-1] - first_idx == len(block_snp_idxs) - 1:
+                snps_bytes = self.__bed[first_idx:first_idx+len(block_snp_idxs)]
+            else:
+                snps_bytes = self.__bed[block_snp_idxs]
+            codes = (snps_bytes[:, byte_idxs] >> shifts) & 3
+            yield (block_snp_idxs, codes)
+
+    def get_missing_counts(self,
+                           snp_idxs=None,
+                           sample_groups=[],
+                           block_size=DFLT_SNPS_BLOCK_SIZE,
+                           ):
+        """
+        number of samples with missing genotype at each SNP (rows) in each
+        group of sample indexes (columns)
+        """
+        if snp_idxs is None:
+            snp_idxs = np.arange(self.n_snps, dtype=np.intp)
+        group_sizes = map(len, sample_groups)
+        sample_idxs = np.concatenate([np.zeros(0, dtype=np.intp)] +
+                                     map(lambda x: np.asarray(x, dtype=np.intp),
+                                         sample_groups))
+        # the first sample column of every group
+        group_starts = np.cumsum([0] + group_sizes[:-1]).astype(np.intp)
+        missing_counts = np.zeros((len(snp_idxs), len(sample_groups)),
+                                  dtype=np.int64)
+        row_idx = 0
+        for (block_snp_idxs, codes) in self.iter_gt_blocks(snp_idxs,
+                                                           sample_idxs,
+                                                           block_size):
+            n_block_snps = len(block_snp_idxs)
+            missing = (codes == BED_MISSING)
+            for group_idx in xrange(len(sample_groups)):
+                group_start = group_starts[group_idx]
+                group_end = group_start + group_sizes[group_idx]
+                group_missing = missing[:, group_start:group_end]
+                missing_counts[row_idx:row_idx+n_block_snps, group_idx] = group_missing.sum(axis=1)
+            row_idx += n_block_snps
+        return missing_counts
+
+class PlinkTpedReader(object):
+    """
+    A reader of PLINK transposed text files. Only the byte ranges of the
+    chromosomes of a region are read, with the help of an index which is
+    kept next to the .tped file, and only the fields of the selected
+    samples are kept. A region is transposed into PLINK .ped/.map files a
+    block of markers at a time, so that memory depends on the size of the
+    region rather than on the size of the .tped file
+    """
+
+    def __init__(self, tfile_prefix):
+        self.__tfile_prefix = tfile_prefix
+        self.__tped_file_name = tfile_prefix + TPED_EXT
+        self.__load_tfam(tfile_prefix + TFAM_EXT)
+        self.__load_chrom_index()
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' Object> ' + str(self.get_raw_repr())
+
+    def get_raw_repr(self):
+        return {"tfile prefix": self.__tfile_prefix,
+                "number of samples": self.n_samples,
+                "chromosomes": self.__chrom_ranges.keys(),
+                }
+
+    def __load_tfam(self, file_name):
+        self.__tfam_recs = []
+        with open(file_name) as tfam_file:
+            for line in tfam_file:
+                cols = line.split()
+                if len(cols) > 0:
+                    self.__tfam_recs.append(cols)
+
+    def __get_tped_stamp(self):
+        tped_stat = os.stat(self.__tped_file_name)
+        return str(tped_stat.st_size) + "\t" + str(int(tped_stat.st_mtime))
+
+    def __load_chrom_index(self):
+        """
+        the index maps each chromosome to the byte ranges of its lines, it
+        is rebuilt whenever the .tped file changes
+        """
+        index_file_name = self.__tped_file_name + TPED_INDEX_EXT
+        tped_stamp = self.__get_tped_stamp()
+        if os.path.isfile(index_file_name):
+            with open(index_file_name) as index_file:
+                lines = index_file.read().splitlines()
+            if (len(lines) > 0) and (lines[0] == '#' + tped_stamp):
+                self.__chrom_ranges = OrderedDict()
+                for line in lines[1:]:
+                    (chrom, start, end) = line.split('\t')
+                    self.__add_chrom_range(chrom, int(start), int(end))
+                return
+        self.__build_chrom_index()
+        try:
+            with open(index_file_name, 'w') as index_file:
+                index_file.write('#' + tped_stamp + "\n")
+                for chrom in self.__chrom_ranges:
+                    for (start, end) in self.__chrom_ranges[chrom]:
+                        index_file.write("\t".join([chrom, str(start), str(end)]) + "\n")
+        except IOError:
+            # a read-only database is indexed again by the next reader
+            pass
+
+    def __add_chrom_range(self, chrom, start, end):
+        if chrom not in self.__chrom_ranges:
+            self.__chrom_ranges[chrom] = []
+        self.__chrom_ranges[chrom].append((start, end))
+
+    def __build_chrom_index(self):
+        self.__chrom_ranges = OrderedDict()
+        offset = 0
+        run_chrom = None
+        run_start = 0
+        with open(self.__tped_file_name, 'rb') as tped_file:
+            for line in tped_file:
+                chrom = get_chrom_code(line.split(None, 1)[0])
+                if chrom != run_chrom:
+                    if run_chrom is not None:
+                        self.__add_chrom_range(run_chrom, run_start, offset)
+                    (run_chrom, run_start) = (chrom, offset)
+                offset += len(line)
+        if run_chrom is not None:
+            self.__add_chrom_range(run_chrom, run_start, offset)
+
+    @property
+    def n_samples(self):
+        return len(self.__tfam_recs)
+
+    @property
+    def tfam_recs(self):
+        return self.__tfam_recs
+
+    @property
+    def chroms(self):
+        return self.__chrom_ranges.keys()
+
+    def get_sample_idxs(self, fam_ids=None):
+        """ samples of the families, in the order of the .tfam file """
+        if fam_ids is None:
+            return range(self.n_samples)
+        fam_ids = set(fam_ids)
+        return [sample_idx for sample_idx in xrange(self.n_samples)
+                if self.__tfam_recs[sample_idx][IDX_COL_FAM_FAM_ID] in fam_ids]
+
+    def __iter_lines(self, chrom):
+        if chrom is None:
+            byte_ranges = [(0, os.path.getsize(self.__tped_file_name))]
+        else:
+            byte_ranges = self.__chrom_ranges.get(get_chrom_code(chrom), [])
+        with open(self.__tped_file_name, 'rb') as tped_file:
+            for (start, end) in byte_ranges:
+                tped_file.seek(start)
+                offset = start
+                while offset < end:
+                    line = tped_file.readline()
+                    offset += len(line)
+                    yield line
+
+    def __get_gts_getter(self, line, sample_idxs):
+        """
+        the genotype of a sample is one field of a tab-delimited line, or
+        two alleles fields of a space-delimited one
+        """
+        if '\t' in line:
+            col_idxs = map(lambda x: x+N_TPED_MARKER_COLS, sample_idxs)
+            return (lambda line: line.rstrip('\r\n').split('\t'),
+                    col_idxs,
+                    False)
+        col_idxs = []
+        for sample_idx in sample_idxs:
+            col_idxs.append(2*sample_idx+N_TPED_MARKER_COLS)
+            col_idxs.append(2*sample_idx+N_TPED_MARKER_COLS+1)
+        return (lambda line: line.split(), col_idxs, True)
+
+    def iter_marker_blocks(self,
+                           chrom=None,
+                           from_bp=None,
+                           to_bp=None,
+                           sample_idxs=None,
+                           block_size=DFLT_TPED_BLOCK_SIZE,
+                           ):
+        """
+        yield (marker columns, genotypes) of block_size markers of the
+        region at a time, the bps are inclusive as in PLINK. The genotypes
+        are a markers x samples array of "<allele> <allele>" strings
+        """
+        if sample_idxs is None:
+            sample_idxs = self.get_sample_idxs()
+        split_line = None
+        markers = []
+        gts = []
+        for line in self.__iter_lines(chrom):
+            if split_line is None:
+                (split_line, col_idxs, paired) = self.__get_gts_getter(line,
+                                                                       sample_idxs)
+                if len(col_idxs) > 0:
+                    get_gts = itemgetter(*col_idxs)
+                else:
+                    get_gts = lambda cols: ()
+            cols = split_line(line)
+            if len(cols) < N_TPED_MARKER_COLS:
+                continue
+            pos = int(cols[IDX_COL_TPED_POS])
+            if (from_bp is not None) and (pos < from_bp):
+                continue
+            if (to_bp is not None) and (pos > to_bp):
+                continue
+            markers.append(cols[:N_TPED_MARKER_COLS])
+            marker_gts = get_gts(cols)
+            if len(col_idxs) == 1:
+                marker_gts = (marker_gts,)
+            if paired:
+                marker_gts = map(" ".join, zip(marker_gts[0::2], marker_gts[1::2]))
+            gts.append(marker_gts)
+            if len(markers) >= block_size:
+                yield (markers, np.array(gts, dtype=object).reshape(len(markers), len(sample_idxs)))
+                markers = []
+                gts = []
+        if len(markers) > 0:
+            yield (markers, np.array(gts, dtype=object).reshape(len(markers), len(sample_idxs)))
+
+    def write_ped_map(self,
+                      out_prefix,
+                      chrom=None,
+                      from_bp=None,
+                      to_bp=None,
+                      fam_ids=None,
+                      block_size=DFLT_TPED_BLOCK_SIZE,
+                      ):
+        """
+        write the region of the families in the tab-delimited .ped/.map
+        layout which plink2xls.py reads, return the numbers of markers and
+        of samples
+        """
+        sample_idxs = self.get_sample_idxs(fam_ids)
+        return write_ped_map_blocks(out_prefix,
+                                    self.iter_marker_blocks(chrom,
+                                                            from_bp,
+                                                            to_bp,
+                                                            sample_idxs,
+                                                            block_size),
+                                    map(lambda x: self.__tfam_recs[x], sample_idxs))
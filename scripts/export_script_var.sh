@@ -20,4 +20,8 @@ export PLINK_DUMMY=$CMM_LIB_DIR/plink_dummy.sh
 #export VCF_COL_EXIST=$CMM_LIB_DIR/vcf_col_exist
 export MUTS2XLS=$CMM_LIB_DIR/muts2xls.py
 export PLINK2XLS=$CMM_LIB_DIR/plink2xls.py
+export TPED2PED=$CMM_LIB_DIR/tped2ped.py
+export HAP_ASSOC2REPORT=$CMM_LIB_DIR/hap_assoc2report.py
+export HAP_ASSOC=$CMM_LIB_DIR/hap_assoc.py
+export PLINK_REGIONS2REPORTS=$CMM_LIB_DIR/plink_regions2reports.py
 #export SORT_N_AWK_CSV=$CMM_LIB_DIR/sort_n_awk_csv.sh
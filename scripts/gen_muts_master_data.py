@@ -0,0 +1,242 @@
+import sys
+import gzip
+import random
+import ntpath
+import argparse
+import numpy as np
+
+# the same columns, in the same order, as script_gen_mutations_report.sh
+# generates for muts2xls.py (see MutationRecordIndexManager.COL_NAME)
+MASTER_COLS = ['#Key',
+               'Func',
+               'Gene',
+               'ExonicFunc',
+               'AAChange',
+               'OAF',
+               '1000g2012apr_ALL',
+               'ESP6500_ALL',
+               'dbSNP137',
+               'Chr',
+               'Start',
+               'End',
+               'Ref',
+               'Obs',
+               'PhyloP',
+               'PhyloP prediction',
+               'SIFT',
+               'SIFT prediction',
+               'PolyPhen2',
+               'PolyPhen2 prediction',
+               'LRT',
+               'LRT prediction',
+               'MT',
+               'MT prediction',
+               'Daniel_DB',
+               ]
+
+KEY_FMT = "{chrom}_{pos}"
+CHROMS = map(str, xrange(1, 23)) + ['X']
+CHROM_SIZE = 150000000
+BASES = 'ACGT'
+BLOCK_SIZE = 1000
+
+FUNCS = [('exonic', 30),
+         ('intronic', 40),
+         ('splicing', 5),
+         ('UTR3', 10),
+         ('UTR5', 5),
+         ('intergenic', 10),
+         ]
+EXONIC_FUNCS = [('synonymous SNV', 40),
+                ('nonsynonymous SNV', 50),
+                ('stopgain SNV', 5),
+                ('frameshift deletion', 5),
+                ]
+ZYGOSITIES = [('wt', 55),
+              ('het', 25),
+              ('hom', 8),
+              ('.', 10),
+              ('oth', 2),
+              ]
+PL_PREDS = 'CN'
+SIFT_PREDS = 'TD'
+PP_PREDS = 'DPB'
+LRT_PREDS = 'DNU'
+MT_PREDS = 'ADNP'
+REGION_COLORS = ['YELLOW', 'LIGHT_BLUE', 'GOLD', 'CORAL', 'LIME_GREEN']
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to generate synthetic mutations master data, with patients zygosities, in the format that muts2xls.py reads")
+argp.add_argument('-o', dest='out_file',
+                        metavar='FILE',
+                        help='output tab-separated file (gzip compressed if it ends with .gz)',
+                        required=True)
+argp.add_argument('-n', dest='n_variants',
+                        metavar='COUNT',
+                        type=int,
+                        help='number of variants (default: 10000)',
+                        default=10000)
+argp.add_argument('-p', dest='n_samples',
+                        metavar='COUNT',
+                        type=int,
+                        help='number of samples (default: 50)',
+                        default=50)
+argp.add_argument('-f', dest='family_size',
+                        metavar='COUNT',
+                        type=int,
+                        help='number of members in each family, patients are named <family>-<member> (default: 2)',
+                        default=2)
+argp.add_argument('-m', dest='missing_freq_rate',
+                        metavar='RATIO',
+                        type=float,
+                        help='ratio of missing values in frequency columns (default: 0.3)',
+                        default=0.3)
+argp.add_argument('-c', dest='region_density',
+                        metavar='COUNT',
+                        type=float,
+                        help='number of color regions per 1000 variants, the regions are written in -C format of muts2xls.py to <output>.regions (default: 1)',
+                        default=1.0)
+argp.add_argument('-S', dest='seed',
+                        metavar='SEED',
+                        type=int,
+                        help='random seed (default: 0)',
+                        default=0)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+def weighted_choice(choices):
+    total = sum(weight for (value, weight) in choices)
+    rand = random.uniform(0, total)
+    for (value, weight) in choices:
+        rand -= weight
+        if rand <= 0:
+            return value
+    return choices[-1][0]
+
+def get_patient_codes(n_samples, family_size):
+    patient_codes = []
+    for sample_idx in xrange(n_samples):
+        fam_code = str(sample_idx/family_size + 1)
+        member_code = str(sample_idx%family_size + 1)
+        patient_codes.append(fam_code + "-" + member_code)
+    return patient_codes
+
+def get_variant_positions(n_variants):
+    """
+    return (chrom, pos) spread over all chromosomes, sorted by their keys
+    as the master data is
+    """
+    positions = set()
+    while len(positions) < n_variants:
+        chrom = random.choice(CHROMS)
+        positions.add((chrom, random.randint(1, CHROM_SIZE)))
+    return sorted(positions, key=lambda (chrom, pos): get_key(chrom, pos))
+
+def get_key(chrom, pos):
+    return KEY_FMT.format(chrom=chrom.zfill(2), pos=str(pos).zfill(12))
+
+def gen_freq(missing_freq_rate):
+    if random.random() < missing_freq_rate:
+        return ''
+    return '%.4f' % random.betavariate(0.5, 3)
+
+def gen_score():
+    return '%.3f' % random.random()
+
+def gen_master_rec(var_idx, chrom, pos, missing_freq_rate):
+    func = weighted_choice(FUNCS)
+    if func == 'exonic':
+        ex_func = weighted_choice(EXONIC_FUNCS)
+        aa_change = 'G' + str(var_idx) + ':NM_' + str(var_idx) + ':exon1:c.' + str(pos) + 'A>G'
+    else:
+        ex_func = ''
+        aa_change = ''
+    (ref, obs) = random.sample(BASES, 2)
+    if random.random() < missing_freq_rate:
+        dbsnp = ''
+    else:
+        dbsnp = 'rs' + str(var_idx)
+    return [get_key(chrom, pos),
+            func,
+            'G' + str(var_idx/20),
+            ex_func,
+            aa_change,
+            gen_freq(missing_freq_rate),
+            gen_freq(missing_freq_rate),
+            gen_freq(missing_freq_rate),
+            dbsnp,
+            chrom,
+            str(pos),
+            str(pos),
+            ref,
+            obs,
+            gen_score(),
+            random.choice(PL_PREDS),
+            gen_score(),
+            random.choice(SIFT_PREDS),
+            gen_score(),
+            random.choice(PP_PREDS),
+            gen_score(),
+            random.choice(LRT_PREDS),
+            gen_score(),
+            random.choice(MT_PREDS),
+            gen_freq(missing_freq_rate),
+            ]
+
+def gen_color_regions(positions, patient_codes, region_density):
+    n_regions = int(round(len(positions) * region_density / 1000))
+    fam_codes = sorted(set(map(lambda x: x.split('-')[0], patient_codes)))
+    color_regions = []
+    for region_idx in xrange(n_regions):
+        start_idx = random.randint(0, len(positions)-1)
+        end_idx = min(len(positions)-1, start_idx + random.randint(0, 50))
+        (chrom, start_pos) = positions[start_idx]
+        (end_chrom, end_pos) = positions[end_idx]
+        if end_chrom != chrom:
+            end_pos = start_pos
+        color_regions.append(":".join([random.choice(fam_codes),
+                                       str(random.randint(1, 3)),
+                                       random.choice(REGION_COLORS),
+                                       chrom,
+                                       str(start_pos) + "-" + str(end_pos)]))
+    return color_regions
+
+def open_output(file_name):
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'wb')
+    return open(file_name, 'wb')
+
+# ****************************** main codes ******************************
+random.seed(args.seed)
+# zygosities are drawn a block of variants at a time, there are far more of
+# them than of master data cells
+zygo_random = np.random.RandomState(args.seed)
+zygo_codes = np.array(map(lambda x: x[0], ZYGOSITIES))
+zygo_weights = np.array(map(lambda x: x[1], ZYGOSITIES), dtype=float)
+zygo_weights /= zygo_weights.sum()
+patient_codes = get_patient_codes(args.n_samples, args.family_size)
+positions = get_variant_positions(args.n_variants)
+info("generating " + str(args.n_variants) + " variants of " + str(args.n_samples) + " samples into " + args.out_file)
+with open_output(args.out_file) as out_file:
+    out_file.write("\t".join(MASTER_COLS + patient_codes) + "\n")
+    for block_start in xrange(0, len(positions), BLOCK_SIZE):
+        block_end = min(block_start+BLOCK_SIZE, len(positions))
+        block_zygos = zygo_random.choice(len(zygo_codes),
+                                         size=(block_end-block_start, len(patient_codes)),
+                                         p=zygo_weights)
+        for var_idx in xrange(block_start, block_end):
+            (chrom, pos) = positions[var_idx]
+            rec = gen_master_rec(var_idx, chrom, pos, args.missing_freq_rate)
+            rec += zygo_codes[block_zygos[var_idx-block_start]].tolist()
+            out_file.write("\t".join(rec) + "\n")
+
+regions_file_name = args.out_file + ".regions"
+color_regions = gen_color_regions(positions, patient_codes, args.region_density)
+with open(regions_file_name, 'w') as regions_file:
+    regions_file.write(",".join(color_regions) + "\n")
+info(str(len(color_regions)) + " color regions are written to " + regions_file_name)
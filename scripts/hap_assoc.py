@@ -0,0 +1,123 @@
+import sys
+import ntpath
+import argparse
+import multiprocessing
+
+from cmm_plink import PlinkTpedReader
+from cmm_plink import parse_region
+from cmm_plink import read_pheno_file
+from cmm_hap_assoc import HapAssocEngine
+from cmm_hap_assoc import read_phased_tped
+from cmm_hap_assoc import write_assoc_haps
+from cmm_hap_assoc import HAP_ASSOC_EXT
+from cmm_hap_assoc import DFLT_MHF
+from cmm_hap_assoc import DFLT_MAF
+from cmm_hap_assoc import DFLT_GENO
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to run haplotypes association study of sliding windows of several sizes over phased haplotypes, into one PLINK compatible .assoc.hap file for each window size")
+argp.add_argument('-t', dest='tfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='phased PLINK .tped/.tfam input file prefix, the first allele of every genotype belongs to the first haplotype',
+                        required=True)
+argp.add_argument('-W', dest='window_sizes',
+                        metavar='SIZES',
+                        help='comma-separated haplotype window sizes, as --hap-window of PLINK',
+                        required=True)
+argp.add_argument('-o', dest='out_prefix',
+                        metavar='FILE PREFIX',
+                        help='output prefix, each window size is written to <prefix>_<size>' + HAP_ASSOC_EXT,
+                        required=True)
+argp.add_argument('-R', dest='region',
+                        metavar='REGION',
+                        help='region of interest in <chrom>[:<from bp>-<to bp>] format (default: All)',
+                        default='All')
+argp.add_argument('-P', dest='pheno_file',
+                        metavar='FILE',
+                        help='PLINK phenotype file (default: phenotypes of the .tfam file)',
+                        default=None)
+argp.add_argument('-I', dest='fam_ids',
+                        metavar='IDS',
+                        help='comma-separated family IDs of the samples to study (default: all samples)',
+                        default=None)
+argp.add_argument('--mhf', dest='mhf',
+                        metavar='FREQ',
+                        type=float,
+                        help='minimum haplotype frequency (default: ' + str(DFLT_MHF) + ')',
+                        default=DFLT_MHF)
+argp.add_argument('--maf', dest='maf',
+                        metavar='FREQ',
+                        type=float,
+                        help='minimum minor allele frequency of the markers (default: ' + str(DFLT_MAF) + ')',
+                        default=DFLT_MAF)
+argp.add_argument('--geno', dest='geno',
+                        metavar='RATE',
+                        type=float,
+                        help='maximum missing genotype rate of the markers (default: ' + str(DFLT_GENO) + ')',
+                        default=DFLT_GENO)
+argp.add_argument('-j', '--jobs', dest='n_jobs',
+                        metavar='N',
+                        type=int,
+                        help='number of processes (default: 1)',
+                        default=1)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+def get_chunk_results(chunk):
+    """ run by the workers, against the engine of the main codes """
+    return hap_assoc_engine.get_chunk_results(chunk, window_sizes, win_nos)
+
+def iter_chunks_results(chunks):
+    if args.n_jobs <= 1:
+        for chunk in chunks:
+            yield get_chunk_results(chunk)
+        return
+    pool = multiprocessing.Pool(args.n_jobs)
+    try:
+        for results in pool.imap(get_chunk_results, chunks):
+            yield results
+    finally:
+        pool.terminate()
+        pool.join()
+
+# ****************************** main codes ******************************
+window_sizes = sorted(set(map(int, args.window_sizes.split(','))))
+if args.region == 'All':
+    (chrom, from_bp, to_bp) = (None, None, None)
+else:
+    (chrom, from_bp, to_bp) = parse_region(args.region)
+if args.fam_ids is not None:
+    fam_ids = args.fam_ids.split(',')
+else:
+    fam_ids = None
+if args.pheno_file is not None:
+    phenos = read_pheno_file(args.pheno_file)
+else:
+    phenos = None
+tped_reader = PlinkTpedReader(args.tfile_prefix)
+(markers, allele_codes, marker_alleles, sample_phenos) = read_phased_tped(tped_reader,
+                                                                          chrom,
+                                                                          from_bp,
+                                                                          to_bp,
+                                                                          fam_ids,
+                                                                          phenos)
+hap_assoc_engine = HapAssocEngine(markers,
+                                  allele_codes,
+                                  marker_alleles,
+                                  sample_phenos,
+                                  mhf=args.mhf,
+                                  maf=args.maf,
+                                  geno=args.geno)
+info(str(hap_assoc_engine))
+win_nos = hap_assoc_engine.get_window_nos(window_sizes)
+
+out_file_names = write_assoc_haps(args.out_prefix,
+                                  window_sizes,
+                                  iter_chunks_results(hap_assoc_engine.get_chunks()))
+for window_size in window_sizes:
+    info("haplotypes association of window size " + str(window_size) + " is written to " + out_file_names[window_size])
@@ -0,0 +1,295 @@
+import os
+import re
+import sys
+import ntpath
+import argparse
+import itertools
+from collections import OrderedDict
+from multiprocessing import cpu_count
+
+from cmm_jobs import LocalJobsExecutor
+from cmm_jobs import get_phys_mem_mb
+
+IDX_COL_HAP_ASSOC_LOCUS = 0
+IDX_COL_HAP_ASSOC_HAPLOTYPE = 1
+IDX_COL_HAP_ASSOC_F_A = 2
+IDX_COL_HAP_ASSOC_F_U = 3
+IDX_COL_HAP_ASSOC_CHISQ = 4
+IDX_COL_HAP_ASSOC_P_VALUE = 7
+IDX_COL_HAP_ASSOC_SNPS = 8
+
+HEADER_HAPLOTYPE = 'HAPLOTYPE'
+HEADER_OR = 'OR'
+OMNIBUS = 'OMNIBUS'
+STAT_NA = 'NA'
+WINDOW_TAG = 'WIN'
+SIGNIFICANT_HAPLO_TAG = 'HAP'
+SNPS_SEP = '|'
+SNPS_HEADER = 'SNPS'
+HAP_ASSOC_EXT = '.assoc.hap'
+DFLT_JOB_MEM_MB = 2048
+# a window command keeps the genotypes of its input in memory, and the
+# haplotypes it phases grow with the window, both relative to the input size
+JOB_BASE_MEM_MB = 256
+JOB_MEM_INPUT_FACTOR = 8
+# haplotypes with a frequency of 0 or 1 have no odds ratio
+NO_OR_FREQS = ['0', '1']
+# good quality haplotypes have F_A > F_U and a P-value below
+FILTER_P_VALUE = 0.05
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to merge PLINK haplotypes association study results of several windows, calculate odds ratios and select the haplotypes of the windows with significant P-value for plink2xls.py")
+argp.add_argument('-i', dest='window_hap_assocs',
+                        metavar='WINDOWS',
+                        help='comma-separated PLINK assoc.hap files in <window size>:<file> format',
+                        required=True)
+argp.add_argument('-p', dest='p_value_sig_ratio',
+                        metavar='NUMBER',
+                        help='P-value significant ratio (default: 1e-03)',
+                        default='1e-03')
+argp.add_argument('-r', dest='raw_out_file',
+                        metavar='FILE',
+                        help='output merged haplotypes with odds ratio',
+                        required=True)
+argp.add_argument('-f', dest='fltred_out_file',
+                        metavar='FILE',
+                        help='output good quality haplotypes (F_A > F_U and P < ' + str(FILTER_P_VALUE) + ')',
+                        required=True)
+argp.add_argument('-s', dest='sig_windows_out_file',
+                        metavar='FILE',
+                        help='output haplotypes with P-value below the significant ratio',
+                        required=True)
+argp.add_argument('-S', dest='selected_out_file',
+                        metavar='FILE',
+                        help='output good quality haplotypes which share any SNP with the significant ones',
+                        required=True)
+argp.add_argument('-u', dest='uniq_snps_out_file',
+                        metavar='FILE',
+                        help='output unique SNPs of the good quality haplotypes',
+                        default=None)
+argp.add_argument('-c', dest='window_cmd',
+                        metavar='COMMAND',
+                        help='command to generate the assoc.hap file of a window locally, with {window_size} and {out_prefix} (the file without ' + HAP_ASSOC_EXT + ') placeholders, e.g. "plink --bfile data --hap-assoc --hap-window {window_size} --out {out_prefix}" (default: the files already exist)',
+                        default=None)
+argp.add_argument('-g', dest='generated_window_sizes',
+                        metavar='WINDOW SIZES',
+                        help='comma-separated sizes of the windows whose assoc.hap file is generated by the window command (default: all windows)',
+                        default=None)
+argp.add_argument('-j', dest='n_jobs',
+                        metavar='NUMBER',
+                        type=int,
+                        help='maximum number of window commands running at the same time (default: number of CPUs)',
+                        default=cpu_count())
+argp.add_argument('-M', dest='mem_limit_mb',
+                        metavar='MB',
+                        type=int,
+                        help='limit of the sum of the estimated memory of the running window commands (default: physical memory)',
+                        default=get_phys_mem_mb())
+argp.add_argument('--job-input', dest='job_input_file',
+                        metavar='FILE',
+                        help='genotypes file read by the window command, e.g. the PLINK .bed, to estimate the memory of each window from its size',
+                        default=None)
+argp.add_argument('--job-mem', dest='job_mem_mb',
+                        metavar='MB',
+                        type=int,
+                        help='estimated memory of a window command (default: estimated from --job-input and the window size, otherwise ' + str(DFLT_JOB_MEM_MB) + ')',
+                        default=None)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+def str2num(value):
+    # as awk strtonum(), a value which is not a number is zero
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+def version_key(value):
+    """ sort key of "sort -V", numbers within the value are compared as numbers """
+    return map(lambda x: (0, int(x), '') if x.isdigit() else (1, 0, x),
+               filter(len, re.split(r'(\d+)', value)))
+
+def get_window_out_prefix(file_name):
+    if file_name.endswith(HAP_ASSOC_EXT):
+        return file_name[:-len(HAP_ASSOC_EXT)]
+    return file_name
+
+def get_job_mem_mb(window_size):
+    """
+    memory of the window command of a window size, as given by --job-mem or
+    estimated from the size of --job-input, within the memory limit
+    """
+    if args.job_mem_mb is not None:
+        return args.job_mem_mb
+    if args.job_input_file is None:
+        return DFLT_JOB_MEM_MB
+    input_mb = os.path.getsize(args.job_input_file) / float(1024*1024)
+    job_mem_mb = JOB_BASE_MEM_MB + input_mb*(JOB_MEM_INPUT_FACTOR+int(window_size))
+    return min(int(job_mem_mb), args.mem_limit_mb)
+
+def iter_ready_windows(window_hap_assocs, window_cmd):
+    """
+    yield the windows in their order, each as soon as its assoc.hap file is
+    ready. With a window command, the files are generated by local jobs,
+    largest windows first, and a window is yielded once its job and those
+    of the windows before it are done
+    """
+    if window_cmd is None:
+        for window in window_hap_assocs:
+            yield window
+        return
+    if args.generated_window_sizes is not None:
+        generated_window_sizes = args.generated_window_sizes.split(',')
+    else:
+        generated_window_sizes = map(lambda x: x[0], window_hap_assocs)
+    generated_windows = filter(lambda x: x[0] in generated_window_sizes,
+                               window_hap_assocs)
+    executor = LocalJobsExecutor(args.n_jobs, args.mem_limit_mb)
+    for (window_size, file_name) in sorted(generated_windows,
+                                           key=lambda x: -int(x[0])):
+        executor.submit(file_name,
+                        window_cmd.format(window_size=window_size,
+                                          out_prefix=get_window_out_prefix(file_name)),
+                        get_job_mem_mb(window_size))
+    info(str(executor))
+    done_jobs = executor.iter_done_jobs()
+    # the files of the other windows are already there
+    done_files = set(map(lambda x: x[1], window_hap_assocs))
+    done_files -= set(map(lambda x: x[1], generated_windows))
+    for (window_size, file_name) in window_hap_assocs:
+        while file_name not in done_files:
+            done_file = next(done_jobs)
+            info("done generating haplotypes association study data of " + done_file)
+            done_files.add(done_file)
+        yield (window_size, file_name)
+
+def iter_window_haplos(window_hap_assocs):
+    """
+    yield the haplotypes of every window, in the order of the windows, with
+    their locus tagged with the window size. The files are read lazily one
+    line at a time
+    """
+    def iter_file_haplos(window_size, file_name):
+        window_tag = WINDOW_TAG + window_size + '_'
+        with open(file_name) as in_file:
+            for line in in_file:
+                if HEADER_HAPLOTYPE in line:
+                    continue
+                cols = line.replace(WINDOW_TAG, window_tag).split()
+                if len(cols) > 0:
+                    yield cols
+    return itertools.chain.from_iterable(itertools.starmap(iter_file_haplos,
+                                                           window_hap_assocs))
+
+def read_header(window):
+    (window_size, file_name) = window
+    with open(file_name) as in_file:
+        return in_file.readline().split()
+
+def insert_odds_ratio(cols):
+    """ as PLINK does not compute it, odds ratio is inserted after CHISQ """
+    f_a = cols[IDX_COL_HAP_ASSOC_F_A]
+    f_u = cols[IDX_COL_HAP_ASSOC_F_U]
+    if cols[IDX_COL_HAP_ASSOC_HAPLOTYPE] == HEADER_HAPLOTYPE:
+        odds_ratio = HEADER_OR
+    elif ((cols[IDX_COL_HAP_ASSOC_HAPLOTYPE] == OMNIBUS) or
+          (f_a in NO_OR_FREQS) or
+          (f_u in NO_OR_FREQS)):
+        odds_ratio = STAT_NA
+    else:
+        (f_a, f_u) = (str2num(f_a), str2num(f_u))
+        if (f_a == 1) or (f_u == 0) or (f_u == 1):
+            odds_ratio = STAT_NA
+        else:
+            odds_ratio = '%0.4f' % ((f_a/(1-f_a)) / (f_u/(1-f_u)))
+    return cols[:IDX_COL_HAP_ASSOC_CHISQ+1] + [odds_ratio] + cols[IDX_COL_HAP_ASSOC_CHISQ+1:]
+
+def is_good_haplo(line, cols):
+    # the haplotypes without odds ratio are dropped along with the OMNIBUS
+    # tests, as "grep -v NA" did
+    if (OMNIBUS in line) or (STAT_NA in line):
+        return False
+    return ((str2num(cols[IDX_COL_HAP_ASSOC_F_A]) > str2num(cols[IDX_COL_HAP_ASSOC_F_U])) and
+            (str2num(cols[IDX_COL_HAP_ASSOC_P_VALUE]) < FILTER_P_VALUE))
+
+def get_snps(cols):
+    return cols[IDX_COL_HAP_ASSOC_SNPS].split(SNPS_SEP)
+
+def write_lines(file_name, lines):
+    with open(file_name, 'w') as out_file:
+        for line in lines:
+            out_file.write(line + "\n")
+
+def select_haplos(fltred_haplos, sig_haplos):
+    """
+    every good quality haplotype which shares a SNP with a significant
+    haplotype is selected with its locus tagged by the number of the
+    significant haplotype. A haplotype selected many times is kept once,
+    with the first of its loci, and the haplotypes are sorted by locus
+    """
+    snp_haplo_idxs = {}
+    for haplo_idx in xrange(len(fltred_haplos)):
+        for snp in get_snps(fltred_haplos[haplo_idx]):
+            snp_haplo_idxs.setdefault(snp, []).append(haplo_idx)
+    selected_loci = OrderedDict()
+    for sig_idx in xrange(len(sig_haplos)):
+        sig_tag = SIGNIFICANT_HAPLO_TAG + str(sig_idx+1) + '_' + WINDOW_TAG
+        for snp in get_snps(sig_haplos[sig_idx]):
+            for haplo_idx in snp_haplo_idxs.get(snp, []):
+                cols = fltred_haplos[haplo_idx]
+                locus = cols[IDX_COL_HAP_ASSOC_LOCUS].replace(WINDOW_TAG, sig_tag)
+                haplo_key = "\t".join(cols[IDX_COL_HAP_ASSOC_LOCUS+1:]).replace(WINDOW_TAG, sig_tag)
+                if (haplo_key not in selected_loci) or (locus < selected_loci[haplo_key]):
+                    selected_loci[haplo_key] = locus
+    selected_lines = map(lambda (haplo_key, locus): locus + "\t" + haplo_key,
+                         selected_loci.items())
+    # loci in the same version order are sorted by their whole lines
+    return sorted(selected_lines,
+                  key=lambda x: (version_key(x.split("\t", 1)[0]), x))
+
+# ****************************** main codes ******************************
+window_hap_assocs = map(lambda x: tuple(x.split(':', 1)),
+                        args.window_hap_assocs.split(','))
+p_value_sig_ratio = float(args.p_value_sig_ratio)
+
+ready_windows = iter_ready_windows(window_hap_assocs, args.window_cmd)
+first_window = next(ready_windows)
+header = insert_odds_ratio(read_header(first_window))
+fltred_haplos = []
+with open(args.raw_out_file, 'w') as raw_out_file:
+    raw_out_file.write("\t".join(header) + "\n")
+    for cols in iter_window_haplos(itertools.chain([first_window],
+                                                   ready_windows)):
+        cols = insert_odds_ratio(cols)
+        line = "\t".join(cols)
+        raw_out_file.write(line + "\n")
+        if is_good_haplo(line, cols):
+            fltred_haplos.append(cols)
+info("done merging haplotypes association study results of " + str(len(window_hap_assocs)) + " window(s) and calculating odds ratio (output: " + args.raw_out_file + ")")
+
+header_line = "\t".join(header)
+write_lines(args.fltred_out_file,
+            [header_line] + map("\t".join, fltred_haplos))
+info("done filtering " + str(len(fltred_haplos)) + " good quality haplotypes (output: " + args.fltred_out_file + ")")
+
+sig_haplos = filter(lambda x: str2num(x[IDX_COL_HAP_ASSOC_P_VALUE]) < p_value_sig_ratio,
+                    fltred_haplos)
+write_lines(args.sig_windows_out_file, map("\t".join, sig_haplos))
+info("done picking " + str(len(sig_haplos)) + " significant haplotypes (p value < " + args.p_value_sig_ratio + ") (output: " + args.sig_windows_out_file + ")")
+
+write_lines(args.selected_out_file,
+            [header_line] + select_haplos(fltred_haplos, sig_haplos))
+info("done selecting haplotypes within the range of the significant ones (output: " + args.selected_out_file + ")")
+
+if args.uniq_snps_out_file is not None:
+    uniq_snps = set()
+    for cols in fltred_haplos:
+        uniq_snps.update(get_snps(cols))
+    write_lines(args.uniq_snps_out_file,
+                sorted(filter(lambda x: SNPS_HEADER not in x, uniq_snps)))
+    info("done preparing " + str(len(uniq_snps)) + " unique SNPs codes (output: " + args.uniq_snps_out_file + ")")
@@ -1,13 +1,34 @@
 from collections import OrderedDict
 from collections import defaultdict
+from array import array
+from contextlib import contextmanager
+from itertools import islice
 import sys
+import os
 import csv
+import json
+import gzip
+import shutil
+import hashlib
+import cPickle
+import cStringIO
+import tempfile
 import xlsxwriter
+from xlsxwriter.format import Format
+import numpy as np
 import ntpath
 import datetime
+import time
 
 import argparse
 
+from cmm_io import open_input
+from cmm_io import is_stream
+from cmm_io import STDIN_NAME
+from cmm_metrics import ReportMetrics
+from cmm_metrics import ROWS_READ
+from cmm_metrics import ROWS_WRITTEN
+
 ATTRIB_RARE = 'rare'
 ATTRIB_HAS_SHARED = 'has_shared'
 ATTRIB_HAS_MUTATION = 'has_mutation'
@@ -21,6 +42,16 @@ CELL_TYPE_HOM_SHARED = 'HOM_SHARED'
 
 INC_SHARED_MUTATION = 'S'
 
+STAGE_OPEN = 'open'
+STAGE_PARSE = 'parse'
+STAGE_ANNOTATE = 'annotate'
+STAGE_COLOR = 'color'
+STAGE_WRITE = 'write'
+STAGE_SHEET = 'mutations_sheet'
+STAGE_REPLAY = 'replay_sheet'
+STAGE_ADDN_SHEET = 'addn_sheet'
+STAGE_CLOSE = 'close'
+
 #DFLT_COLOR_RARE = 'YELLOW'
 #DFLT_COLOR_HARMFUL = 'LIGHT_BLUE'
 #DFLT_COLOR_SHARED = 'SILVER'
@@ -81,6 +112,18 @@ ZYGO_CODES[ZYGO_OTH_KEY] = 'oth'
 
 HORIZONTAL_SPLIT_IDX=1
 
+# columns of typed frequencies kept in the master data cache
+TYPED_FREQ_OAF = 0
+TYPED_FREQ_1000G = 1
+TYPED_FREQ_ESP6500 = 2
+TYPED_FREQ_DAN_DB = 3
+N_TYPED_FREQS = 4
+
+# zygosities that the families sheets treat as uncalled (see
+# get_common_zygosities in script_gen_mutations_report.sh)
+UNCALLED_ZYGOS = ('.', '')
+PATIENT_CODES_SEP = '|'
+
 script_name = ntpath.basename(sys.argv[0])
 
 # ****************************** define classes ******************************
@@ -131,6 +174,7 @@ class CellFormatManager(MutationsReportBase):
         self.__dflt_hash_fmt = {'font_name': 'Arial', 'font_size': 10}
         self.__dflt_fmt = self.__add_fmt(self.__dflt_hash_fmt)
         self.__init_colors_formats()
+        self.__fmt_keys = None
 
     def get_raw_repr(self):
         return {"color dict": self.__color_dict,
@@ -168,6 +212,15 @@ class CellFormatManager(MutationsReportBase):
     def cell_fmts(self):
         return self.__cell_fmts
 
+    @property
+    def fmt_keys(self):
+        """ map each cell format back to its key in cell_fmts """
+        if self.__fmt_keys is None:
+            self.__fmt_keys = {}
+            for fmt_key in self.__cell_fmts:
+                self.__fmt_keys[self.__cell_fmts[fmt_key]] = fmt_key
+        return self.__fmt_keys
+
 class PredictionTranslator(MutationsReportBase):
     """
     A class to translate codes from effect predictors by using informaiton
@@ -415,11 +468,13 @@ class MutationContentRecord(MutationRecord):
                  col_idx_mg,
                  pred_tran,
                  freq_ratios=[],
-                 pat_grp_idxs=[]):
+                 pat_grp_idxs=[],
+                 typed_freqs=None):
         MutationRecord.__init__(self, data, n_master_cols, col_idx_mg)
         self.__pred_tran = pred_tran
         self.__freq_ratios = freq_ratios
         self.__pat_grp_idxs = pat_grp_idxs
+        self.__typed_freqs = typed_freqs
         self.__init_pat_zygos()
         self.__annotate_rarity()
         self.__check_zygosities()
@@ -456,26 +511,17 @@ class MutationContentRecord(MutationRecord):
     @property
     def oaf(self):
         oaf = super(MutationContentRecord, self).oaf
-        if isFloat(oaf):
-            return float(oaf)
-        else:
-            return oaf
+        return self.__get_freq(oaf, TYPED_FREQ_OAF)
 
     @property
     def maf(self):
         maf = super(MutationContentRecord, self).maf
-        if isFloat(maf):
-            return float(maf)
-        else:
-            return maf
+        return self.__get_freq(maf, TYPED_FREQ_1000G)
 
     @property
     def esp6500(self):
         esp6500 = super(MutationContentRecord, self).esp6500
-        if isFloat(esp6500):
-            return float(esp6500)
-        else:
-            return esp6500
+        return self.__get_freq(esp6500, TYPED_FREQ_ESP6500)
 
     @property
     def pl_pred(self):
@@ -562,10 +608,19 @@ class MutationContentRecord(MutationRecord):
     @property
     def dan_freq(self):
         dan_freq = super(MutationContentRecord, self).dan_freq
-        if isFloat(dan_freq):
-            return float(dan_freq)
+        return self.__get_freq(dan_freq, TYPED_FREQ_DAN_DB)
+
+    def __get_freq(self, raw_freq, typed_freq_idx):
+        # frequencies converted by the master data cache are NaN when the
+        # raw value is not a number
+        if self.__typed_freqs is not None:
+            freq = self.__typed_freqs[typed_freq_idx]
+            if freq == freq:
+                return float(freq)
+        if isFloat(raw_freq):
+            return float(raw_freq)
         else:
-            return dan_freq
+            return raw_freq
 
     def __init_pat_zygos(self):
         pat_zygos = map(lambda x:Patient_Zygosity(x),
@@ -966,6 +1021,388 @@ class FamilyInfos(MutationsReportBase):
             self.__fam_infos[fam_code] = FamilyInfo(fam_code)
         self.__fam_infos[fam_code].append(full_patient_code)
 
+class MasterDataCache(MutationsReportBase):
+    """
+    A binary copy of a mutations csv stored next to it (<csv>.m2x) so that
+    the summary and the family reports, which all read the same master data,
+    parse the csv only once. Every cell is kept as an index into a string
+    table in a memory-mapped matrix, frequencies are kept already converted
+    to float (NaN if not a number)
+    """
+
+    VERSION = 1
+    DIR_EXT = '.m2x'
+    META_FILE = 'meta.json'
+    CODES_FILE = 'codes.npy'
+    FREQS_FILE = 'freqs.npy'
+    STRINGS_FILE = 'strings.dat'
+    STRING_OFFSETS_FILE = 'string_offsets.npy'
+    BLOCK_SIZE = 4096
+
+    def __init__(self, cache_dir):
+        self.__cache_dir = cache_dir
+        with open(os.path.join(cache_dir, self.META_FILE)) as meta_file:
+            self.__meta = json.load(meta_file)
+        self.__codes = np.load(os.path.join(cache_dir, self.CODES_FILE),
+                               mmap_mode='r')
+        self.__freqs = np.load(os.path.join(cache_dir, self.FREQS_FILE),
+                               mmap_mode='r')
+        with open(os.path.join(cache_dir, self.STRINGS_FILE), 'rb') as strings_file:
+            blob = strings_file.read()
+        offsets = np.load(os.path.join(cache_dir, self.STRING_OFFSETS_FILE)).tolist()
+        self.__strings = [blob[offsets[i]:offsets[i+1]] for i in xrange(len(offsets)-1)]
+        self.__code_idx = dict((self.__strings[i], i) for i in xrange(len(self.__strings)))
+        self.header = [self.__strings[code] for code in self.__meta['header']]
+
+    def get_raw_repr(self):
+        return {"cache directory": self.__cache_dir,
+                "number of records": self.n_recs,
+                "number of columns": len(self.header),
+                "number of strings": len(self.__strings),
+                }
+
+    @property
+    def n_recs(self):
+        return self.__codes.shape[0]
+
+    @classmethod
+    def get_cache_dir(cls, csv_file):
+        return csv_file + cls.DIR_EXT
+
+    @classmethod
+    def get_csv_stat(cls, csv_file):
+        csv_stat = os.stat(csv_file)
+        return {"version": cls.VERSION,
+                "path": os.path.abspath(csv_file),
+                "size": csv_stat.st_size,
+                "mtime": csv_stat.st_mtime,
+                }
+
+    @classmethod
+    def is_valid(cls, cache_dir, csv_stat):
+        meta_file_name = os.path.join(cache_dir, cls.META_FILE)
+        if not os.path.isfile(meta_file_name):
+            return False
+        try:
+            with open(meta_file_name) as meta_file:
+                meta = json.load(meta_file)
+        except ValueError:
+            return False
+        for key in csv_stat:
+            if meta.get(key) != csv_stat[key]:
+                return False
+        return True
+
+    @classmethod
+    def load(cls, csv_file):
+        """
+        return the cache of csv_file, building it first if it does not exist
+        or is stale, or None if the csv cannot be cached
+        """
+        if is_stream(csv_file):
+            warn(csv_file + " is a stream, master data will not be cached")
+            return None
+        cache_dir = cls.get_cache_dir(csv_file)
+        csv_stat = cls.get_csv_stat(csv_file)
+        if cls.is_valid(cache_dir, csv_stat):
+            info("loading master data cache: " + cache_dir)
+            return cls(cache_dir)
+        info("building master data cache: " + cache_dir)
+        try:
+            tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(cache_dir)+'.',
+                                       dir=os.path.dirname(os.path.abspath(csv_file)))
+        except OSError as e:
+            warn("master data cannot be cached (" + str(e) + ")")
+            return None
+        try:
+            if not cls.build(csv_file, tmp_dir, csv_stat):
+                return None
+            if os.path.isdir(cache_dir):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            try:
+                os.rename(tmp_dir, cache_dir)
+            except OSError:
+                # another report has just built the same cache
+                if not cls.is_valid(cache_dir, csv_stat):
+                    raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls(cache_dir)
+
+    @classmethod
+    def build(cls, csv_file, cache_dir, csv_stat):
+        code_idx = {'': 0}
+        strings = ['']
+        codes = array('i')
+        freqs = array('d')
+        nan = float('nan')
+        with open_input(csv_file) as csvfile:
+            csv_reader = csv.reader(csvfile, delimiter='\t')
+            raw_header_rec = csv_reader.next()
+            col_idx_mg = MutationRecordIndexManager(raw_header_rec)
+            freq_col_idxs = [None] * N_TYPED_FREQS
+            freq_col_idxs[TYPED_FREQ_OAF] = col_idx_mg.IDX_OAF
+            freq_col_idxs[TYPED_FREQ_1000G] = col_idx_mg.IDX_1000G
+            freq_col_idxs[TYPED_FREQ_ESP6500] = col_idx_mg.IDX_ESP6500
+            freq_col_idxs[TYPED_FREQ_DAN_DB] = col_idx_mg.IDX_DAN_DB
+            rec_size = len(raw_header_rec)
+            n_recs = 0
+            header_codes = []
+            for item in raw_header_rec:
+                if item not in code_idx:
+                    code_idx[item] = len(strings)
+                    strings.append(item)
+                header_codes.append(code_idx[item])
+            for raw_rec in csv_reader:
+                if len(raw_rec) != rec_size:
+                    warn("record " + str(n_recs+2) + " of " + csv_file + " has " + str(len(raw_rec)) + " columns instead of " + str(rec_size) + ", master data will not be cached")
+                    return False
+                for item in raw_rec:
+                    code = code_idx.get(item)
+                    if code is None:
+                        code = code_idx[item] = len(strings)
+                        strings.append(item)
+                    codes.append(code)
+                for col_idx in freq_col_idxs:
+                    if (col_idx is not None) and isFloat(raw_rec[col_idx]):
+                        freqs.append(float(raw_rec[col_idx]))
+                    else:
+                        freqs.append(nan)
+                n_recs += 1
+        np.save(os.path.join(cache_dir, cls.CODES_FILE),
+                np.frombuffer(codes, dtype=np.int32).reshape(n_recs, rec_size))
+        np.save(os.path.join(cache_dir, cls.FREQS_FILE),
+                np.frombuffer(freqs, dtype=np.float64).reshape(n_recs, N_TYPED_FREQS))
+        offsets = np.zeros(len(strings)+1, dtype=np.int64)
+        np.cumsum(map(len, strings), out=offsets[1:])
+        np.save(os.path.join(cache_dir, cls.STRING_OFFSETS_FILE), offsets)
+        with open(os.path.join(cache_dir, cls.STRINGS_FILE), 'wb') as strings_file:
+            strings_file.write(''.join(strings))
+        meta = dict(csv_stat)
+        meta['header'] = header_codes
+        # meta is written last, a cache without it is never used
+        with open(os.path.join(cache_dir, cls.META_FILE), 'w') as meta_file:
+            json.dump(meta, meta_file)
+        return True
+
+    def iter_recs(self, col_idxs=None, zygo_start=None):
+        """
+        yield (raw record, typed frequencies) of every record, keeping only
+        col_idxs if given. Zygosities (col_idxs[zygo_start:]) of a record
+        are all blanked if any of them is uncalled
+        """
+        strings = self.__strings
+        if zygo_start is not None:
+            uncalled_codes = [self.__code_idx[zygo] for zygo in UNCALLED_ZYGOS
+                              if zygo in self.__code_idx]
+        for start in xrange(0, self.n_recs, self.BLOCK_SIZE):
+            codes = self.__codes[start:start+self.BLOCK_SIZE]
+            if col_idxs is not None:
+                codes = np.array(codes[:, col_idxs])
+            if zygo_start is not None:
+                uncalled = np.in1d(codes[:, zygo_start:], uncalled_codes)
+                uncalled = uncalled.reshape(codes.shape[0], -1).any(axis=1)
+                codes[uncalled, zygo_start:] = self.__code_idx['']
+            freqs = self.__freqs[start:start+self.BLOCK_SIZE]
+            for rec_idx in xrange(codes.shape[0]):
+                raw_rec = [strings[code] for code in codes[rec_idx].tolist()]
+                yield (raw_rec, freqs[rec_idx])
+
+class SheetRecorder(MutationsReportBase):
+    """
+    A worksheet proxy which passes every call to the worksheet and also
+    streams it, with cell formats replaced by their keys, into a sheet cache
+    file so that the sheet can be replayed without being computed again
+    """
+
+    FLUSH_SIZE = 10000
+
+    def __init__(self, ws, cell_fmt_mg, out_file):
+        self.__ws = ws
+        self.__fmt_keys = cell_fmt_mg.fmt_keys
+        self.__out_file = out_file
+        self.__pickler = cPickle.Pickler(out_file, cPickle.HIGHEST_PROTOCOL)
+        self.__calls = []
+        self.n_calls = 0
+
+    def get_raw_repr(self):
+        return {"worksheet": self.__ws.get_name(),
+                "number of calls": self.n_calls,
+                }
+
+    def __record(self, name, args):
+        fmt_idx = -1
+        for idx in xrange(len(args)):
+            if isinstance(args[idx], Format):
+                fmt_idx = idx
+                args = args[:idx] + (self.__fmt_keys[args[idx]],) + args[idx+1:]
+                break
+        self.__calls.append((name, args, fmt_idx))
+        self.n_calls += 1
+        if len(self.__calls) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def write(self, *args):
+        self.__record('write', args)
+        return self.__ws.write(*args)
+
+    def __getattr__(self, name):
+        method = getattr(self.__ws, name)
+        def record_call(*args):
+            self.__record(name, args)
+            return method(*args)
+        return record_call
+
+    def flush(self):
+        if len(self.__calls) > 0:
+            self.__pickler.dump(self.__calls)
+            self.__pickler.clear_memo()
+            self.__calls = []
+
+class SheetCache(MutationsReportBase):
+    """
+    A content-addressed store of generated mutations sheets. A sheet is
+    identified by a hash of the csv columns it shows, its patients and every
+    option that changes how it looks, so that an unchanged sheet is replayed
+    from the store instead of being computed again. The columns of a csv are
+    hashed once per run, and an edit of a patient column only invalidates
+    the sheets which show that patient
+    """
+
+    VERSION = 2
+    FILE_EXT = '.sheet'
+    HASH_BLOCK_RECS = 4096
+
+    def __init__(self, cache_dir, options, n_master_cols):
+        self.__cache_dir = cache_dir
+        self.__n_master_cols = n_master_cols
+        self.__csvs_digests = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        options_hash = hashlib.sha1()
+        options_hash.update(str(self.VERSION))
+        # a new version of the script may write the sheets differently
+        with open(os.path.realpath(__file__), 'rb') as script_file:
+            options_hash.update(script_file.read())
+        for (opt_name, opt_value) in options:
+            options_hash.update('\0' + opt_name + '=' + repr(opt_value))
+        self.__options_digest = options_hash.hexdigest()
+
+    def get_raw_repr(self):
+        return {"cache directory": self.__cache_dir,
+                "options digest": self.__options_digest,
+                }
+
+    def __hash_cols(self, csv_file):
+        """
+        return (header, digest of the record sizes, digest of each column).
+        Records are padded or cut to the header size, the digest of the
+        record sizes catches what is padded or cut
+        """
+        with open_input(csv_file) as csvfile:
+            csv_reader = csv.reader(csvfile, delimiter='\t')
+            header = csv_reader.next()
+            n_cols = len(header)
+            col_hashes = map(lambda x: hashlib.sha1(), xrange(n_cols))
+            rec_sizes_hash = hashlib.sha1()
+            while True:
+                recs = list(islice(csv_reader, self.HASH_BLOCK_RECS))
+                if len(recs) == 0:
+                    break
+                rec_sizes_hash.update(repr(map(len, recs)))
+                padding = [''] * n_cols
+                cols = zip(*map(lambda x: (x+padding)[:n_cols], recs))
+                for col_idx in xrange(n_cols):
+                    col_hashes[col_idx].update('\0'.join(cols[col_idx]) + '\n')
+            csvfile.close()
+        return (header,
+                rec_sizes_hash.hexdigest(),
+                map(lambda x: x.hexdigest(), col_hashes))
+
+    def __get_csv_digests(self, csv_file):
+        """ the columns of a csv are hashed again only if it has changed """
+        csv_stat = os.stat(csv_file)
+        csv_key = (os.path.abspath(csv_file), csv_stat.st_mtime, csv_stat.st_size)
+        if csv_key not in self.__csvs_digests:
+            self.__csvs_digests[csv_key] = self.__hash_cols(csv_file)
+        return self.__csvs_digests[csv_key]
+
+    def __get_col_selection(self, header, patient_codes):
+        """
+        the columns shown by a sheet, as MutationsReport selects them, or
+        None if a patient is not in the csv
+        """
+        if patient_codes is None:
+            return range(len(header))
+        pat_col_idxs = {}
+        for idx in xrange(len(header)-1, self.__n_master_cols-1, -1):
+            pat_col_idxs[header[idx].lower()] = idx
+        col_selection = range(min(self.__n_master_cols, len(header)))
+        for patient_code in patient_codes:
+            if patient_code.lower() not in pat_col_idxs:
+                return None
+            col_selection.append(pat_col_idxs[patient_code.lower()])
+        return col_selection
+
+    def get_fingerprint(self, sheet_name, csv_file, patient_codes):
+        """
+        return the sheet fingerprint, or None if the sheet cannot be cached
+        """
+        if is_stream(csv_file):
+            debug(csv_file + " is a stream, sheet " + sheet_name + " will not be cached")
+            return None
+        (header, rec_sizes_digest, col_digests) = self.__get_csv_digests(csv_file)
+        col_selection = self.__get_col_selection(header, patient_codes)
+        if col_selection is None:
+            return None
+        sheet_hash = hashlib.sha1(self.__options_digest)
+        sheet_hash.update('\0' + sheet_name + '\0' + repr(patient_codes) + '\0')
+        sheet_hash.update(rec_sizes_digest)
+        for col_idx in col_selection:
+            sheet_hash.update('\0' + header[col_idx] + '\0' + col_digests[col_idx])
+        return sheet_hash.hexdigest()
+
+    def __get_sheet_file(self, fingerprint):
+        return os.path.join(self.__cache_dir, fingerprint + self.FILE_EXT)
+
+    def has_sheet(self, fingerprint):
+        return os.path.isfile(self.__get_sheet_file(fingerprint))
+
+    def replay(self, ws, cell_fmt_mg, fingerprint):
+        cell_fmts = cell_fmt_mg.cell_fmts
+        # the unpickler reads a few bytes at a time, which GzipFile serves
+        # slowly. The calls take less memory than the sheet they write
+        with gzip.open(self.__get_sheet_file(fingerprint), 'rb') as gz_file:
+            in_file = cStringIO.StringIO(gz_file.read())
+            unpickler = cPickle.Unpickler(in_file)
+            while True:
+                try:
+                    calls = unpickler.load()
+                except EOFError:
+                    break
+                for (name, args, fmt_idx) in calls:
+                    if fmt_idx >= 0:
+                        args = args[:fmt_idx] + (cell_fmts[args[fmt_idx]],) + args[fmt_idx+1:]
+                    getattr(ws, name)(*args)
+
+    @contextmanager
+    def record(self, ws, cell_fmt_mg, fingerprint):
+        """ record the sheet, it is stored only if it is completely written """
+        (fd, tmp_file_name) = tempfile.mkstemp(suffix=self.FILE_EXT+'.tmp',
+                                               dir=self.__cache_dir)
+        os.close(fd)
+        try:
+            with gzip.open(tmp_file_name, 'wb', 1) as out_file:
+                recorder = SheetRecorder(ws, cell_fmt_mg, out_file)
+                yield recorder
+                recorder.flush()
+            os.rename(tmp_file_name, self.__get_sheet_file(fingerprint))
+            debug(recorder)
+        finally:
+            if os.path.isfile(tmp_file_name):
+                os.remove(tmp_file_name)
+
 class MutationsReport(MutationsReportBase):
     """ A class to handle a mutations report """
 
@@ -974,11 +1411,29 @@ class MutationsReport(MutationsReportBase):
                  n_master_cols,
                  sheet_name,
                  color_region_infos=[],
-                 freq_ratios=[]):
+                 freq_ratios=[],
+                 patient_codes=None,
+                 master_cache=False):
         self.__file_name = file_name
         self.__n_master_cols = n_master_cols
         self.__sheet_name = sheet_name
         self.__freq_ratios = freq_ratios
+        self.__master_data = None
+        if master_cache:
+            self.__master_data = MasterDataCache.load(file_name)
+        if self.__master_data is not None:
+            (self.__csvfile, self.__csv_reader) = (None, None)
+            full_header_rec = self.__master_data.header
+            debug(self.__master_data)
+        else:
+            (self.__csvfile,
+             self.__csv_reader,
+             full_header_rec) = self.__open_csv()
+        self.__init_col_selection(full_header_rec, patient_codes)
+        if self.__col_selection is None:
+            self.__raw_header_rec = full_header_rec
+        else:
+            self.__raw_header_rec = [full_header_rec[i] for i in self.__col_selection]
         self.__col_idx_mg = MutationRecordIndexManager(self.raw_header_rec)
         self.__pred_tran = PredictionTranslator()
         self.__load_color_region_infos(color_region_infos)
@@ -1019,30 +1474,90 @@ class MutationsReport(MutationsReportBase):
     def header_rec(self):
         return MutationHeaderRecord(self.raw_header_rec, self.__n_master_cols, self.__col_idx_mg)
 
+    def __init_col_selection(self, header, patient_codes):
+        """ select the master columns and the zygosities of patient_codes """
+        self.__col_selection = None
+        if patient_codes is None:
+            return
+        pat_col_idxs = {}
+        for idx in xrange(len(header)-1, self.__n_master_cols-1, -1):
+            pat_col_idxs[header[idx].lower()] = idx
+        col_selection = range(self.__n_master_cols)
+        for patient_code in patient_codes:
+            if patient_code.lower() not in pat_col_idxs:
+                throw("patient " + patient_code + " cannot be found in " + self.__file_name)
+            col_selection.append(pat_col_idxs[patient_code.lower()])
+        self.__col_selection = col_selection
+
+    def __select_cols(self, raw_rec):
+        rec = [raw_rec[i] if i < len(raw_rec) else '' for i in self.__col_selection]
+        for zygo in rec[self.__n_master_cols:]:
+            if zygo in UNCALLED_ZYGOS:
+                rec[self.__n_master_cols:] = [''] * (len(rec)-self.__n_master_cols)
+                break
+        return rec
+
+    def __iter_raw_recs(self):
+        """ yield (raw record, typed frequencies) """
+        if self.__master_data is not None:
+            zygo_start = None
+            if self.__col_selection is not None:
+                zygo_start = self.__n_master_cols
+            for rec in self.__master_data.iter_recs(self.__col_selection, zygo_start):
+                yield rec
+            return
+        # the header has already been consumed from the opened csv, a stream
+        # can therefore be read only once while a file can be reopened
+        if self.__csv_reader is None:
+            if is_stream(self.__file_name):
+                throw("mutations of " + self.__file_name + " can be read only once")
+            (self.__csvfile, self.__csv_reader, raw_header_rec) = self.__open_csv()
+        csvfile = self.__csvfile
+        csv_reader = self.__csv_reader
+        self.__csvfile = None
+        self.__csv_reader = None
+        with csvfile:
+            for raw_rec in csv_reader:
+                if self.__col_selection is not None:
+                    raw_rec = self.__select_cols(raw_rec)
+                yield (raw_rec, None)
+            csvfile.close()
+
+    def __open_csv(self):
+        csvfile = open_input(self.__file_name)
+        csv_reader = csv.reader(csvfile, delimiter='\t')
+        raw_header_rec = csv_reader.next()
+        return (csvfile, csv_reader, raw_header_rec)
+
     @property
     def raw_header_rec(self):
-        with open(self.__file_name, 'rb') as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter='\t')
-            raw_header_rec = csv_reader.next()
-            csvfile.close()
-        return raw_header_rec
+        return self.__raw_header_rec
 
     @property
     def mut_recs(self):
         self.__priority_regions.init_comparison()
-        with open(self.__file_name, 'rb') as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter='\t')
-            csv_reader.next()
-            for raw_rec in csv_reader:
-                mut_rec = MutationContentRecord(raw_rec,
-                                                n_master_cols,
-                                                self.__col_idx_mg,
-                                                pred_tran=self.__pred_tran,
-                                                freq_ratios=self.__freq_ratios,
-                                                pat_grp_idxs=self.__pat_grp_idxs)
-                mut_rec.marked_color = self.__priority_regions.get_color(mut_rec.key)
-                yield(mut_rec)
-            csvfile.close()
+        raw_recs = self.__iter_raw_recs()
+        while True:
+            start_time = time.time()
+            try:
+                (raw_rec, typed_freqs) = raw_recs.next()
+            except StopIteration:
+                break
+            parsed_time = time.time()
+            mut_rec = MutationContentRecord(raw_rec,
+                                            n_master_cols,
+                                            self.__col_idx_mg,
+                                            pred_tran=self.__pred_tran,
+                                            freq_ratios=self.__freq_ratios,
+                                            pat_grp_idxs=self.__pat_grp_idxs,
+                                            typed_freqs=typed_freqs)
+            annotated_time = time.time()
+            mut_rec.marked_color = self.__priority_regions.get_color(mut_rec.key)
+            metrics.add_time(STAGE_PARSE, parsed_time-start_time)
+            metrics.add_time(STAGE_ANNOTATE, annotated_time-parsed_time)
+            metrics.add_time(STAGE_COLOR, time.time()-annotated_time)
+            metrics.count(ROWS_READ)
+            yield(mut_rec)
 
     @property
     def mut_regs(self):
@@ -1239,7 +1754,7 @@ argp.add_argument('-A', dest='addn_csvs',
                         metavar='ADDITIONAL_CSVS',
                         help='list of addn informaion csv-format file in together with their name in comma and colon separators format',
                         default=None)
-argp.add_argument('-s', dest='csvs', metavar='CSV INFO', help='list of csv files together with their name in comma and colon separators format', required=True)
+argp.add_argument('-s', dest='csvs', metavar='CSV INFO', help='list of csv files (plain text or gzip/BGZF compressed, named pipes or \'-\' for stdin) together with their name in comma and colon separators format. A sheet can show only some patients, and only their commonly called zygosities, by adding their codes <name,csv,patient_1|patient_2|..>', required=True)
 argp.add_argument('-N', dest='n_master_cols', type=int, metavar='COLUMN COUNT', help='number of master data columns', required=True)
 argp.add_argument('-R', dest='marked_key_range', metavar='KEY RANGES', help='regions to be marked', default=None)
 argp.add_argument('-F', dest='frequency_ratios', metavar='NAME-FREQ PAIRS', help='name of columns to be filtered and their frequencies <name_1:frequency_1,name_2:frequency_2,..> (for example, -F OAF:0.2,1000G:0.1)', default=None)
@@ -1251,6 +1766,22 @@ argp.add_argument('-C', dest='color_region_infos',
                         metavar='COLOR REGIONS',
                         help='color information of each region of interest',
                         default=None)
+argp.add_argument('--master-cache', dest='master_cache',
+                        action='store_true',
+                        help='keep a binary copy of the csvs next to them (<csv>' + MasterDataCache.DIR_EXT + ') and use it instead of parsing the csvs again',
+                        default=False)
+argp.add_argument('--sheet-cache', dest='sheet_cache_dir',
+                        metavar='DIRECTORY',
+                        help='directory to keep the generated mutations sheets, a sheet whose csv content and options are unchanged is reused instead of being computed again',
+                        default=None)
+argp.add_argument('--metrics', dest='metrics_file',
+                        metavar='FILE',
+                        help='write wall/CPU time of each stage and each sheet, rows and cells counts and peak memory usage to FILE in JSON format',
+                        default=None)
+argp.add_argument('--profile', dest='profile',
+                        action='store_true',
+                        help='dump cProfile statistics of each stage next to the metrics file (or the output xls file) as <file>[.<sheet>].<stage>.prof',
+                        default=False)
 argp.add_argument('-D', dest='dev_mode',
                         action='store_true',
                         help='To enable development mode, this will effect the debuggin message and how the result is shown up',
@@ -1306,6 +1837,18 @@ color_region_infos = []
 if args.color_region_infos is not None:
     for info in args.color_region_infos.split(','):
         color_region_infos.append(ColorRegionRecord(info))
+master_cache = args.master_cache
+sheet_cache_dir = args.sheet_cache_dir
+metrics_file = args.metrics_file
+profile_prefix = None
+if args.profile:
+    if metrics_file is not None:
+        profile_prefix = metrics_file
+    else:
+        profile_prefix = out_file
+metrics = ReportMetrics(script_name,
+                        enabled=metrics_file is not None,
+                        profile_prefix=profile_prefix)
 dev_mode = args.dev_mode
 log_file = open(args.log_file, "a+")
 #coding_only = args.coding_only
@@ -1342,6 +1885,16 @@ def throw(err_msg):
     write_log(formated_msg)
     raise Exception(formated_msg)
 
+def parse_csv_info(csv_info):
+    """ return (sheet name, csv file, patient codes or None) """
+    csv_info_items = csv_info.split(',')
+    if len(csv_info_items) > 2:
+        return (csv_info_items[0],
+                csv_info_items[1],
+                csv_info_items[2].split(PATIENT_CODES_SEP))
+    (sheet_name, sheet_csv) = csv_info_items
+    return (sheet_name, sheet_csv, None)
+
 def new_section_txt(txt):
     info("")
     info(txt.center(140,"*"))
@@ -1376,9 +1929,11 @@ info("")
 ## display csvs configuration
 disp_header("csvs configuration (-s)(" + str(len(csvs_list)) + " sheet(s))")
 for i in xrange(len(csvs_list)):
-    (sheet_name, sheet_csv) = csvs_list[i].split(',')
+    (sheet_name, sheet_csv, patient_codes) = parse_csv_info(csvs_list[i])
     disp_param("sheet name #"+str(i+1), sheet_name)
     disp_param("sheet csv  #"+str(i+1), sheet_csv)
+    if patient_codes is not None:
+        disp_param("sheet patients #"+str(i+1), ",".join(patient_codes))
 info("")
 
 ## display optional configuration
@@ -1417,6 +1972,14 @@ if len(color_region_infos) > 0:
     for i in xrange(len(color_region_infos)):
         color_region_info = color_region_infos[i]
         disp_subparam("color info #"+str(i+1), color_region_info.raw_info)
+if master_cache:
+    disp_param("master data cache (--master-cache)", "ON")
+if sheet_cache_dir is not None:
+    disp_param("sheet cache directory (--sheet-cache)", sheet_cache_dir)
+if metrics_file is not None:
+    disp_param("metrics file (--metrics)", metrics_file)
+if profile_prefix is not None:
+    disp_param("profile files prefix (--profile)", profile_prefix)
 if dev_mode:
     disp_param("developer mode (-D)", "ON")
 
@@ -1576,11 +2139,19 @@ def write_content(ws,
         
 def add_sheet(wb, sheet_name):
     ws = wb.add_worksheet(sheet_name)
+    metrics.start_sheet(sheet_name, ws)
     ws.set_default_row(12)
     return ws
 
-def add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs):
+def add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs, fingerprint=None):
     ws = add_sheet(wb, muts_rep.sheet_name)
+    if fingerprint is None:
+        write_muts_sheet(ws, cell_fmt_mg, muts_rep, xtra_attribs)
+    else:
+        with sheet_cache.record(ws, cell_fmt_mg, fingerprint) as recorder:
+            write_muts_sheet(recorder, cell_fmt_mg, muts_rep, xtra_attribs)
+
+def write_muts_sheet(ws, cell_fmt_mg, muts_rep, xtra_attribs):
     #ws = wb.add_worksheet(muts_rep.sheet_name)
     ws.set_default_row(12)
     mut_rec_size = muts_rep.record_size
@@ -1599,6 +2170,7 @@ def add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs):
                 including = False
                 break
         if including:
+            start_time = time.time()
             write_content(ws,
                           cell_fmt_mg,
                           row,
@@ -1606,12 +2178,14 @@ def add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs):
                           mut_rec_size,
                           muts_rep.col_idx_mg,
                           xtra_attribs)
+            metrics.add_time(STAGE_WRITE, time.time()-start_time)
+            metrics.count(ROWS_WRITTEN)
             row += 1
     set_layout(ws, mut_rec_size+len(xtra_attribs), muts_rep.col_idx_mg) 
         
 def add_addn_csv_sheet(wb, dflt_cell_fmt, sheet_name, csv_file):
     ws = add_sheet(wb, sheet_name)
-    with open(csv_file, 'rb') as csvfile:
+    with open_input(csv_file) as csvfile:
         csv_recs = list(csv.reader(csvfile, delimiter='\t'))
         csv_row = 0
         for xls_row in xrange(len(csv_recs)):
@@ -1625,26 +2199,68 @@ def add_addn_csv_sheet(wb, dflt_cell_fmt, sheet_name, csv_file):
 # ****************************** main codes ******************************
 new_section_txt(" Generating report ")
 
+stdin_csvs = filter(lambda x: x.split(',')[1] == STDIN_NAME,
+                    csvs_list + addn_csvs_list)
+if len(stdin_csvs) > 1:
+    throw("only one csv can be read from stdin (" + STDIN_NAME + ")")
+
+sheet_cache = None
+if sheet_cache_dir is not None:
+    # every option that changes how a mutations sheet looks
+    sheet_options = [('N', n_master_cols),
+                     ('F', frequency_ratios),
+                     ('C', args.color_region_infos),
+                     ('K', sorted(cell_colors.items())),
+                     ('Z', ZYGO_CODES.items()),
+                     ('E', xtra_attribs),
+                     ('i', inc_criteria),
+                     ]
+    sheet_cache = SheetCache(sheet_cache_dir, sheet_options, n_master_cols)
+    debug(sheet_cache)
+
 wb = xlsxwriter.Workbook(out_file)
 cell_fmt_mg = CellFormatManager(wb, COLOR_RGB)
 dflt_cell_fmt = cell_fmt_mg.default_format
 debug(cell_fmt_mg)
 
 for main_csv in csvs_list:
-    (sheet_name, sheet_csv) = main_csv.split(',')
-    muts_rep = MutationsReport(file_name=sheet_csv,
-                               n_master_cols=n_master_cols,
-                               sheet_name=sheet_name,
-                               color_region_infos=color_region_infos,
-                               freq_ratios=frequency_ratios)
+    metrics.end_sheet()
+    (sheet_name, sheet_csv, patient_codes) = parse_csv_info(main_csv)
+    fingerprint = None
+    if sheet_cache is not None:
+        fingerprint = sheet_cache.get_fingerprint(sheet_name,
+                                                  sheet_csv,
+                                                  patient_codes)
+        if (fingerprint is not None) and sheet_cache.has_sheet(fingerprint):
+            info("reusing cached mutations sheet: " + sheet_name + " (" + fingerprint + ")")
+            ws = add_sheet(wb, sheet_name)
+            with metrics.stage(STAGE_REPLAY):
+                sheet_cache.replay(ws, cell_fmt_mg, fingerprint)
+            continue
+    with metrics.stage(STAGE_OPEN):
+        muts_rep = MutationsReport(file_name=sheet_csv,
+                                   n_master_cols=n_master_cols,
+                                   sheet_name=sheet_name,
+                                   color_region_infos=color_region_infos,
+                                   freq_ratios=frequency_ratios,
+                                   patient_codes=patient_codes,
+                                   master_cache=master_cache)
     debug(muts_rep)
     info("adding mutations sheet: " + sheet_name)
-    add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs)
+    with metrics.stage(STAGE_SHEET):
+        add_muts_sheet(wb, cell_fmt_mg, muts_rep, xtra_attribs, fingerprint)
 
 for addn_csv in addn_csvs_list:
     (sheet_name, sheet_csv) = addn_csv.split(',')
-    add_addn_csv_sheet(wb, dflt_cell_fmt, sheet_name, sheet_csv)
+    with metrics.stage(STAGE_ADDN_SHEET):
+        add_addn_csv_sheet(wb, dflt_cell_fmt, sheet_name, sheet_csv)
+metrics.end_sheet()
+
+with metrics.stage(STAGE_CLOSE):
+    wb.close()
 
-wb.close()
+if metrics_file is not None:
+    metrics.write(metrics_file)
+    info("metrics are written to " + metrics_file)
 
 new_section_txt(" F I N I S H <" + script_name + "> ")
@@ -1,14 +1,36 @@
 from collections import OrderedDict
 from collections import defaultdict
+from collections import deque
 import sys
 import csv
 import xlsxwriter
 import ntpath
 import datetime
+import time
+import os
+import multiprocessing
 
 import argparse
+import bisect
+import numpy as np
+
+from cmm_io import open_input
+from cmm_io import open_output
+from cmm_io import is_stream
+from cmm_io import is_gzip_file
+from cmm_plink import get_chrom_code
+from cmm_plink import get_snps_info
+from cmm_plink import parse_region
+from cmm_plink import read_pheno_file
+from cmm_plink import PlinkBedReader
+from cmm_plink import SNPS_INFO_HEADER
+from cmm_metrics import ReportMetrics
+from cmm_metrics import ROWS_READ
+from cmm_metrics import ROWS_WRITTEN
+from xlsxwriter.format import Format
 
 # ****************************** define constants ******************************
+IDX_COL_HAPASSOC_LOCUS   = 0
 IDX_COL_HAPASSOC_HAPLO   = 1
 IDX_COL_HAPASSOC_F_A     = 2
 IDX_COL_HAPASSOC_F_U     = 3
@@ -17,8 +39,10 @@ IDX_COL_HAPASSOC_OR      = 5
 IDX_COL_HAPASSOC_P_VALUE = 7
 IDX_COL_HAPASSOC_SNPS    = 8
 HAPLO_INFO_SIZE          = 5
+STAT_NA = 'NA'
 
 IDX_COL_MAP_MARKER = 1
+IDX_COL_MAP_POS = 3
 
 IDX_COL_PED_FAM_ID = 0
 IDX_COL_PED_INDV_ID = 1
@@ -31,6 +55,44 @@ IDX_COL_SNP_POS = 4
 
 HAPLO_COL_WIDTH = 1.6
 
+DFLT_FAM_CACHE_MB = 512
+
+# genotypes are kept as allele codes, code 0 is a missing allele
+N_PLOIDY = 2
+MISSING_ALLELE = '0'
+MISSING_ALLELE_CODE = 0
+MAX_ALLELE_CODE = 255
+# code of the alleles, from haplotypes, which no family has
+UNKNOWN_ALLELE_CODE = -1
+# number of set bits of each byte value
+POPCOUNT_TABLE = np.array(map(lambda x: bin(x).count('1'), xrange(256)),
+                          dtype=np.uint8)
+# families and markers compared at a time by PlinkHaplosSharing
+SHARING_FAMS_BLOCK_SIZE = 64
+SHARING_MARKERS_BLOCK_SIZE = 8192
+
+STAGE_LOAD = 'load'
+STAGE_COMPARE = 'compare'
+STAGE_MASTER_SHEET = 'master_sheet'
+STAGE_COMPACT_FAM_SHEET = 'compact_fam_sheet'
+STAGE_FULL_FAM_SHEET = 'full_fam_sheet'
+STAGE_REPLAY_FAM_SHEETS = 'replay_fam_sheets'
+STAGE_REPORT_SHEET = 'report_sheet'
+STAGE_ADDN_SHEET = 'addn_sheet'
+STAGE_CLOSE = 'close'
+STAGE_EXPORT_MATCHES = 'export_matches'
+
+HAPLOS_MATCHES_HEADER = ['FAMILY',
+                         'PLOID',
+                         'LOCUS',
+                         'HAPLOTYPE',
+                         'P',
+                         'OR',
+                         'N_MARKERS',
+                         'FIRST_BP',
+                         'LAST_BP',
+                         ]
+
 COLOR_RGB = OrderedDict()
 COLOR_RGB['GREEN_ANNIKA'] = '#CCFFCC'
 COLOR_RGB['PINK_ANNIKA'] = '#E6B9B8'
@@ -74,6 +136,11 @@ COLOR_RGB['LIGHT_BLUE'] = '#ADD8E6'
 OTH_INDV_COLORS = ['ICEBLUE', 'ROYAL_BLUE']
 #OTH_INDV_COLORS = ['ICEBLUE', 'LIGHT_BLUE']
 DFLT_FMT = 'default_format'
+# the cell formats groups of CellFormatManager
+FMTS_NAMES = ['bp_fmts', 'stat_fmts', 'snp_fmts']
+
+FAM_WORKBOOK_FMT = "family_{fam_id}.xlsx"
+FAMS_BATCH_WORKBOOK_FMT = "families_{batch_no}.xlsx"
 
 script_name = ntpath.basename(sys.argv[0])
 
@@ -118,6 +185,7 @@ class CellFormatManager(PlinkBase):
         self.__dflt_hash_fmt = {'font_name': 'Arial', 'font_size': 9}
         self.__dflt_fmt = self.__add_fmt(self.__dflt_hash_fmt)
         self.__init_colors_formats()
+        self.__fmt_keys = None
 
     def get_raw_repr(self):
         return {"color dict": self.__color_dict,
@@ -169,15 +237,101 @@ class CellFormatManager(PlinkBase):
     def snp_fmts(self):
         return self.__snp_fmts
 
+    @property
+    def fmt_keys(self):
+        """
+        map each cell format back to its (formats group, key), the default
+        format has no group
+        """
+        if self.__fmt_keys is None:
+            self.__fmt_keys = {self.__dflt_fmt: (None, None)}
+            for fmts_name in FMTS_NAMES:
+                fmts = getattr(self, fmts_name)
+                for fmt_key in fmts:
+                    self.__fmt_keys[fmts[fmt_key]] = (fmts_name, fmt_key)
+        return self.__fmt_keys
+
+    def get_fmt(self, fmt_key):
+        (fmts_name, key) = fmt_key
+        if fmts_name is None:
+            return self.__dflt_fmt
+        return getattr(self, fmts_name)[key]
+
+class SheetPayloadRecorder(PlinkBase):
+    """
+    A stand-in worksheet for the family sheets workers. Nothing is written,
+    every call is kept, with the cell format replaced by its key, as the
+    payload of the sheet which the main process replays into the workbook
+    """
+
+    # read by count_ws_cells(), a recorded sheet has no cell table
+    table = None
+
+    def __init__(self, sheet_name, cell_fmt_mg):
+        self.__sheet_name = sheet_name
+        self.__fmt_keys = cell_fmt_mg.fmt_keys
+        self.__calls = []
+
+    def get_raw_repr(self):
+        return {"sheet name": self.__sheet_name,
+                "number of calls": len(self.__calls),
+                }
+
+    @property
+    def sheet_name(self):
+        return self.__sheet_name
+
+    @property
+    def calls(self):
+        return self.__calls
+
+    def __record(self, name, args):
+        fmt_idx = -1
+        for idx in xrange(len(args)):
+            if isinstance(args[idx], Format):
+                fmt_idx = idx
+                args = args[:idx] + (self.__fmt_keys[args[idx]],) + args[idx+1:]
+                break
+        self.__calls.append((name, args, fmt_idx))
+
+    def write(self, *args):
+        self.__record('write', args)
+
+    def __getattr__(self, name):
+        def record_call(*args):
+            self.__record(name, args)
+        return record_call
+
+class SheetsPayloadWorkbook(PlinkBase):
+    """ A stand-in workbook which gives out SheetPayloadRecorder sheets """
+
+    def __init__(self, cell_fmt_mg):
+        self.__cell_fmt_mg = cell_fmt_mg
+        self.__sheets = []
+
+    def get_raw_repr(self):
+        return {"sheets": map(lambda x: x.sheet_name, self.__sheets)}
+
+    def add_worksheet(self, sheet_name):
+        ws = SheetPayloadRecorder(sheet_name, self.__cell_fmt_mg)
+        self.__sheets.append(ws)
+        return ws
+
+    @property
+    def sheets_payload(self):
+        """ (sheet name, calls) of every sheet, in the order they are added """
+        return map(lambda x: (x.sheet_name, x.calls), self.__sheets)
+
 class PlinkPedRecord(PlinkBase):
     """ A class to parse information for each record in Pedigree file """
 
     def __init__(self, data):
         self.__data = data
-        self.__gts = None
+        self.__gt_tensor = None
+        self.__fam_idx = None
 
     def get_raw_repr(self):
-        return {"raw data": self.__data,
+        return {"raw data": self.__data[:6],
                 "family ID": self.fam_id,
                 "displayed ID": self.displayed_id,
                 "individual ID": self.indv_id,
@@ -204,19 +358,32 @@ class PlinkPedRecord(PlinkBase):
 
     @property
     def gts(self):
-        if self.__gts is None:
-            return self.__data[6:len(self.__data)]
-        else:
-            return self.__gts
+        return self.__data[6:len(self.__data)]
+
+    @property
+    def gt_tensor(self):
+        return self.__gt_tensor
+
+    @property
+    def fam_idx(self):
+        """ index of the family in the genotype tensor """
+        return self.__fam_idx
+
+    @property
+    def gt_codes(self):
+        """ markers x ploidy allele codes of the family """
+        return self.__gt_tensor.get_fam_codes(self.__fam_idx)
+
+    def set_gt_tensor(self, gt_tensor, fam_idx):
+        # the raw genotypes are not needed anymore once they are encoded
+        self.__gt_tensor = gt_tensor
+        self.__fam_idx = fam_idx
+        self.__data = self.__data[:6]
 
     @property
     def n_color_regions(self):
         return self.color_regions.n_regions
 
-    @gts.setter
-    def gts(self, value):
-        self.__gts = value
-
     def info_color_regions(self):
         info_fmt = ">>>>{chrom:>3}:{start_pos:>10} - {end_pos:>9} : {color}"
         info(">> There are " + str(self.n_color_regions) + " color region(s)")
@@ -231,23 +398,62 @@ class PlinkPedManager(PlinkBase):
 
     def __init__(self, file_name):
         self.__file_name = file_name
-        self.__fam_ids = map(lambda x: x.fam_id, self.fam_infos)
+        self.__build_fam_index()
 
     def get_raw_repr(self):
         return {"ped file name": self.__file_name,
+                "number of families": len(self.__fam_ids),
+                "indexed by": "lines" if self.__fam_lines is not None else "byte offsets",
                 }
+
+    def __build_fam_index(self):
+        """
+        map each family ID to the (byte offset, length) of its line so that
+        a family can be read with one seek. Compressed files and streams
+        cannot be seeked, their lines are kept instead
+        """
+        self.__fam_ids = []
+        self.__fam_offsets = {}
+        self.__fam_lines = None
+        if is_stream(self.__file_name) or is_gzip_file(self.__file_name):
+            self.__fam_lines = {}
+        offset = 0
+        with open_input(self.__file_name) as in_file:
+            for line in in_file:
+                metrics.count(ROWS_READ)
+                # a pedigree line has no quoted fields, its family ID is
+                # simply its first column
+                fam_id = line.split('\t', 1)[0]
+                self.__fam_ids.append(fam_id)
+                if fam_id not in self.__fam_offsets:
+                    self.__fam_offsets[fam_id] = (offset, len(line))
+                    if self.__fam_lines is not None:
+                        self.__fam_lines[fam_id] = line
+                offset += len(line)
+            in_file.close()
+
+    def __parse_line(self, line):
+        return PlinkPedRecord(csv.reader([line], delimiter='\t').next())
+
     @property
     def fam_infos(self):
-        with open(self.__file_name, 'rb') as csvfile:
+        with open_input(self.__file_name) as csvfile:
             csv_reader = csv.reader(csvfile, delimiter='\t')
             for raw_fam_info in csv_reader:
+                metrics.count(ROWS_READ)
                 yield(PlinkPedRecord(raw_fam_info))
             csvfile.close()
 
     def get_fam_info(self, fam_id):
-        for fam_info in self.fam_infos:
-            if fam_info.fam_id == fam_id:
-                return fam_info
+        if fam_id not in self.__fam_offsets:
+            return None
+        metrics.count(ROWS_READ)
+        if self.__fam_lines is not None:
+            return self.__parse_line(self.__fam_lines[fam_id])
+        (offset, length) = self.__fam_offsets[fam_id]
+        with open(self.__file_name, 'rb') as in_file:
+            in_file.seek(offset)
+            return self.__parse_line(in_file.read(length))
 
     @property
     def fam_ids(self):
@@ -259,6 +465,7 @@ class PlinkMapManager(PlinkBase):
     def __init__(self, file_name):
         self.__file_name = file_name
         self.__markers = []
+        self.__positions = []
         self.__load_markers()
 
     def get_raw_repr(self):
@@ -272,30 +479,565 @@ class PlinkMapManager(PlinkBase):
     def __getitem__(self, key):
         return self.__markers[key]
 
+    @property
+    def markers(self):
+        return self.__markers
+
+    @property
+    def positions(self):
+        return self.__positions
+
     def __load_markers(self):
         del self.__markers[:]
-        with open(self.__file_name, 'rb') as csvfile:
+        del self.__positions[:]
+        with open_input(self.__file_name) as csvfile:
             csv_reader = csv.reader(csvfile, delimiter='\t')
             for marker_info in csv_reader:
+                metrics.count(ROWS_READ)
                 self.__markers.append(marker_info[IDX_COL_MAP_MARKER])
+                self.__positions.append(int(marker_info[IDX_COL_MAP_POS]))
             csvfile.close()
 
+class PlinkGTTensor(PlinkBase):
+    """
+    Genotypes of all families as a families x markers x ploidy array of
+    allele codes, with the table of the alleles of the codes and the column
+    of each marker.
+
+    With bit_packed, the markers of each family ploid are packed into bit
+    planes instead: a called plane, and the planes of the index of the
+    allele among the alleles seen at the marker, one plane for two-allele
+    markers. The allele codes of a family are decoded on request and kept
+    in an LRU bounded by fam_cache_mb, the pinned families are kept outside
+    of it
+    """
+
+    def __init__(self,
+                 markers,
+                 n_fams,
+                 bit_packed=False,
+                 fam_cache_mb=DFLT_FAM_CACHE_MB):
+        self.__markers = markers
+        self.__marker_cols = {}
+        for col in xrange(len(markers)):
+            self.__marker_cols[markers[col]] = col
+        self.__alleles = [MISSING_ALLELE]
+        self.__allele_codes = {MISSING_ALLELE: MISSING_ALLELE_CODE}
+        # each distinct "A B" genotype string is split only once
+        self.__gt_idxs = {}
+        self.__gt_code_pairs = []
+        self.__gt_code_pairs_array = None
+        self.__n_fams = n_fams
+        self.__bit_packed = bit_packed
+        if bit_packed:
+            # the planes are bytes arrays padded to 64-bit words
+            n_bytes = (len(markers)+63) / 64 * 8
+            self.__called_bits = np.zeros((n_fams, N_PLOIDY, n_bytes),
+                                          dtype=np.uint8)
+            self.__allele_bits = np.zeros((n_fams, N_PLOIDY, 1, n_bytes),
+                                          dtype=np.uint8)
+            self.__marker_alleles = np.zeros((len(markers), 2),
+                                             dtype=np.uint8)
+            self.__codes = None
+        else:
+            self.__codes = np.zeros((n_fams, len(markers), N_PLOIDY),
+                                    dtype=np.uint8)
+        # decoded families, least recently used first
+        self.__fam_cache = OrderedDict()
+        self.__fam_cache_limit = fam_cache_mb * 1024 * 1024
+        self.__fam_cache_used = 0
+        self.__pinned_fam_idxs = set()
+        self.__pinned_fams_codes = {}
+        self.__fam_cache_hits = 0
+        self.__fam_cache_misses = 0
+
+    def get_raw_repr(self):
+        return {"number of families": self.__n_fams,
+                "number of markers": len(self.__markers),
+                "alleles": self.__alleles,
+                "bit packed": self.__bit_packed,
+                "size (bytes)": self.nbytes,
+                "family cache limit (bytes)": self.__fam_cache_limit,
+                "family cache used (bytes)": self.__fam_cache_used,
+                "cached families": len(self.__fam_cache),
+                "pinned families": sorted(self.__pinned_fam_idxs),
+                "family cache hits": self.__fam_cache_hits,
+                "family cache misses": self.__fam_cache_misses,
+                }
+
+    @property
+    def nbytes(self):
+        if self.__bit_packed:
+            return self.__called_bits.nbytes + self.__allele_bits.nbytes
+        return self.__codes.nbytes
+
+    @property
+    def bit_packed(self):
+        return self.__bit_packed
+
+    @property
+    def n_fams(self):
+        return self.__n_fams
+
+    @property
+    def codes(self):
+        """ the whole families x markers x ploidy array, if not bit packed """
+        return self.__codes
+
+    @property
+    def called_bits(self):
+        """ families x ploidy x bytes called planes, if bit packed """
+        return self.__called_bits
+
+    @property
+    def allele_bits(self):
+        """ families x ploidy x planes x bytes allele planes, if bit packed """
+        return self.__allele_bits
+
+    @property
+    def markers(self):
+        return self.__markers
+
+    @property
+    def alleles(self):
+        """ allele of each code """
+        return self.__alleles
+
+    def __get_allele_code(self, allele):
+        if allele not in self.__allele_codes:
+            if len(self.__alleles) > MAX_ALLELE_CODE:
+                throw("too many distinct alleles in the genotyping data")
+            self.__allele_codes[allele] = len(self.__alleles)
+            self.__alleles.append(allele)
+        return self.__allele_codes[allele]
+
+    def __add_gt(self, gt):
+        alleles = gt.split(" ")[:N_PLOIDY]
+        alleles += [MISSING_ALLELE] * (N_PLOIDY-len(alleles))
+        self.__gt_idxs[gt] = len(self.__gt_code_pairs)
+        self.__gt_code_pairs.append(map(self.__get_allele_code, alleles))
+        self.__gt_code_pairs_array = None
+
+    def set_fam_gts(self, fam_idx, gts):
+        """ encode the raw "A B" genotypes, one per marker, of a family """
+        n_markers = len(self.__markers)
+        if len(gts) < n_markers:
+            throw("family #" + str(fam_idx+1) + " has " + str(len(gts)) + " genotypes but there are " + str(n_markers) + " markers")
+        gts = gts[:n_markers]
+        try:
+            gt_idxs = map(self.__gt_idxs.__getitem__, gts)
+        except KeyError:
+            for gt in set(gts):
+                if gt not in self.__gt_idxs:
+                    self.__add_gt(gt)
+            gt_idxs = map(self.__gt_idxs.__getitem__, gts)
+        if self.__gt_code_pairs_array is None:
+            self.__gt_code_pairs_array = np.array(self.__gt_code_pairs,
+                                                  dtype=np.uint8)
+        if self.__bit_packed:
+            self.__pack_fam_codes(fam_idx, self.__gt_code_pairs_array[gt_idxs])
+        else:
+            self.__codes[fam_idx] = self.__gt_code_pairs_array[gt_idxs]
+
+    def __pack_bits(self, is_set):
+        n_bytes = self.__called_bits.shape[-1]
+        bits = np.packbits(is_set)
+        return np.append(bits, np.zeros(n_bytes-len(bits), dtype=np.uint8))
+
+    def __unpack_bits(self, bits):
+        return np.unpackbits(bits, axis=-1)[..., :len(self.__markers)]
+
+    def __add_allele_plane(self):
+        """ double the number of alleles each marker can have """
+        marker_alleles = self.__marker_alleles
+        self.__marker_alleles = np.append(marker_alleles,
+                                          np.zeros_like(marker_alleles),
+                                          axis=1)
+        allele_bits = self.__allele_bits
+        self.__allele_bits = np.append(allele_bits,
+                                       np.zeros_like(allele_bits[:, :, :1]),
+                                       axis=2)
+
+    def __get_marker_allele_idxs(self, codes):
+        """ index of each called allele among the alleles of its marker """
+        allele_idxs = np.zeros(len(codes), dtype=np.uint8)
+        is_pending = codes != MISSING_ALLELE_CODE
+        allele_idx = 0
+        while is_pending.any():
+            if allele_idx == self.__marker_alleles.shape[1]:
+                self.__add_allele_plane()
+            marker_alleles = self.__marker_alleles[:, allele_idx]
+            is_new = is_pending & (marker_alleles == MISSING_ALLELE_CODE)
+            marker_alleles[is_new] = codes[is_new]
+            is_found = is_pending & (marker_alleles == codes)
+            allele_idxs[is_found] = allele_idx
+            is_pending &= ~is_found
+            allele_idx += 1
+        return allele_idxs
+
+    def __pack_fam_codes(self, fam_idx, fam_codes):
+        for ploid_idx in xrange(N_PLOIDY):
+            codes = fam_codes[:, ploid_idx]
+            allele_idxs = self.__get_marker_allele_idxs(codes)
+            self.__called_bits[fam_idx, ploid_idx] = self.__pack_bits(codes != MISSING_ALLELE_CODE)
+            for plane_idx in xrange(self.__allele_bits.shape[2]):
+                is_set = (allele_idxs >> plane_idx) & 1
+                self.__allele_bits[fam_idx, ploid_idx, plane_idx] = self.__pack_bits(is_set)
+
+    def pin_fam(self, fam_idx):
+        """ keep the decoded codes of a family used by every sheet """
+        self.__pinned_fam_idxs.add(fam_idx)
+
+    def get_fam_codes(self, fam_idx):
+        """
+        markers x ploidy allele codes of a family, they are shared between
+        the callers and must not be modified
+        """
+        if not self.__bit_packed:
+            return self.__codes[fam_idx]
+        if fam_idx in self.__pinned_fams_codes:
+            self.__fam_cache_hits += 1
+            return self.__pinned_fams_codes[fam_idx]
+        if fam_idx in self.__fam_cache:
+            self.__fam_cache_hits += 1
+            codes = self.__fam_cache.pop(fam_idx)
+            self.__fam_cache[fam_idx] = codes
+            return codes
+        self.__fam_cache_misses += 1
+        codes = self.__decode_fam_codes(fam_idx)
+        codes.flags.writeable = False
+        if fam_idx in self.__pinned_fam_idxs:
+            self.__pinned_fams_codes[fam_idx] = codes
+        else:
+            self.__cache_fam_codes(fam_idx, codes)
+        return codes
+
+    def __cache_fam_codes(self, fam_idx, codes):
+        if codes.nbytes > self.__fam_cache_limit:
+            return
+        while self.__fam_cache_used + codes.nbytes > self.__fam_cache_limit:
+            (old_fam_idx, old_codes) = self.__fam_cache.popitem(last=False)
+            self.__fam_cache_used -= old_codes.nbytes
+        self.__fam_cache[fam_idx] = codes
+        self.__fam_cache_used += codes.nbytes
+
+    def __decode_fam_codes(self, fam_idx):
+        is_called = self.__unpack_bits(self.__called_bits[fam_idx])
+        allele_idxs = np.zeros(is_called.shape, dtype=np.uint8)
+        for plane_idx in xrange(self.__allele_bits.shape[2]):
+            plane = self.__unpack_bits(self.__allele_bits[fam_idx, :, plane_idx])
+            allele_idxs |= plane << plane_idx
+        markers_idxs = np.arange(len(self.__markers))
+        codes = self.__marker_alleles[markers_idxs, allele_idxs]
+        codes[is_called == 0] = MISSING_ALLELE_CODE
+        return codes.T
+
+    def get_shared_bits(self, fam_idx, ploid_idx, ref_fam_idxs, ref_ploid_idx):
+        """
+        64-bit words of the markers at which a family ploid has the same
+        called allele as a ploid of each of ref_fam_idxs, if bit packed
+        """
+        called_bits = self.__called_bits.view(np.uint64)
+        allele_bits = self.__allele_bits.view(np.uint64)
+        shared_bits = called_bits[fam_idx, ploid_idx] & called_bits[ref_fam_idxs, ref_ploid_idx]
+        for plane_idx in xrange(allele_bits.shape[2]):
+            shared_bits &= ~(allele_bits[fam_idx, ploid_idx, plane_idx] ^
+                             allele_bits[ref_fam_idxs, ref_ploid_idx, plane_idx])
+        return shared_bits
+
+    def get_marker_cols(self, snp_codes):
+        """
+        return the indexes, in snp_codes, of the SNPs which are genotyped
+        together with their columns in the tensor
+        """
+        idxs = []
+        cols = []
+        marker_cols = self.__marker_cols
+        for idx in xrange(len(snp_codes)):
+            snp_code = snp_codes[idx]
+            if snp_code in marker_cols:
+                idxs.append(idx)
+                cols.append(marker_cols[snp_code])
+        return (idxs, np.array(cols, dtype=np.intp))
+
+    def get_allele_codes(self, alleles):
+        allele_codes = self.__allele_codes
+        return map(lambda x: allele_codes.get(x, UNKNOWN_ALLELE_CODE), alleles)
+
+class PlinkAssocHapMatcher(PlinkBase):
+    """
+    Match all the haplotypes of an assoc.hap file against the genotypes of
+    a family at once. The alleles of the haplotypes are kept as
+    (haplotype, allele code) entries in an inverted index from each
+    genotyped SNP, by its marker column, to the haplotypes containing it.
+    Only the entries at the markers where a family has a genotype are
+    compared, the other haplotypes cannot match the family anyway
+    """
+
+    def __init__(self, gt_tensor, assoc_hap_mg):
+        self.__gt_tensor = gt_tensor
+        self.__assoc_hap_mg = assoc_hap_mg
+        self.__haplos_info = assoc_hap_mg.haplos_info
+        self.__build_snps_index()
+        self.__fams_color_idxs = {}
+        self.__n_compared_entries = 0
+
+    def get_raw_repr(self):
+        return {"number of haplotypes": len(self.__haplos_info),
+                "number of alleles": len(self.__entry_haplos),
+                "number of indexed SNPs": len(self.__index_cols),
+                "number of matched families": len(self.__fams_color_idxs),
+                "number of compared alleles": self.__n_compared_entries,
+                }
+
+    @property
+    def haplos_info(self):
+        return self.__haplos_info
+
+    def __build_snps_index(self):
+        gt_tensor = self.__gt_tensor
+        # the empty arrays keep concatenate() working without haplotypes
+        entry_haplos = [np.zeros(0, dtype=np.intp)]
+        entry_cols = [np.zeros(0, dtype=np.intp)]
+        entry_codes = []
+        # the haplotypes of a window share their SNP list, whose markers
+        # are looked up once
+        snps_table_cols = map(gt_tensor.get_marker_cols,
+                              self.__assoc_hap_mg.snps_table)
+        snps_idxs = self.__assoc_hap_mg.snps_idxs
+        for haplo_idx in xrange(len(self.__haplos_info)):
+            bps = self.__haplos_info[haplo_idx].haplotype
+            (bp_idxs, marker_cols) = snps_table_cols[snps_idxs[haplo_idx]]
+            # Only the snps which present in family are compared,
+            # otherwise, exception will occur
+            if (len(bp_idxs) > 0) and (bp_idxs[-1] >= len(bps)):
+                n_bps = np.searchsorted(bp_idxs, len(bps))
+                (bp_idxs, marker_cols) = (bp_idxs[:n_bps], marker_cols[:n_bps])
+            entry_haplos.append(np.repeat(np.intp(haplo_idx), len(bp_idxs)))
+            entry_cols.append(marker_cols)
+            entry_codes += gt_tensor.get_allele_codes(map(lambda x: bps[x],
+                                                          bp_idxs))
+        entry_cols = np.concatenate(entry_cols)
+        # entries of the same SNP are contiguous, those of the SNP at
+        # self.__index_cols[i] are index_offsets[i]:index_offsets[i+1]
+        order = np.argsort(entry_cols, kind='mergesort')
+        entry_cols = entry_cols[order]
+        self.__entry_haplos = np.concatenate(entry_haplos)[order]
+        self.__entry_codes = np.array(entry_codes, dtype=np.int16)[order]
+        (self.__index_cols, index_starts) = np.unique(entry_cols,
+                                                      return_index=True)
+        self.__index_offsets = np.append(index_starts,
+                                         len(entry_cols)).astype(np.intp)
+        self.__index_lens = np.diff(self.__index_offsets)
+
+    def __get_snps_entries(self, snp_idxs):
+        """ indexes of the entries of the indexed SNPs at snp_idxs """
+        starts = self.__index_offsets[snp_idxs]
+        lens = self.__index_lens[snp_idxs]
+        # concatenated ranges starts[i]:starts[i]+lens[i]
+        lens_cumsum = np.cumsum(lens)
+        shifts = np.repeat(starts - (lens_cumsum-lens), lens)
+        return shifts + np.arange(lens_cumsum[-1] if len(lens) > 0 else 0)
+
+    def get_fam_matches(self, fam_info):
+        """
+        return haplotypes x family ploids arrays of whether the family
+        haplotype is similar to the haplotype, the number of markers compared
+        with it and the first and the last of their marker columns (-1 if it
+        is not matched). Similar means that
+        1 - each bp at the same marker is similar, which has an exception
+            in case that there is no bp info from the family
+        2 - with the exception from above, it has been compared at least once
+        The matches are not kept, see get_color_idxs
+        """
+        n_haplos = len(self.__haplos_info)
+        n_ploid = fam_info.n_ploid
+        fam_codes = fam_info.gt_codes[self.__index_cols]
+        is_matched = np.zeros((n_haplos, n_ploid), dtype=np.bool_)
+        n_markers = np.zeros((n_haplos, n_ploid), dtype=np.intp)
+        first_cols = np.repeat(np.intp(-1), n_haplos*n_ploid).reshape(n_haplos, n_ploid)
+        last_cols = np.repeat(np.intp(-1), n_haplos*n_ploid).reshape(n_haplos, n_ploid)
+        for ploid_idx in xrange(n_ploid):
+            ploid_codes = fam_codes[:, ploid_idx]
+            snp_idxs = np.flatnonzero(ploid_codes != MISSING_ALLELE_CODE)
+            entry_idxs = self.__get_snps_entries(snp_idxs)
+            self.__n_compared_entries += len(entry_idxs)
+            entry_haplos = self.__entry_haplos[entry_idxs]
+            entry_fam_codes = np.repeat(ploid_codes[snp_idxs],
+                                        self.__index_lens[snp_idxs])
+            is_mismatched = entry_fam_codes != self.__entry_codes[entry_idxs]
+            n_compared = np.bincount(entry_haplos, minlength=n_haplos)
+            n_mismatched = np.bincount(entry_haplos[is_mismatched],
+                                       minlength=n_haplos)
+            is_ploid_matched = (n_compared > 0) & (n_mismatched == 0)
+            is_matched[:, ploid_idx] = is_ploid_matched
+            n_markers[is_ploid_matched, ploid_idx] = n_compared[is_ploid_matched]
+            # marker columns of the entries of the matched haplotypes
+            is_matched_entry = is_ploid_matched[entry_haplos]
+            matched_haplos = entry_haplos[is_matched_entry]
+            matched_cols = np.repeat(self.__index_cols[snp_idxs],
+                                     self.__index_lens[snp_idxs])[is_matched_entry]
+            ploid_first_cols = np.repeat(np.intp(len(self.__gt_tensor.markers)),
+                                         n_haplos)
+            np.minimum.at(ploid_first_cols, matched_haplos, matched_cols)
+            ploid_last_cols = np.repeat(np.intp(-1), n_haplos)
+            np.maximum.at(ploid_last_cols, matched_haplos, matched_cols)
+            first_cols[is_ploid_matched, ploid_idx] = ploid_first_cols[is_ploid_matched]
+            last_cols[is_ploid_matched, ploid_idx] = ploid_last_cols[is_ploid_matched]
+        return (is_matched, n_markers, first_cols, last_cols)
+
+    def get_color_idxs(self, fam_info):
+        """
+        return, for each haplotype, the index of the first family haplotype
+        which is similar to it or -1, see get_fam_matches. Only these are
+        kept for each family
+        """
+        fam_id = fam_info.fam_id
+        if fam_id in self.__fams_color_idxs:
+            return self.__fams_color_idxs[fam_id]
+        is_matched = self.get_fam_matches(fam_info)[0]
+        if is_matched.shape[1] == 0:
+            color_idxs = np.repeat(np.int8(-1), is_matched.shape[0])
+        else:
+            color_idxs = np.argmax(is_matched, axis=1).astype(np.int8)
+            color_idxs[~is_matched.any(axis=1)] = -1
+        self.__fams_color_idxs[fam_id] = color_idxs
+        return color_idxs
+
+class PlinkHaplosSharing(PlinkBase):
+    """
+    The markers at which the haplotypes of every family share the called
+    allele of a haplotype of a reference (special) family, computed once
+    over the genotype tensor. The markers of each (family, ploid) x
+    (reference family, ploid) pair are kept as bits. A bit packed tensor
+    already is that compact, the shared markers of any pair are then
+    computed on request with bitwise operations over 64-bit words
+    """
+
+    def __init__(self, gt_tensor, ref_fam_idxs):
+        self.__gt_tensor = gt_tensor
+        self.__shared_bits = {}
+        if gt_tensor.bit_packed:
+            return
+        for ref_fam_idx in ref_fam_idxs:
+            self.__shared_bits[ref_fam_idx] = self.__get_shared_bits(ref_fam_idx)
+
+    def get_raw_repr(self):
+        return {"reference families": self.__shared_bits.keys(),
+                "size (bytes)": sum(map(lambda x: x.nbytes,
+                                        self.__shared_bits.values())),
+                }
+
+    def __get_shared_bits(self, ref_fam_idx):
+        codes = self.__gt_tensor.codes
+        (n_fams, n_markers, n_ploidy) = codes.shape
+        ref_codes = codes[ref_fam_idx]
+        shared_bits = np.zeros((n_fams, n_ploidy, n_ploidy, (n_markers+7)/8),
+                               dtype=np.uint8)
+        for start_idx in xrange(0, n_fams, SHARING_FAMS_BLOCK_SIZE):
+            end_idx = min(start_idx+SHARING_FAMS_BLOCK_SIZE, n_fams)
+            # families x ploidy x markers
+            fams_codes = codes[start_idx:end_idx].transpose(0, 2, 1)
+            is_called = fams_codes != MISSING_ALLELE_CODE
+            for ref_ploid_idx in xrange(n_ploidy):
+                is_shared = is_called & (fams_codes == ref_codes[:, ref_ploid_idx])
+                shared_bits[start_idx:end_idx, :, ref_ploid_idx] = np.packbits(is_shared, axis=-1)
+        return shared_bits
+
+    def get_shared_markers(self,
+                           fam_idx,
+                           ploid_idx,
+                           ref_fam_idx,
+                           ref_ploid_idx,
+                           marker_cols):
+        """
+        return if the two haplotypes have the same called allele at each
+        of marker_cols. Sharing is symmetric, either family can be one of
+        the reference families
+        """
+        if self.__gt_tensor.bit_packed:
+            bits = self.__gt_tensor.get_shared_bits(fam_idx,
+                                                    ploid_idx,
+                                                    ref_fam_idx,
+                                                    ref_ploid_idx).view(np.uint8)
+        elif ref_fam_idx in self.__shared_bits:
+            bits = self.__shared_bits[ref_fam_idx][fam_idx, ploid_idx, ref_ploid_idx]
+        elif fam_idx in self.__shared_bits:
+            bits = self.__shared_bits[fam_idx][ref_fam_idx, ref_ploid_idx, ploid_idx]
+        else:
+            codes = self.__gt_tensor.codes
+            fam_codes = codes[fam_idx, marker_cols, ploid_idx]
+            ref_codes = codes[ref_fam_idx, marker_cols, ref_ploid_idx]
+            return (fam_codes != MISSING_ALLELE_CODE) & (fam_codes == ref_codes)
+        return ((bits[marker_cols >> 3] >> (7 - (marker_cols & 7))) & 1).astype(bool)
+
+    def get_sharing_matrix(self):
+        """
+        number of markers at which each pair of (family, ploid) haplotypes,
+        in the order of the genotype tensor, have the same called allele
+        """
+        if self.__gt_tensor.bit_packed:
+            return self.__count_shared_bits()
+        codes = self.__gt_tensor.codes
+        (n_fams, n_markers, n_ploidy) = codes.shape
+        n_haplos = n_fams * n_ploidy
+        sharing_matrix = np.zeros((n_haplos, n_haplos), dtype=np.float64)
+        for start_idx in xrange(0, n_markers, SHARING_MARKERS_BLOCK_SIZE):
+            end_idx = min(start_idx+SHARING_MARKERS_BLOCK_SIZE, n_markers)
+            haplos_codes = codes[:, start_idx:end_idx].transpose(0, 2, 1)
+            haplos_codes = haplos_codes.reshape(n_haplos, end_idx-start_idx)
+            # two haplotypes share a marker when both have its allele
+            for allele_code in xrange(1, len(self.__gt_tensor.alleles)):
+                has_allele = (haplos_codes == allele_code).astype(np.float32)
+                sharing_matrix += np.dot(has_allele, has_allele.T)
+        return sharing_matrix.astype(np.int64)
+
+    def __count_shared_bits(self):
+        gt_tensor = self.__gt_tensor
+        n_fams = gt_tensor.n_fams
+        fam_idxs = np.arange(n_fams)
+        sharing_matrix = np.zeros((n_fams, N_PLOIDY, n_fams, N_PLOIDY),
+                                  dtype=np.int64)
+        for fam_idx in xrange(n_fams):
+            for ploid_idx in xrange(N_PLOIDY):
+                for ref_ploid_idx in xrange(N_PLOIDY):
+                    shared_bits = gt_tensor.get_shared_bits(fam_idx,
+                                                            ploid_idx,
+                                                            fam_idxs,
+                                                            ref_ploid_idx)
+                    n_shared = POPCOUNT_TABLE[shared_bits.view(np.uint8)].sum(axis=-1)
+                    sharing_matrix[fam_idx, ploid_idx, :, ref_ploid_idx] = n_shared
+        return sharing_matrix.reshape(n_fams*N_PLOIDY, n_fams*N_PLOIDY)
+
 class PlinkGTManager(PlinkBase):
     """ A manager class to handle PLINK genotyping data """
 
     def __init__(self,
                  gt_file_prefix,
                  special_fam_infos=[],
-                 color_region_infos=[]):
+                 color_region_infos=[],
+                 bit_packed=False,
+                 fam_cache_mb=DFLT_FAM_CACHE_MB):
         self.__gt_file_prefix = gt_file_prefix
+        self.__bit_packed = bit_packed
+        self.__fam_cache_mb = fam_cache_mb
         self.__map_mg = PlinkMapManager(gt_file_prefix + '.map')
         self.__ped_mg = PlinkPedManager(gt_file_prefix + '.ped')
         self.__load_special_fam_infos(special_fam_infos)
         self.__load_color_region_infos(color_region_infos)
+        self.__load_fam_infos()
+        self.__haplos_matchers = {}
+        ref_fam_idxs = map(lambda x: self.__fam_infos[x].fam_idx,
+                           filter(lambda x: x in self.__fam_infos,
+                                  self.special_fam_ids))
+        self.__haplos_sharing = PlinkHaplosSharing(self.__gt_tensor,
+                                                   ref_fam_idxs)
 
     def get_raw_repr(self):
         return {"genotyping file prefix": self.__gt_file_prefix,
                 "family IDs": self.fam_ids,
+                "genotype tensor": self.__gt_tensor,
+                "haplotypes sharing": self.__haplos_sharing,
                 }
 
     @property
@@ -306,6 +1048,24 @@ class PlinkGTManager(PlinkBase):
     def special_fam_ids(self):
         return self.__special_fam_infos.keys()
 
+    @property
+    def gt_tensor(self):
+        return self.__gt_tensor
+
+    @property
+    def marker_positions(self):
+        """ bp of each marker column of the genotype tensor """
+        return self.__map_mg.positions
+
+    @property
+    def haplos_sharing(self):
+        return self.__haplos_sharing
+
+    @property
+    def fam_infos(self):
+        """ one record of each family, in the order of the genotype tensor """
+        return sorted(self.__fam_infos.values(), key=lambda x: x.fam_idx)
+
     def __load_special_fam_infos(self, special_fam_infos):
         self.__special_fam_infos = {}
         for special_fam_info in special_fam_infos:
@@ -321,33 +1081,59 @@ class PlinkGTManager(PlinkBase):
             color_regions = self.__color_region_infos[fam_id]
             color_regions.sort_regions()
 
-    def map_gts_to_snps(self, fam_haplos, markers):
-        gts = {}
-        for idx in xrange(len(markers)):
-            gts[markers[idx]] = fam_haplos.gts[idx]
-        return gts
+    def __load_fam_infos(self):
+        """
+        decode the genotypes of every family, the first record of a family
+        ID, into the genotype tensor once
+        """
+        uniq_fam_ids = list(OrderedDict.fromkeys(self.fam_ids))
+        self.__gt_tensor = PlinkGTTensor(self.__map_mg.markers,
+                                          len(uniq_fam_ids),
+                                          bit_packed=self.__bit_packed,
+                                          fam_cache_mb=self.__fam_cache_mb)
+        self.__fam_infos = {}
+        for fam_idx in xrange(len(uniq_fam_ids)):
+            fam_id = uniq_fam_ids[fam_idx]
+            fam_info = self.__ped_mg.get_fam_info(fam_id)
+            self.__gt_tensor.set_fam_gts(fam_idx, fam_info.gts)
+            fam_info.set_gt_tensor(self.__gt_tensor, fam_idx)
+            if fam_id in self.__special_fam_infos:
+                # special families are used by every sheet
+                self.__gt_tensor.pin_fam(fam_idx)
+                fam_info.colors = self.__special_fam_infos[fam_id].colors
+            else:
+                fam_info.colors = OTH_INDV_COLORS
+            if fam_id in self.__color_region_infos:
+                fam_info.color_regions = self.__color_region_infos[fam_id]
+            else:
+                fam_info.color_regions = ColorRegions()
+            self.__fam_infos[fam_id] = fam_info
 
     def get_fam_info(self, fam_id):
-        fam_info = self.__ped_mg.get_fam_info(fam_id)
-        fam_info.gts = self.map_gts_to_snps(fam_info, self.__map_mg)
-        if fam_id in self.__special_fam_infos:
-            fam_info.colors = self.__special_fam_infos[fam_id].colors
-        else:
-            fam_info.colors = OTH_INDV_COLORS
-        if fam_id in self.__color_region_infos:
-            fam_info.color_regions = self.__color_region_infos[fam_id]
-        else:
-            fam_info.color_regions = ColorRegions()
-        return fam_info
+        """
+        family records share the genotype tensor, they must not be modified
+        """
+        return self.__fam_infos.get(fam_id)
+
+    def get_haplos_matcher(self, assoc_hap_mg):
+        """ a matcher is built once for each assoc.hap manager """
+        if assoc_hap_mg not in self.__haplos_matchers:
+            haplos_matcher = PlinkAssocHapMatcher(self.__gt_tensor,
+                                                  assoc_hap_mg)
+            debug(haplos_matcher)
+            self.__haplos_matchers[assoc_hap_mg] = haplos_matcher
+        return self.__haplos_matchers[assoc_hap_mg]
 
 class PlinkAssocHapRecord(PlinkBase):
-    """ A class to parse each record of haplotype association study result """
+    """ A class to access each record of haplotype association study result """
 
-    def __init__(self, data):
-        self.__data = data
+    def __init__(self, assoc_hap_mg, haplo_idx):
+        self.__assoc_hap_mg = assoc_hap_mg
+        self.__haplo_idx = haplo_idx
 
     def get_raw_repr(self):
-        return {"raw data": self.__data,
+        return {"haplotype index": self.__haplo_idx,
+                "locus": self.locus,
                 "haplotype": self.haplotype,
                 "f_a": self.f_a,
                 "f_u": self.f_u,
@@ -357,80 +1143,160 @@ class PlinkAssocHapRecord(PlinkBase):
                 "snps": self.snps,
                 }
 
+    @property
+    def locus(self):
+        return self.__assoc_hap_mg.loci[self.__haplo_idx]
+
     @property
     def haplotype(self):
-        return self.__data[IDX_COL_HAPASSOC_HAPLO]
+        return self.__assoc_hap_mg.haplotypes[self.__haplo_idx]
 
     @property
     def f_a(self):
-        return float(self.__data[IDX_COL_HAPASSOC_F_A])
+        return self.__assoc_hap_mg.f_as[self.__haplo_idx]
 
     @property
     def f_u(self):
-        return float(self.__data[IDX_COL_HAPASSOC_F_U])
+        return self.__assoc_hap_mg.f_us[self.__haplo_idx]
 
     @property
     def chisq(self):
-        return float(self.__data[IDX_COL_HAPASSOC_CHISQ])
+        return self.__assoc_hap_mg.chisqs[self.__haplo_idx]
 
     @property
     def or_value(self):
-        return float(self.__data[IDX_COL_HAPASSOC_OR])
+        return self.__assoc_hap_mg.or_values[self.__haplo_idx]
 
     @property
     def p_value(self):
-        return float(self.__data[IDX_COL_HAPASSOC_P_VALUE])
+        return self.__assoc_hap_mg.p_values[self.__haplo_idx]
 
     @property
     def snps(self):
-        return self.__data[IDX_COL_HAPASSOC_SNPS].split('|')
+        """ shared with the other haplotypes of the window, do not modify """
+        assoc_hap_mg = self.__assoc_hap_mg
+        return assoc_hap_mg.snps_table[assoc_hap_mg.snps_idxs[self.__haplo_idx]]
 
 class PlinkAssocHapManager(PlinkBase):
-    """ A class to handle PLINK haplotype association study file """
+    """
+    A class to handle PLINK haplotype association study file. The file is
+    parsed once into a float64 array of each statistic, non-numeric values
+    like NA being NaN, and a table of the distinct SNP lists, which are
+    shared by the haplotypes of the same window
+    """
 
     def __init__(self, hap_assoc_file):
         self.__file_name = hap_assoc_file
-        self.__haplos_count = None
+        self.__load_haplos()
 
     def get_raw_repr(self):
         return {"asso.hap file name": self.__file_name,
                 "header": self.header,
                 "number of haplotypes": self.haplos_count,
+                "number of SNP lists": len(self.__snps_table),
                 }
 
-    @property
-    def header(self):
-        with open(self.__file_name, 'rb') as csvfile:
+    def __parse_float(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+
+    def __load_haplos(self):
+        self.__loci = []
+        self.__haplotypes = []
+        stats = []
+        self.__snps_table = []
+        snps_list_idxs = {}
+        snps_idxs = []
+        with open_input(self.__file_name) as csvfile:
             csv_reader = csv.reader(csvfile, delimiter='\t')
-            header = csv_reader.next()
+            self.__header = csv_reader.next()
+            for haplo_info in csv_reader:
+                metrics.count(ROWS_READ)
+                self.__loci.append(haplo_info[IDX_COL_HAPASSOC_LOCUS])
+                self.__haplotypes.append(haplo_info[IDX_COL_HAPASSOC_HAPLO])
+                stats.append(map(self.__parse_float,
+                                 [haplo_info[IDX_COL_HAPASSOC_F_A],
+                                  haplo_info[IDX_COL_HAPASSOC_F_U],
+                                  haplo_info[IDX_COL_HAPASSOC_CHISQ],
+                                  haplo_info[IDX_COL_HAPASSOC_OR],
+                                  haplo_info[IDX_COL_HAPASSOC_P_VALUE],
+                                  ]))
+                snps_list = haplo_info[IDX_COL_HAPASSOC_SNPS]
+                if snps_list not in snps_list_idxs:
+                    snps_list_idxs[snps_list] = len(self.__snps_table)
+                    self.__snps_table.append(snps_list.split('|'))
+                snps_idxs.append(snps_list_idxs[snps_list])
             csvfile.close()
-        return header
+        stats = np.array(stats, dtype=np.float64).reshape(-1, 5)
+        (self.__f_as,
+         self.__f_us,
+         self.__chisqs,
+         self.__or_values,
+         self.__p_values) = stats.T.copy()
+        self.__snps_idxs = np.array(snps_idxs, dtype=np.int32)
+        self.__haplos_info = map(lambda x: PlinkAssocHapRecord(self, x),
+                                 xrange(len(self.__haplotypes)))
+
+    @property
+    def header(self):
+        return self.__header
+
+    @property
+    def loci(self):
+        return self.__loci
+
+    @property
+    def haplotypes(self):
+        return self.__haplotypes
+
+    @property
+    def f_as(self):
+        return self.__f_as
+
+    @property
+    def f_us(self):
+        return self.__f_us
+
+    @property
+    def chisqs(self):
+        return self.__chisqs
+
+    @property
+    def or_values(self):
+        return self.__or_values
+
+    @property
+    def p_values(self):
+        return self.__p_values
+
+    @property
+    def snps_table(self):
+        return self.__snps_table
+
+    @property
+    def snps_idxs(self):
+        """ index of the SNP list of each haplotype in snps_table """
+        return self.__snps_idxs
 
     @property
     def haplos_info(self):
-        with open(self.__file_name, 'rb') as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter='\t')
-            csv_reader.next()
-            for haplo_info in csv_reader:
-                yield(PlinkAssocHapRecord(haplo_info))
-            csvfile.close()
+        return self.__haplos_info
 
     @property
     def haplos_count(self):
-        if self.__haplos_count is not None:
-            return self.__haplos_count
-        else:
-            self.__haplos_count = len(list(self.haplos_info))
-            return self.__haplos_count
+        return len(self.__haplotypes)
 
 class SnpRecord(PlinkBase):
-    """ A class to parse SNP information """
+    """ A class to access SNP information """
 
-    def __init__(self, data):
-        self.__data = data
+    def __init__(self, snps_info_mg, snp_idx):
+        self.__snps_info_mg = snps_info_mg
+        self.__snp_idx = snp_idx
 
     def get_raw_repr(self):
-        return {"raw data ": self.__data,
+        return {"snp index ": self.__snp_idx,
                 "snp code ": self.snp_code,
                 "F_MISS_A": self.f_miss_a,
                 "F_MISS_U": self.f_miss_u,
@@ -440,63 +1306,116 @@ class SnpRecord(PlinkBase):
 
     @property
     def snp_code(self):
-        return self.__data[IDX_COL_SNP_CODE]
+        return self.__snps_info_mg.snp_list[self.__snp_idx]
 
     @property
     def f_miss_a(self):
-        return self.__data[IDX_COL_SNP_F_MISS_A]
+        return self.__snps_info_mg.f_miss_as[self.__snp_idx]
 
     @property
     def f_miss_u(self):
-        return self.__data[IDX_COL_SNP_F_MISS_U]
+        return self.__snps_info_mg.f_miss_us[self.__snp_idx]
 
     @property
     def chrom(self):
-        return self.__data[IDX_COL_SNP_CHROM]
+        return self.__snps_info_mg.chroms[self.__snp_idx]
 
     @property
     def pos(self):
-        return int(self.__data[IDX_COL_SNP_POS])
+        return int(self.__snps_info_mg.positions[self.__snp_idx])
 
 class SnpsInfoManager(PlinkBase):
-    """ A class to handle SNPs information """
-
-    def __init__(self, snps_info_file):
+    """
+    A class to handle SNPs information. The file is loaded once into a
+    column of each field, F_MISS_A and F_MISS_U are kept as they are
+    written, with an index of the rows of each SNP code. The records can
+    also be given as snps_info, e.g. computed from PLINK binary files, in
+    which case snps_info_file only names their source
+    """
+
+    def __init__(self, snps_info_file, snps_info=None):
         self.__file_name = snps_info_file
-        self.__snp_list = map(lambda x:x.snp_code, self.snps_info)
+        self.__load_snps(snps_info)
 
     def get_raw_repr(self):
         return {"snps infomation file name": self.__file_name,
                 "header": self.header,
                 "record size": self.record_size,
-                "number of snps": len(list(self.snps_info)),
+                "number of snps": len(self.__snp_list),
                 }
 
+    def __load_snps(self, snps_info):
+        self.__snp_list = []
+        self.__f_miss_as = []
+        self.__f_miss_us = []
+        self.__chroms = []
+        self.__positions = []
+        self.__snp_rows = defaultdict(list)
+        if snps_info is not None:
+            self.__header = SNPS_INFO_HEADER
+            self.__add_snps(snps_info)
+        else:
+            with open_input(self.__file_name) as csvfile:
+                csv_reader = csv.reader(csvfile, delimiter='\t')
+                self.__header = csv_reader.next()
+                self.__add_snps(csv_reader)
+                csvfile.close()
+        self.__positions = np.array(self.__positions, dtype=np.int64)
+        self.__snps_info = map(lambda x: SnpRecord(self, x),
+                               xrange(len(self.__snp_list)))
+
+    def __add_snps(self, snps_info):
+        for snp_info in snps_info:
+            metrics.count(ROWS_READ)
+            snp_code = snp_info[IDX_COL_SNP_CODE]
+            self.__snp_rows[snp_code].append(len(self.__snp_list))
+            self.__snp_list.append(snp_code)
+            self.__f_miss_as.append(snp_info[IDX_COL_SNP_F_MISS_A])
+            self.__f_miss_us.append(snp_info[IDX_COL_SNP_F_MISS_U])
+            self.__chroms.append(snp_info[IDX_COL_SNP_CHROM])
+            self.__positions.append(snp_info[IDX_COL_SNP_POS])
+
     @property
     def snp_list(self):
         return self.__snp_list
 
+    @property
+    def f_miss_as(self):
+        return self.__f_miss_as
+
+    @property
+    def f_miss_us(self):
+        return self.__f_miss_us
+
+    @property
+    def chroms(self):
+        return self.__chroms
+
+    @property
+    def positions(self):
+        return self.__positions
+
     @property
     def header(self):
-        with open(self.__file_name, 'rb') as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter='\t')
-            header = csv_reader.next()
-            csvfile.close()
-        return header
+        return self.__header
 
     @property
     def snps_info(self):
-        with open(self.__file_name, 'rb') as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter='\t')
-            csv_reader.next()
-            for snp_info in csv_reader:
-                yield(SnpRecord(snp_info))
-            csvfile.close()
+        return self.__snps_info
 
     @property
     def record_size(self):
         return len(self.header)
 
+    def get_snp_idxs(self, snp_codes):
+        """ the rows, in file order, of the given SNP codes """
+        is_selected = np.zeros(len(self.__snp_list), dtype=bool)
+        snp_rows = self.__snp_rows
+        for snp_code in set(snp_codes):
+            if snp_code in snp_rows:
+                is_selected[snp_rows[snp_code]] = True
+        return np.flatnonzero(is_selected).tolist()
+
 class SpecialStudyFamilyRecord(PlinkBase):
     """ A class to parse information for each record in Pedigree file """
 
@@ -564,47 +1483,95 @@ class ColorRegionRecord(PlinkBase):
         return int(self.__info[3].split('-')[1])
 
 class ColorRegions(list, PlinkBase):
-    """ A manager class to handle coloring regions of each family """
+    """
+    A manager class to handle coloring regions of each family. The regions
+    are compiled into a sorted interval index of each chromosome, so that
+    positions can be colored in any order
+    """
 
     def __init__(self):
-        self.__active_region_idx = 0
+        self.__chroms_index = None
 
     def get_raw_repr(self):
         return {"number of regions": self.n_regions,
+                "chromosomes": sorted(self.chroms_index.keys()),
                 }
 
     @property
     def n_regions(self):
         return len(self)
 
-    def __update_comparison_info(self):
-        if self.n_regions > self.__active_region_idx:
-            color_region = self[self.__active_region_idx]
-            self.__active_chrom = color_region.chrom
-            self.__active_start_pos = color_region.start_pos
-            self.__active_end_pos = color_region.end_pos
-            self.__active_color = color_region.color
-        else:
-            self.__active_chrom = None
-            self.__active_start_pos = 999999999999
-            self.__active_end_pos = 999999999999
-            self.__active_color = None
-
-    def init_comparison(self):
-        self.__active_region_idx = 0
-        self.__update_comparison_info()
-
-    def get_color(self, position):
-        while position > self.__active_end_pos:
-            self.__active_region_idx += 1
-            self.__update_comparison_info()
-        if position >= self.__active_start_pos:
-            return self.__active_color
-        else:
+    @property
+    def chroms_index(self):
+        """
+        for each chromosome code, (start positions, running maximum of end
+        positions, region indexes) of its regions in the order of their
+        start positions. The first region, in that order, whose end is
+        not before a position is the only candidate to contain it
+        """
+        if self.__chroms_index is None:
+            self.__build_chroms_index()
+        return self.__chroms_index
+
+    def __build_chroms_index(self):
+        chroms_regions = defaultdict(list)
+        for region_idx in xrange(self.n_regions):
+            chroms_regions[get_chrom_code(self[region_idx].chrom)].append(region_idx)
+        self.__chroms_index = {}
+        for chrom in chroms_regions:
+            region_idxs = sorted(chroms_regions[chrom],
+                                 key=lambda x: self[x].start_pos)
+            start_poss = map(lambda x: self[x].start_pos, region_idxs)
+            max_end_poss = np.maximum.accumulate(map(lambda x: self[x].end_pos,
+                                                     region_idxs)).tolist()
+            self.__chroms_index[chrom] = (start_poss, max_end_poss, region_idxs)
+
+    def get_region_idx(self, chrom, position):
+        """ index of the first region containing the position or -1 """
+        chrom_code = get_chrom_code(chrom)
+        if chrom_code not in self.chroms_index:
+            return -1
+        (start_poss, max_end_poss, region_idxs) = self.chroms_index[chrom_code]
+        idx = bisect.bisect_left(max_end_poss, position)
+        if (idx < len(region_idxs)) and (start_poss[idx] <= position):
+            return region_idxs[idx]
+        return -1
+
+    def get_color(self, chrom, position):
+        region_idx = self.get_region_idx(chrom, position)
+        if region_idx == -1:
             return None
+        return self[region_idx].color
+
+    def get_region_idxs(self, chroms, positions):
+        """ get_region_idx() of whole arrays of chromosomes and positions """
+        positions = np.asarray(positions, dtype=np.int64)
+        chrom_codes = np.array(map(get_chrom_code, chroms), dtype=object)
+        region_idxs = np.repeat(np.intp(-1), len(positions))
+        for chrom in self.chroms_index:
+            (start_poss, max_end_poss, chrom_region_idxs) = self.chroms_index[chrom]
+            rows = np.flatnonzero(chrom_codes == chrom)
+            rows_poss = positions[rows]
+            idxs = np.searchsorted(max_end_poss, rows_poss, side='left')
+            is_in_range = idxs < len(chrom_region_idxs)
+            rows = rows[is_in_range]
+            idxs = idxs[is_in_range]
+            is_contained = np.asarray(start_poss)[idxs] <= rows_poss[is_in_range]
+            region_idxs[rows[is_contained]] = np.asarray(chrom_region_idxs)[idxs[is_contained]]
+        return region_idxs
+
+    def get_colors(self, chroms, positions):
+        """ colors of whole arrays of chromosomes and positions, None if uncolored """
+        return map(lambda x: None if x == -1 else self[x].color,
+                   self.get_region_idxs(chroms, positions).tolist())
+
+    def append(self, color_region):
+        list.append(self, color_region)
+        self.__chroms_index = None
 
     def sort_regions(self):
-        self.sort(key=lambda x:x.start_pos, reverse=False)
+        self.sort(key=lambda x: (get_chrom_code(x.chrom), x.start_pos))
+        self.__chroms_index = None
 
 # ****************************** get arguments ******************************
 argp = argparse.ArgumentParser(description="A script to manipulate csv files and group them into one xls")
@@ -619,8 +1586,20 @@ argp.add_argument('-A', dest='addn_csvs',
                         default=None)
 argp.add_argument('-S', dest='snps_info_file',
                         metavar='SNPS_INFO_FILE',
-                        help='a file to descript SNPs annotation',
-                        required=True)
+                        help='a file to descript SNPs annotation (required unless -b is given)',
+                        default=None)
+argp.add_argument('-b', dest='bfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='PLINK binary (.bed/.bim/.fam) file prefix to compute SNPs annotation, positions and missing genotyping rates of cases and controls, from instead of reading -S',
+                        default=None)
+argp.add_argument('-R', dest='region',
+                        metavar='REGION',
+                        help='region of the SNPs of -b in <chrom>[:<from bp>-<to bp>] format (default: All)',
+                        default='All')
+argp.add_argument('-P', dest='pheno_file',
+                        metavar='FILE',
+                        help='PLINK phenotype file to split cases (2) from controls (1) of -b (default: phenotypes of the .fam file)',
+                        default=None)
 argp.add_argument('-H', dest='report_haplos_file',
                         metavar='REPORT_HAPLOS_FILE',
                         help='Haplotypes that are related to the ones with significant p-value in assoc.hap format with odds ratio',
@@ -653,6 +1632,45 @@ argp.add_argument('-I', dest='show_fam_haplo_sheets',
                         action='store_true',
                         help='To enable showing sheets, one for each individual, which map individual haplotype(s) with filtered assoc.hap ',
                         default=False)
+argp.add_argument('--bit-packed', dest='bit_packed',
+                        action='store_true',
+                        help='keep the families genotypes as bit planes, which takes about 4 times less memory, and compare haplotypes with bitwise operations',
+                        default=False)
+argp.add_argument('--fam-cache-mb', dest='fam_cache_mb',
+                        metavar='MB',
+                        type=int,
+                        help='memory limit of the cache of decoded bit packed family genotypes, it has no effect without --bit-packed since the byte tensor keeps every family decoded (default: ' + str(DFLT_FAM_CACHE_MB) + ')',
+                        default=DFLT_FAM_CACHE_MB)
+argp.add_argument('--sharing-matrix', dest='sharing_matrix_file',
+                        metavar='FILE',
+                        help='write the number of markers at which each pair of family haplotypes has the same allele to FILE in tab-separated format (requires -f)',
+                        default=None)
+argp.add_argument('--export-matches', dest='matches_file',
+                        metavar='FILE',
+                        help='write the filtered haplotypes matched by each family haplotype to FILE in long tab-separated format, one row per family, ploid and haplotype with its P, OR, number of matched markers and first/last bp. FILE is written in BGZF blocks, readable with zcat or tabix tools, if it ends with .gz or .bgz (requires -f)',
+                        default=None)
+argp.add_argument('-j', '--jobs', dest='n_jobs',
+                        metavar='N',
+                        type=int,
+                        help='number of processes which compute the families sheets, the processes share the loaded genotypes (default: 1)',
+                        default=1)
+argp.add_argument('--fam-workbooks', dest='fam_workbooks_dir',
+                        metavar='DIRECTORY',
+                        help='write the families sheets into one workbook per family (or per batch of families, see --fam-batch-size) in DIRECTORY, in parallel with -j, instead of into the xls output file, which then gets an index sheet of the families workbooks (requires -f)',
+                        default=None)
+argp.add_argument('--fam-batch-size', dest='fam_batch_size',
+                        metavar='N',
+                        type=int,
+                        help='number of families in each workbook of --fam-workbooks (default: 1)',
+                        default=1)
+argp.add_argument('--metrics', dest='metrics_file',
+                        metavar='FILE',
+                        help='write wall/CPU time of each stage and each sheet, rows and cells counts and peak memory usage to FILE in JSON format',
+                        default=None)
+argp.add_argument('--profile', dest='profile',
+                        action='store_true',
+                        help='dump cProfile statistics of each stage next to the metrics file (or the output xls file) as <file>[.<sheet>].<stage>.prof',
+                        default=False)
 argp.add_argument('-l', dest='log_file',
                         metavar='FILE',
                         help='log file',
@@ -677,6 +1695,9 @@ if args.plink_fams_haplos_file_prefix is not None:
 else:
     plink_fams_haplos_file_prefix = None
 snps_info_file = args.snps_info_file
+bfile_prefix = args.bfile_prefix
+region = args.region
+pheno_file = args.pheno_file
 report_haplos_file = args.report_haplos_file
 p_value_sig_ratio = args.p_value_sig_ratio
 dev_mode = args.dev_mode
@@ -689,6 +1710,23 @@ color_region_infos = []
 if args.color_region_infos is not None:
     for info in args.color_region_infos.split(','):
         color_region_infos.append(ColorRegionRecord(info))
+bit_packed = args.bit_packed
+fam_cache_mb = args.fam_cache_mb
+sharing_matrix_file = args.sharing_matrix_file
+matches_file = args.matches_file
+n_jobs = args.n_jobs
+fam_workbooks_dir = args.fam_workbooks_dir
+fam_batch_size = args.fam_batch_size
+metrics_file = args.metrics_file
+profile_prefix = None
+if args.profile:
+    if metrics_file is not None:
+        profile_prefix = metrics_file
+    else:
+        profile_prefix = out_file
+metrics = ReportMetrics(script_name,
+                        enabled=metrics_file is not None,
+                        profile_prefix=profile_prefix)
 log_file = open(args.log_file, "a+")
 
 ## **************  define basic functions  **************
@@ -746,7 +1784,13 @@ info("")
 ## display required configuration
 disp_header("required configuration")
 disp_param("xls output file (-o)", out_file)
-disp_param("SNPs information file (-S)", snps_info_file)
+if bfile_prefix is not None:
+    disp_param("SNPs information PLINK binary file prefix (-b)", bfile_prefix)
+    disp_param("SNPs information region (-R)", region)
+    if pheno_file is not None:
+        disp_param("SNPs information phenotype file (-P)", pheno_file)
+else:
+    disp_param("SNPs information file (-S)", snps_info_file)
 disp_param("selected haplotypes file (-H)", report_haplos_file)
 disp_param("filtered haplos file (-F)", fltred_haplos_file)
 if plink_fams_haplos_file_prefix is not None:
@@ -771,6 +1815,21 @@ disp_param("P-value significant ratio (-p)", p_value_sig_ratio)
 if dev_mode:
     disp_param("developer mode (-D)", "ON")
 disp_param("show family haplotypes mapping (-I)", show_fam_haplo_sheets)
+disp_param("bit packed genotypes (--bit-packed)", bit_packed)
+if bit_packed:
+    disp_param("family cache limit in MB (--fam-cache-mb)", fam_cache_mb)
+if sharing_matrix_file is not None:
+    disp_param("haplotypes sharing matrix file (--sharing-matrix)", sharing_matrix_file)
+if matches_file is not None:
+    disp_param("haplotypes matches file (--export-matches)", matches_file)
+disp_param("number of processes (-j)", n_jobs)
+if fam_workbooks_dir is not None:
+    disp_param("families workbooks directory (--fam-workbooks)", fam_workbooks_dir)
+    disp_param("families per workbook (--fam-batch-size)", fam_batch_size)
+if metrics_file is not None:
+    disp_param("metrics file (--metrics)", metrics_file)
+if profile_prefix is not None:
+    disp_param("profile files prefix (--profile)", profile_prefix)
 if len(special_fam_infos) > 0:
     disp_subheader("special studies on families (-s)")
     for i in xrange(len(special_fam_infos)):
@@ -787,20 +1846,39 @@ if len(color_region_infos) > 0:
 info("")
 
 # ****************************** define functions ******************************
+def load_bed_snps_info(bfile_prefix, region, pheno_file):
+    bed_reader = PlinkBedReader(bfile_prefix)
+    if region == 'All':
+        snp_idxs = bed_reader.get_snp_idxs()
+    else:
+        snp_idxs = bed_reader.get_snp_idxs(*parse_region(region))
+    if pheno_file is not None:
+        phenos = read_pheno_file(pheno_file)
+    else:
+        phenos = None
+    (snps_info, n_cases, n_controls) = get_snps_info(bed_reader,
+                                                     snp_idxs,
+                                                     bed_reader.get_sample_idxs().tolist(),
+                                                     phenos)
+    info(str(len(snps_info)) + " SNPs of region " + region + " are read from " + bfile_prefix + ", " + str(n_cases) + " cases and " + str(n_controls) + " controls")
+    return SnpsInfoManager(bfile_prefix, snps_info=snps_info)
+
 def add_sheet(wb, sheet_name):
     ws = wb.add_worksheet(sheet_name)
+    metrics.start_sheet(sheet_name, ws)
     ws.set_default_row(12)
     return ws
 
 def add_addn_csv_sheet(wb, dflt_cell_fmt, sheet_name, csv_file):
     ws = add_sheet(wb, sheet_name)
-    with open(csv_file, 'rb') as csvfile:
+    with open_input(csv_file) as csvfile:
         csv_recs = list(csv.reader(csvfile, delimiter='\t'))
         csv_row = 0
         for xls_row in xrange(len(csv_recs)):
             csv_rec = csv_recs[xls_row]
             for col in xrange(len(csv_rec)):
                 ws.write(csv_row, col, csv_rec[col], dflt_cell_fmt)
+            metrics.count(ROWS_WRITTEN)
             csv_row += 1
         csvfile.close()
     ws.freeze_panes(1, 0)
@@ -841,15 +1919,17 @@ def add_snps_to_ws(ws,
                    color_regions=ColorRegions()
                    ):
     n_snps_col = snps_info_mg.record_size
-    color_regions.init_comparison()
     # Add SNPs information
     snps_rows_map = {}
     row_idx = HAPLO_INFO_SIZE
-    for snp_info in snps_info_mg.snps_info:
+    snps_info = snps_info_mg.snps_info
+    snp_idxs = snps_info_mg.get_snp_idxs(snps_list)
+    chroms = snps_info_mg.chroms
+    snps_colors = color_regions.get_colors(map(lambda x: chroms[x], snp_idxs),
+                                           snps_info_mg.positions[snp_idxs])
+    for (snp_idx, snp_color) in zip(snp_idxs, snps_colors):
+        snp_info = snps_info[snp_idx]
         snp_code = snp_info.snp_code
-        if snp_code not in snps_list:
-            continue
-        snp_color = color_regions.get_color(snp_info.pos)
         if snp_color is None:
             snp_cell_fmt = cell_fmt_mg.default_format
         else:
@@ -857,6 +1937,8 @@ def add_snps_to_ws(ws,
         row_idx += 1
         snps_rows_map[snp_code] = row_idx
         add_snp_to_ws(ws, row_idx, snp_info, snp_cell_fmt)
+        metrics.count(ROWS_WRITTEN)
+    dflt_cell_fmt = cell_fmt_mg.default_format
     add_snp_header_to_ws(ws,
                          dflt_cell_fmt,
                          HAPLO_INFO_SIZE,
@@ -868,6 +1950,14 @@ def add_snps_to_ws(ws,
     ws.set_column(IDX_COL_SNP_POS, IDX_COL_SNP_POS, 10)
     return (snps_rows_map, n_snps_col)
 
+def add_stat_to_ws(ws, row, col, value, cell_format):
+    # xlsx cannot keep NaN, the statistics that PLINK could not compute
+    # are shown as NA
+    if np.isnan(value):
+        ws.write(row, col, STAT_NA, cell_format)
+    else:
+        ws.write(row, col, value, cell_format)
+
 def add_haplo_stat_to_ws(ws,
                          cell_fmt_mg,
                          col,
@@ -876,11 +1966,11 @@ def add_haplo_stat_to_ws(ws,
                          ):
     dflt_cell_fmt = cell_fmt_mg.default_format
     ws.write(0, col, col+1, dflt_cell_fmt)
-    ws.write(1, col, haplo_info.f_a, wb_fmt)
-    ws.write(2, col, haplo_info.f_u, wb_fmt)
-    ws.write(3, col, haplo_info.chisq, wb_fmt)
-    ws.write(4, col, haplo_info.or_value, wb_fmt)
-    ws.write(5, col, haplo_info.p_value, wb_fmt)
+    add_stat_to_ws(ws, 1, col, haplo_info.f_a, wb_fmt)
+    add_stat_to_ws(ws, 2, col, haplo_info.f_u, wb_fmt)
+    add_stat_to_ws(ws, 3, col, haplo_info.chisq, wb_fmt)
+    add_stat_to_ws(ws, 4, col, haplo_info.or_value, wb_fmt)
+    add_stat_to_ws(ws, 5, col, haplo_info.p_value, wb_fmt)
 
 def add_assoc_hap_header_to_ws(ws,
                                dflt_cell_fmt,
@@ -901,61 +1991,63 @@ def add_assoc_hap_header_to_ws(ws,
     ws.set_row(4, 35, None, {})
     ws.set_row(5, 55, None, {})
 
+def get_haplo_header(fam_info, ploid_idx):
+    if fam_info.n_ploid == 1:
+        return fam_info.fam_id
+    elif ploid_idx == 0:
+        return fam_info.fam_id+" (shared)"
+    else:
+        return fam_info.fam_id+" (unshared)"
+
 def add_fam_info_to_ws(ws,
                        cell_fmt_mg,
                        adding_fam_info,
                        col_idx,
                        snps_rows_map,
                        ref_fam_infos=[],
+                       haplos_sharing=None,
                        ):
     dflt_cell_fmt = cell_fmt_mg.default_format
     bp_fmts = cell_fmt_mg.bp_fmts
     # Write families haplotypes header
     header_row = HAPLO_INFO_SIZE
-    adding_fam_id = adding_fam_info.fam_id
     n_ploid = adding_fam_info.n_ploid
-    adding_fam_gts = adding_fam_info.gts
     adding_colors = adding_fam_info.colors
-    if n_ploid == 1:
-        ws.write(header_row,
-                 col_idx,
-                 adding_fam_id,
-                 cell_fmt_mg.stat_fmts[adding_colors[0]])
-    else:
+    for ploid_idx in xrange(n_ploid):
         ws.write(header_row,
-                 col_idx,
-                 adding_fam_id+" (shared)",
-                 cell_fmt_mg.stat_fmts[adding_colors[0]])
-        ws.write(header_row,
-                 col_idx+1,
-                 adding_fam_id+" (unshared)",
-                 cell_fmt_mg.stat_fmts[adding_colors[1]])
+                 col_idx+ploid_idx,
+                 get_haplo_header(adding_fam_info, ploid_idx),
+                 cell_fmt_mg.stat_fmts[adding_colors[ploid_idx]])
+    # all families are genotyped on the same markers, the allele codes of
+    # the sheet SNPs are gathered once for every family
+    gt_tensor = adding_fam_info.gt_tensor
+    alleles = gt_tensor.alleles
+    snp_codes = snps_rows_map.keys()
+    (snp_idxs, marker_cols) = gt_tensor.get_marker_cols(snp_codes)
+    adding_codes = adding_fam_info.gt_codes[marker_cols].tolist()
     for adding_ploid_idx in xrange(adding_fam_info.n_ploid):
-        for snp_code in snps_rows_map:
-            if snp_code not in adding_fam_gts:
-                continue
-            adding_bp = adding_fam_gts[snp_code].split(" ")[adding_ploid_idx]
-            if adding_bp == "0":
+        # defining format, the first reference haplotype sharing the
+        # allele gives its color
+        snps_bp_fmt = [bp_fmts[adding_colors[adding_ploid_idx]]] * len(snp_idxs)
+        for ref_fam_info in reversed(ref_fam_infos):
+            for ref_ploid_idx in reversed(xrange(ref_fam_info.n_ploid)):
+                ref_bp_fmt = bp_fmts[ref_fam_info.colors[ref_ploid_idx]]
+                is_shared = haplos_sharing.get_shared_markers(adding_fam_info.fam_idx,
+                                                              adding_ploid_idx,
+                                                              ref_fam_info.fam_idx,
+                                                              ref_ploid_idx,
+                                                              marker_cols)
+                for snp_idx in np.flatnonzero(is_shared):
+                    snps_bp_fmt[snp_idx] = ref_bp_fmt
+        for snp_idx in xrange(len(snp_idxs)):
+            snp_code = snp_codes[snp_idxs[snp_idx]]
+            adding_code = adding_codes[snp_idx][adding_ploid_idx]
+            if adding_code == MISSING_ALLELE_CODE:
                 continue
-            # defining format
-            bp_fmt = bp_fmts[adding_fam_info.colors[adding_ploid_idx]]
-            for ref_fam_info in ref_fam_infos:
-                is_compared = False
-                ref_fam_gts = ref_fam_info.gts
-                ref_colors = ref_fam_info.colors
-                if snp_code not in ref_fam_gts:
-                    continue
-                for ref_ploid_idx in xrange(ref_fam_info.n_ploid):
-                    ref_bp = ref_fam_gts[snp_code].split(" ")[ref_ploid_idx]
-                    if adding_bp == ref_bp:
-                        bp_fmt = bp_fmts[ref_fam_info.colors[ref_ploid_idx]]
-                        is_compared = True
-                        break
-                if is_compared:
-                    break
+            bp_fmt = snps_bp_fmt[snp_idx]
             row = snps_rows_map[snp_code]
             col = col_idx+adding_ploid_idx
-            ws.write(row, col, adding_bp, bp_fmt)
+            ws.write(row, col, alleles[adding_code], bp_fmt)
     ws.set_column(col_idx, col_idx+n_ploid-1, 1.3)
     add_run_no_to_ws(ws, dflt_cell_fmt, col_idx, col_idx+n_ploid-1)
 
@@ -967,7 +2059,7 @@ def get_uniq_snps_from_assoc_hap(haplos_info):
     return tmp_snps_dict.keys()
 
 def get_uniq_snps_from_family_gts(family_info):
-    return family_info.gts.keys()
+    return list(set(family_info.gt_tensor.markers))
 
 def add_report_haplos_sheet(wb,
                             cell_fmt_mg,
@@ -1020,35 +2112,25 @@ def add_report_haplos_sheet(wb,
     ws.set_column(n_snps_col, haplos_count+n_snps_col-1, 1.3)
     ws.freeze_panes(HAPLO_INFO_SIZE+1, n_snps_col)
 
-def add_fam_haplos_sheets(wb,
-                          cell_fmt_mg,
-                          plink_gt_mg,
-                          fltred_assoc_hap_mg,
-                          snps_info_mg,
-                          ):
+def get_fam_sheets_order(plink_gt_mg):
+    """ families of interest first """
     special_fam_ids = plink_gt_mg.special_fam_ids
-    # Adding family of interest first
-    for fam_id in special_fam_ids:
-        info("adding special haplotype sheet for family " + fam_id)
-        add_compact_fam_haplos_sheet(wb,
-                                     cell_fmt_mg,
-                                     plink_gt_mg,
-                                     fam_id,
-                                     fltred_assoc_hap_mg,
-                                     snps_info_mg,
-                                     )
-        info("adding normal full haplotype sheet for family " + fam_id)
-        add_full_fam_haplos_sheet(wb,
-                                  cell_fmt_mg,
-                                  plink_gt_mg,
-                                  fam_id,
-                                  fltred_assoc_hap_mg,
-                                  snps_info_mg,
-                                  )
     other_fams = filter(lambda x: x not in special_fam_ids,
                           plink_gt_mg.fam_ids)
-    for fam_id in other_fams:
+    return special_fam_ids + other_fams
+
+def add_fam_sheets(wb,
+                   cell_fmt_mg,
+                   plink_gt_mg,
+                   fam_id,
+                   fltred_assoc_hap_mg,
+                   snps_info_mg,
+                   ):
+    if fam_id in plink_gt_mg.special_fam_ids:
+        info("adding special haplotype sheet for family " + fam_id)
+    else:
         info("adding normal compact haplotype sheet for family " + fam_id)
+    with metrics.stage(STAGE_COMPACT_FAM_SHEET):
         add_compact_fam_haplos_sheet(wb,
                                      cell_fmt_mg,
                                      plink_gt_mg,
@@ -1056,7 +2138,8 @@ def add_fam_haplos_sheets(wb,
                                      fltred_assoc_hap_mg,
                                      snps_info_mg,
                                      )
-        info("adding normal full haplotype sheet for family " + fam_id)
+    info("adding normal full haplotype sheet for family " + fam_id)
+    with metrics.stage(STAGE_FULL_FAM_SHEET):
         add_full_fam_haplos_sheet(wb,
                                   cell_fmt_mg,
                                   plink_gt_mg,
@@ -1065,49 +2148,179 @@ def add_fam_haplos_sheets(wb,
                                   snps_info_mg,
                                   )
 
-def compare_haplos(fam_info, assoc_hap_info):
-    # The idea is to check if any of filtered haplotypes are similar to
-    # one of the two family haplotypes.
-    # With the above idea, the program has to check
-    # 1 - If each bp at the same marker is similar, which has an exception
-    #     in case that there is no bp info from the family
-    # 2 - With the exception from above, the comparison has to check that
-    #     it has been compared at least once
-    # Start the comparison bp-wise
-    assoc_hap_bps = assoc_hap_info.haplotype
-    assoc_hap_snps = assoc_hap_info.snps
-    fam_gts = fam_info.gts
-    for haplo_idx in xrange(fam_info.n_ploid):
-        is_compared = False
-        haplo_matched = haplo_idx
-        for bp_idx in xrange(len(assoc_hap_bps)):
-            assoc_hap_bp = assoc_hap_bps[bp_idx]
-            assoc_hap_snp_code = assoc_hap_snps[bp_idx]
-            # Only compare the snp which present in family,
-            # otherwise, exception will occur
-            if assoc_hap_snp_code in fam_gts :
-                fam_bps = fam_gts[assoc_hap_snp_code]
-                fam_bp = fam_bps.split(" ")[haplo_idx]
-                if fam_bp == "0":
-                    continue
-                # Compare !!!
-                is_compared = True
-                if assoc_hap_bp != fam_bp:
-                    haplo_matched = -1
+def run_fam_task(fam_task):
+    """
+    run by the workers of map_fam_workers(), the metrics of the task are
+    returned with its result
+    """
+    global metrics
+    (worker_func, task) = fam_task
+    # stages of the workers are not profiled
+    metrics = ReportMetrics(script_name, enabled=metrics.enabled)
+    result = worker_func(task)
+    return (result, metrics.get_snapshot())
+
+def map_fam_workers(worker_func, tasks):
+    """
+    run worker_func over tasks in n_jobs processes, the results come back in
+    the order of tasks. The processes are forked after the families are
+    loaded, they read the genotype tensor and the managers from the main
+    process memory instead of loading copies of them. A task is submitted
+    only when a result is consumed, so that at most n_jobs results wait in
+    memory while the caller handles one
+    """
+    if n_jobs <= 1:
+        for task in tasks:
+            yield worker_func(task)
+        return
+    # buffered messages would be written again by every worker
+    sys.stderr.flush()
+    log_file.flush()
+    pool = multiprocessing.Pool(n_jobs)
+    tasks = iter(tasks)
+    in_flight = deque()
+    try:
+        while True:
+            for task in tasks:
+                in_flight.append(pool.apply_async(run_fam_task,
+                                                  ((worker_func, task),)))
+                if len(in_flight) > n_jobs:
                     break
-        if (haplo_matched != -1) and is_compared:
-            return haplo_matched
-    if not is_compared:
-        return -1
-    else:
-        return haplo_matched
+            if len(in_flight) == 0:
+                break
+            (result, worker_metrics) = in_flight.popleft().get()
+            metrics.merge(worker_metrics)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def render_fam_sheets(fam_id):
+    """
+    run by the workers of add_fam_haplos_sheets(), the sheets of the family
+    are computed against the managers loaded by the main codes
+    """
+    payload_wb = SheetsPayloadWorkbook(cell_fmt_mg)
+    add_fam_sheets(payload_wb,
+                   cell_fmt_mg,
+                   plink_gt_mg,
+                   fam_id,
+                   fltred_haplos_mg,
+                   snps_info_mg,
+                   )
+    return payload_wb.sheets_payload
+
+def write_fam_workbook(fams_batch):
+    """ run by the workers of add_fam_workbooks() """
+    (file_name, fam_ids) = fams_batch
+    fam_wb = xlsxwriter.Workbook(file_name)
+    fam_cell_fmt_mg = CellFormatManager(fam_wb, COLOR_RGB)
+    for fam_id in fam_ids:
+        add_fam_sheets(fam_wb,
+                       fam_cell_fmt_mg,
+                       plink_gt_mg,
+                       fam_id,
+                       fltred_haplos_mg,
+                       snps_info_mg,
+                       )
+    fam_wb.close()
+    return fams_batch
+
+def replay_sheets_payload(wb, cell_fmt_mg, sheets_payload):
+    for (sheet_name, calls) in sheets_payload:
+        ws = wb.add_worksheet(sheet_name)
+        metrics.start_sheet(sheet_name, ws)
+        for (name, args, fmt_idx) in calls:
+            if fmt_idx != -1:
+                cell_fmt = cell_fmt_mg.get_fmt(args[fmt_idx])
+                args = args[:fmt_idx] + (cell_fmt,) + args[fmt_idx+1:]
+            getattr(ws, name)(*args)
 
-def get_matched_haplos_info(fam_info, assoc_haps_info):
+def add_fam_haplos_sheets(wb,
+                          cell_fmt_mg,
+                          plink_gt_mg,
+                          fltred_assoc_hap_mg,
+                          snps_info_mg,
+                          ):
+    fam_ids = get_fam_sheets_order(plink_gt_mg)
+    if n_jobs <= 1:
+        for fam_id in fam_ids:
+            add_fam_sheets(wb,
+                           cell_fmt_mg,
+                           plink_gt_mg,
+                           fam_id,
+                           fltred_assoc_hap_mg,
+                           snps_info_mg,
+                           )
+        return
+    # the workers only compute the sheets payloads, the workbook is written
+    # by this process one family at a time. The matcher is built before the
+    # workers are forked so that it is shared by them
+    plink_gt_mg.get_haplos_matcher(fltred_assoc_hap_mg)
+    for sheets_payload in map_fam_workers(render_fam_sheets, fam_ids):
+        with metrics.stage(STAGE_REPLAY_FAM_SHEETS):
+            replay_sheets_payload(wb, cell_fmt_mg, sheets_payload)
+
+def add_fam_workbooks(wb,
+                      cell_fmt_mg,
+                      plink_gt_mg,
+                      fltred_assoc_hap_mg,
+                      fam_workbooks_dir,
+                      fam_batch_size,
+                      ):
+    """
+    write the families sheets into workbooks of fam_batch_size families and
+    add an index sheet of the workbooks to wb
+    """
+    if not os.path.isdir(fam_workbooks_dir):
+        os.makedirs(fam_workbooks_dir)
+    fam_ids = get_fam_sheets_order(plink_gt_mg)
+    fams_batches = []
+    for batch_start in xrange(0, len(fam_ids), fam_batch_size):
+        batch_fam_ids = fam_ids[batch_start:batch_start+fam_batch_size]
+        if fam_batch_size == 1:
+            wb_name = FAM_WORKBOOK_FMT.format(fam_id=batch_fam_ids[0])
+        else:
+            batch_no = batch_start/fam_batch_size + 1
+            wb_name = FAMS_BATCH_WORKBOOK_FMT.format(batch_no=batch_no)
+        fams_batches.append((os.path.join(fam_workbooks_dir, wb_name),
+                             batch_fam_ids))
+    plink_gt_mg.get_haplos_matcher(fltred_assoc_hap_mg)
+    for (file_name, batch_fam_ids) in map_fam_workers(write_fam_workbook,
+                                                      fams_batches):
+        info("families " + ",".join(batch_fam_ids) + " are written to " + file_name)
+    ws = add_sheet(wb, 'families')
+    dflt_cell_fmt = cell_fmt_mg.default_format
+    ws.write(0, 0, 'family', dflt_cell_fmt)
+    ws.write(0, 1, 'workbook', dflt_cell_fmt)
+    row = 0
+    for (file_name, batch_fam_ids) in fams_batches:
+        for fam_id in batch_fam_ids:
+            row += 1
+            ws.write(row, 0, fam_id, dflt_cell_fmt)
+            ws.write(row, 1, os.path.basename(file_name), dflt_cell_fmt)
+            metrics.count(ROWS_WRITTEN)
+    ws.set_column(1, 1, 20)
+    ws.freeze_panes(1, 0)
+
+def get_haplos_color_idxs(plink_gt_mg, fam_info, assoc_hap_mg):
+    # The idea is to check if any of filtered haplotypes are similar to
+    # one of the two family haplotypes, see PlinkAssocHapMatcher
+    start_time = time.time()
+    haplos_matcher = plink_gt_mg.get_haplos_matcher(assoc_hap_mg)
+    color_idxs = haplos_matcher.get_color_idxs(fam_info).tolist()
+    metrics.add_time(STAGE_COMPARE, time.time()-start_time)
+    return (haplos_matcher.haplos_info, color_idxs)
+
+def get_matched_haplos_info(plink_gt_mg, fam_info, assoc_hap_mg):
+    (assoc_haps_info, color_idxs) = get_haplos_color_idxs(plink_gt_mg,
+                                                          fam_info,
+                                                          assoc_hap_mg)
     matched_haplos_info = []
-    for assoc_hap_info in assoc_haps_info:
-        matched_idx = compare_haplos(fam_info, assoc_hap_info)
+    for haplo_idx in xrange(len(assoc_haps_info)):
+        matched_idx = color_idxs[haplo_idx]
         if matched_idx != -1:
-            info = {'assoc_info': assoc_hap_info,
+            info = {'assoc_info': assoc_haps_info[haplo_idx],
                     'color_idx': matched_idx,
                    }
             matched_haplos_info.append(info)
@@ -1137,9 +2350,9 @@ def add_compact_fam_haplos_sheet(wb,
     main_fam_info.info_color_regions()
     ws = add_sheet(wb, main_fam_info.displayed_id)
     dflt_cell_fmt = cell_fmt_mg.default_format
-    fltred_haplos_info = fltred_haplos_mg.haplos_info
-    matched_haplos_info = get_matched_haplos_info(main_fam_info,
-                                                  fltred_haplos_info)
+    matched_haplos_info = get_matched_haplos_info(plink_gt_mg,
+                                                  main_fam_info,
+                                                  fltred_assoc_hap_mg)
     raw_haplos_info = map(lambda x: x['assoc_info'], matched_haplos_info)
     uniq_snps = get_uniq_snps_from_assoc_hap(raw_haplos_info)
     color_regions = main_fam_info.color_regions
@@ -1167,7 +2380,8 @@ def add_compact_fam_haplos_sheet(wb,
                                other_fam_info,
                                last_col_idx,
                                snps_rows_map,
-                               ref_fam_infos=[main_fam_info])
+                               ref_fam_infos=[main_fam_info],
+                               haplos_sharing=plink_gt_mg.haplos_sharing)
             last_col_idx += other_fam_info.n_ploid
     else:
         for special_fam_id in special_fam_ids:
@@ -1178,7 +2392,8 @@ def add_compact_fam_haplos_sheet(wb,
                                special_fam_info,
                                last_col_idx,
                                snps_rows_map,
-                               ref_fam_infos=[main_fam_info])
+                               ref_fam_infos=[main_fam_info],
+                               haplos_sharing=plink_gt_mg.haplos_sharing)
             last_col_idx += special_fam_info.n_ploid
     add_assoc_hap_header_to_ws(ws,
                                dflt_cell_fmt,
@@ -1233,11 +2448,14 @@ def add_full_fam_haplos_sheet(wb,
                        )
     # Add haplotypes information
     start_haplos_col_idx = n_snps_col + fam_info.n_ploid
-    haplo_idx = 0
-    for haplo_info in fltred_assoc_hap_mg.haplos_info:
+    (haplos_info, color_idxs) = get_haplos_color_idxs(plink_gt_mg,
+                                                      fam_info,
+                                                      fltred_assoc_hap_mg)
+    for haplo_idx in xrange(len(haplos_info)):
+        haplo_info = haplos_info[haplo_idx]
         col = haplo_idx + start_haplos_col_idx
         # get cell format
-        matched_idx = compare_haplos(fam_info, haplo_info)
+        matched_idx = color_idxs[haplo_idx]
         if matched_idx != -1:
             color_code = fam_info.colors[matched_idx]
             stat_fmt = cell_fmt_mg.stat_fmts[color_code]
@@ -1254,12 +2472,72 @@ def add_full_fam_haplos_sheet(wb,
             snp_code = snps_list[bp_idx]
             if snp_code in snps_rows_map:
                 ws.write(snps_rows_map[snp_code], col, bp, bp_fmt)
-        haplo_idx += 1
     haplos_count = fltred_assoc_hap_mg.haplos_count
     end_col_idx = start_haplos_col_idx + haplos_count - 1
     ws.set_column(start_haplos_col_idx, end_col_idx, HAPLO_COL_WIDTH)
     ws.freeze_panes(HAPLO_INFO_SIZE+1, start_haplos_col_idx)
 
+def write_sharing_matrix(file_name, plink_gt_mg):
+    haplos_headers = []
+    haplos_idxs = []
+    for fam_info in plink_gt_mg.fam_infos:
+        for ploid_idx in xrange(fam_info.n_ploid):
+            haplos_headers.append(get_haplo_header(fam_info, ploid_idx))
+            haplos_idxs.append(fam_info.fam_idx*N_PLOIDY + ploid_idx)
+    sharing_matrix = plink_gt_mg.haplos_sharing.get_sharing_matrix()
+    sharing_matrix = sharing_matrix[np.ix_(haplos_idxs, haplos_idxs)]
+    with open(file_name, 'w') as out_file:
+        out_file.write("\t".join([""] + haplos_headers) + "\n")
+        for haplo_idx in xrange(len(haplos_headers)):
+            counts = map(str, sharing_matrix[haplo_idx].tolist())
+            out_file.write("\t".join([haplos_headers[haplo_idx]] + counts) + "\n")
+
+def format_haplo_stat(value):
+    if np.isnan(value):
+        return 'NA'
+    return repr(value)
+
+def write_haplos_matches(file_name, plink_gt_mg, assoc_hap_mg):
+    """
+    one row for each (haplotype, ploid) matched by a family, the rows are
+    written family by family so that only the rows of one family are kept in
+    memory
+    """
+    haplos_matcher = plink_gt_mg.get_haplos_matcher(assoc_hap_mg)
+    marker_positions = np.array(plink_gt_mg.marker_positions, dtype=np.int64)
+    haplotypes = assoc_hap_mg.haplotypes
+    loci = assoc_hap_mg.loci
+    p_values = assoc_hap_mg.p_values
+    or_values = assoc_hap_mg.or_values
+    with open_output(file_name) as out_file:
+        out_file.write("\t".join(HAPLOS_MATCHES_HEADER) + "\n")
+        for fam_info in plink_gt_mg.fam_infos:
+            start_time = time.time()
+            (is_matched,
+             n_markers,
+             first_cols,
+             last_cols) = haplos_matcher.get_fam_matches(fam_info)
+            metrics.add_time(STAGE_COMPARE, time.time()-start_time)
+            # a haplotype matched by several ploids has a row for each
+            (haplo_idxs, ploid_idxs) = np.nonzero(is_matched)
+            first_bps = marker_positions[first_cols[haplo_idxs, ploid_idxs]].tolist()
+            last_bps = marker_positions[last_cols[haplo_idxs, ploid_idxs]].tolist()
+            rows = []
+            for i in xrange(len(haplo_idxs)):
+                (haplo_idx, ploid_idx) = (haplo_idxs[i], ploid_idxs[i])
+                rows.append("\t".join([fam_info.fam_id,
+                                       str(ploid_idx),
+                                       loci[haplo_idx],
+                                       haplotypes[haplo_idx],
+                                       format_haplo_stat(p_values[haplo_idx]),
+                                       format_haplo_stat(or_values[haplo_idx]),
+                                       str(n_markers[haplo_idx, ploid_idx]),
+                                       str(first_bps[i]),
+                                       str(last_bps[i]),
+                                       ]) + "\n")
+            out_file.write("".join(rows))
+            metrics.count(ROWS_WRITTEN, len(rows))
+
 def add_full_master_haplos_sheet(wb,
                                  cell_fmt_mg,
                                  fltred_assoc_hap_mg,
@@ -1298,54 +2576,95 @@ def add_full_master_haplos_sheet(wb,
     ws.freeze_panes(HAPLO_INFO_SIZE+1, start_haplos_col_idx)
 
 # ****************************** main codes ******************************
+if (snps_info_file is None) and (bfile_prefix is None):
+    throw("either SNPs information file (-S) or PLINK binary file prefix (-b) is required")
+if n_jobs < 1:
+    throw("number of processes (-j) must be at least 1")
+if fam_batch_size < 1:
+    throw("number of families per workbook (--fam-batch-size) must be at least 1")
+
 new_section_txt(" Generating reports ")
 wb = xlsxwriter.Workbook(out_file)
 
-if plink_fams_haplos_file_prefix is not None:
-    plink_gt_mg = PlinkGTManager(plink_fams_haplos_file_prefix,
-                                 special_fam_infos=special_fam_infos,
-                                 color_region_infos=color_region_infos)
-    debug(plink_gt_mg)
-snps_info_mg = SnpsInfoManager(snps_info_file)
-debug(snps_info_mg)
-report_haplos_mg = PlinkAssocHapManager(report_haplos_file)
-debug(report_haplos_mg)
-fltred_haplos_mg = PlinkAssocHapManager(fltred_haplos_file)
-debug(fltred_haplos_mg)
+with metrics.stage(STAGE_LOAD):
+    if plink_fams_haplos_file_prefix is not None:
+        plink_gt_mg = PlinkGTManager(plink_fams_haplos_file_prefix,
+                                     special_fam_infos=special_fam_infos,
+                                     color_region_infos=color_region_infos,
+                                     bit_packed=bit_packed,
+                                     fam_cache_mb=fam_cache_mb)
+        debug(plink_gt_mg)
+    if bfile_prefix is not None:
+        snps_info_mg = load_bed_snps_info(bfile_prefix, region, pheno_file)
+    else:
+        snps_info_mg = SnpsInfoManager(snps_info_file)
+    debug(snps_info_mg)
+    report_haplos_mg = PlinkAssocHapManager(report_haplos_file)
+    debug(report_haplos_mg)
+    fltred_haplos_mg = PlinkAssocHapManager(fltred_haplos_file)
+    debug(fltred_haplos_mg)
 cell_fmt_mg = CellFormatManager(wb, COLOR_RGB)
 debug(cell_fmt_mg)
 dflt_cell_fmt = cell_fmt_mg.default_format
-add_full_master_haplos_sheet(wb,
-                             cell_fmt_mg,
-                             fltred_haplos_mg,
-                             snps_info_mg,
-                             )
+with metrics.stage(STAGE_MASTER_SHEET):
+    add_full_master_haplos_sheet(wb,
+                                 cell_fmt_mg,
+                                 fltred_haplos_mg,
+                                 snps_info_mg,
+                                 )
 if plink_fams_haplos_file_prefix is not None:
     add_full_all_fams_haplos_sheet(wb,
                                    cell_fmt_mg,
                                    plink_gt_mg,
                                    fltred_haplos_mg,
                                    snps_info_mg)
-    if plink_fams_haplos_file_prefix is not None:
+    if fam_workbooks_dir is not None:
+        add_fam_workbooks(wb,
+                          cell_fmt_mg,
+                          plink_gt_mg,
+                          fltred_haplos_mg,
+                          fam_workbooks_dir,
+                          fam_batch_size)
+        info("done writing haplotypes workbooks of the families")
+    else:
         add_fam_haplos_sheets(wb,
                               cell_fmt_mg,
                               plink_gt_mg,
                               fltred_haplos_mg,
                               snps_info_mg)
         info("done adding haplotypes sheet for each family")
-add_report_haplos_sheet(wb,
-                        cell_fmt_mg,
-                        'significant haplos',
-                        report_haplos_mg,
-                        snps_info_mg,
-                        )
+        debug(plink_gt_mg.get_haplos_matcher(fltred_haplos_mg))
+        debug(plink_gt_mg.gt_tensor)
+    if sharing_matrix_file is not None:
+        write_sharing_matrix(sharing_matrix_file, plink_gt_mg)
+        info("haplotypes sharing matrix is written to " + sharing_matrix_file)
+    if matches_file is not None:
+        with metrics.stage(STAGE_EXPORT_MATCHES):
+            write_haplos_matches(matches_file, plink_gt_mg, fltred_haplos_mg)
+        info("haplotypes matches are written to " + matches_file)
+with metrics.stage(STAGE_REPORT_SHEET):
+    add_report_haplos_sheet(wb,
+                            cell_fmt_mg,
+                            'significant haplos',
+                            report_haplos_mg,
+                            snps_info_mg,
+                            )
 info("done adding report for haplotypes with significant p value")
 
-add_addn_csv_sheet(wb, dflt_cell_fmt, "filtered haplotypes", fltred_haplos_file)
-add_addn_csv_sheet(wb, dflt_cell_fmt, "input", report_haplos_file)
+with metrics.stage(STAGE_ADDN_SHEET):
+    add_addn_csv_sheet(wb, dflt_cell_fmt, "filtered haplotypes", fltred_haplos_file)
+with metrics.stage(STAGE_ADDN_SHEET):
+    add_addn_csv_sheet(wb, dflt_cell_fmt, "input", report_haplos_file)
 for i in xrange(len(addn_csvs_list)):
-    add_addn_csv_sheet(wb, addn_sheet_names[i], addn_sheet_csvs[i])
+    with metrics.stage(STAGE_ADDN_SHEET):
+        add_addn_csv_sheet(wb, addn_sheet_names[i], addn_sheet_csvs[i])
+metrics.end_sheet()
+
+with metrics.stage(STAGE_CLOSE):
+    wb.close()
 
-wb.close()
+if metrics_file is not None:
+    metrics.write(metrics_file)
+    info("metrics are written to " + metrics_file)
 
 new_section_txt(" F I N I S H <" + script_name + "> ")
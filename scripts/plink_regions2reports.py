@@ -0,0 +1,307 @@
+import os
+import sys
+import ntpath
+import argparse
+import itertools
+import datetime
+import subprocess
+import multiprocessing
+import numpy as np
+
+from cmm_plink import PlinkBedReader
+from cmm_plink import PlinkTpedReader
+from cmm_plink import get_chrom_code
+from cmm_plink import parse_region
+from cmm_plink import read_pheno_file
+from cmm_plink import write_snps_info
+from cmm_plink import write_ped_map_blocks
+from cmm_plink import IDX_COL_TPED_CHROM
+from cmm_plink import IDX_COL_TPED_POS
+from cmm_hap_assoc import HapAssocEngine
+from cmm_hap_assoc import read_phased_tped
+from cmm_hap_assoc import write_assoc_haps
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HAP_ASSOC2REPORT = os.path.join(SCRIPT_DIR, 'hap_assoc2report.py')
+PLINK2XLS = os.path.join(SCRIPT_DIR, 'plink2xls.py')
+
+ALL_REGIONS = 'All'
+# the filters of script_gen_plink_report.sh
+HAP_ASSOC_MAF = 0.01
+HAP_ASSOC_GENO = 0.1
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to generate the PLINK reports of several regions at once. The genotypes are read once, the PLINK binary files are memory-mapped and the phased and families haplotypes of all the regions are loaded together, then every region is studied and reported by a pool of workers into its own <running key>_<region> directory, as script_gen_plink_report.sh does")
+argp.add_argument('-b', dest='bfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='PLINK binary (.bed/.bim/.fam) input file prefix',
+                        required=True)
+argp.add_argument('-H', dest='phased_tfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='phased haplotypes .tped/.tfam file prefix for the haplotypes association study',
+                        required=True)
+argp.add_argument('-W', dest='window_sizes',
+                        metavar='SIZES',
+                        help='comma-separated haplotype window sizes, as --hap-window of PLINK',
+                        required=True)
+argp.add_argument('-R', dest='regions',
+                        metavar='REGIONS',
+                        help='comma-separated regions of interest in <chrom>[:<from bp>-<to bp>] format (default: ' + ALL_REGIONS + ')',
+                        default=ALL_REGIONS)
+argp.add_argument('-P', dest='pheno_file',
+                        metavar='FILE',
+                        help='PLINK phenotype file (default: None)',
+                        default=None)
+argp.add_argument('-f', dest='fams_haplos_tfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='PLINK families haplotypes database tfile prefix (default: None)',
+                        default=None)
+argp.add_argument('-I', dest='fam_ids',
+                        metavar='IDS',
+                        help='comma-separated family ids of the families haplotypes database (default: all families)',
+                        default=None)
+argp.add_argument('-s', dest='special_fams_info',
+                        metavar='INFORMATION',
+                        help='information of families of interest, as plink2xls.py -s (default: None)',
+                        default=None)
+argp.add_argument('-S', dest='p_value_sig_ratio',
+                        metavar='NUMBER',
+                        help='P-value significant ratio (default: 1e-03)',
+                        default='1e-03')
+argp.add_argument('-C', dest='color_regions_info',
+                        metavar='COLOR INFO',
+                        help='color information of regions of interest of specific families, as plink2xls.py -C (default: None)',
+                        default=None)
+argp.add_argument('-k', dest='running_key',
+                        metavar='NAME',
+                        help='running key, the prefix of the directory of every region',
+                        required=True)
+argp.add_argument('-o', dest='out_dir',
+                        metavar='DIRECTORY',
+                        help='project output directory',
+                        required=True)
+argp.add_argument('-j', '--jobs', dest='n_jobs',
+                        metavar='N',
+                        type=int,
+                        help='number of regions processed at the same time (default: 1)',
+                        default=1)
+argp.add_argument('-D', dest='dev_mode',
+                        action='store_true',
+                        help='enable developer mode of plink2xls.py',
+                        default=False)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+def get_region_key(region):
+    return args.running_key + "_" + region.replace('-', '_').replace(':', '_')
+
+def get_loaded_spans(regions):
+    """
+    the (chrom, from bp, to bp) spans which cover all the regions, one for
+    each chromosome, or the whole genome if any region is
+    """
+    if ALL_REGIONS in regions:
+        return [(None, None, None)]
+    chroms_spans = {}
+    for region in regions:
+        (chrom, from_bp, to_bp) = parse_region(region)
+        chrom = get_chrom_code(chrom)
+        if chrom not in chroms_spans:
+            chroms_spans[chrom] = (from_bp, to_bp)
+            continue
+        (span_from_bp, span_to_bp) = chroms_spans[chrom]
+        if (from_bp is None) or (span_from_bp is None):
+            chroms_spans[chrom] = (None, None)
+        else:
+            chroms_spans[chrom] = (min(from_bp, span_from_bp), max(to_bp, span_to_bp))
+    return map(lambda x: (x, chroms_spans[x][0], chroms_spans[x][1]),
+               sorted(chroms_spans.keys()))
+
+def get_markers_rows(markers, region):
+    """ rows of the markers of the region, in their loaded order """
+    if region == ALL_REGIONS:
+        return np.arange(len(markers))
+    (chrom, from_bp, to_bp) = parse_region(region)
+    chrom = get_chrom_code(chrom)
+    is_selected = np.array(map(lambda x: get_chrom_code(x[IDX_COL_TPED_CHROM]) == chrom,
+                               markers),
+                           dtype=bool)
+    if from_bp is not None:
+        positions = np.array(map(lambda x: int(x[IDX_COL_TPED_POS]), markers),
+                             dtype=np.int64)
+        is_selected &= (positions >= from_bp) & (positions <= to_bp)
+    return np.flatnonzero(is_selected)
+
+def load_phased_haplos(tped_reader, spans, phenos):
+    markers = []
+    codes_blocks = []
+    marker_alleles = []
+    for (chrom, from_bp, to_bp) in spans:
+        (span_markers, span_codes, span_alleles, sample_phenos) = read_phased_tped(tped_reader,
+                                                                                   chrom,
+                                                                                   from_bp,
+                                                                                   to_bp,
+                                                                                   None,
+                                                                                   phenos)
+        markers += span_markers
+        codes_blocks.append(span_codes)
+        marker_alleles += span_alleles
+    return (markers, np.concatenate(codes_blocks), marker_alleles, sample_phenos)
+
+def load_fams_haplos(tped_reader, spans, sample_idxs):
+    markers = []
+    gts_blocks = []
+    for (chrom, from_bp, to_bp) in spans:
+        for (block_markers, gts) in tped_reader.iter_marker_blocks(chrom,
+                                                                   from_bp,
+                                                                   to_bp,
+                                                                   sample_idxs):
+            markers += block_markers
+            gts_blocks.append(gts)
+    if len(gts_blocks) == 0:
+        return (markers, np.zeros((0, len(sample_idxs)), dtype=object))
+    return (markers, np.concatenate(gts_blocks))
+
+def run_script(cmd):
+    # CalledProcessError cannot be passed back from the workers
+    if subprocess.call([sys.executable] + cmd) != 0:
+        raise RuntimeError("failed executing: " + " ".join(cmd))
+
+def gen_region_report(region):
+    """
+    run by the workers, against the data loaded by the main codes. Return
+    the report file name, or None if no significant window has been found
+    """
+    region_key = get_region_key(region)
+    region_out_dir = os.path.join(args.out_dir, region_key)
+    (reports_dir, working_dir, data_out_dir, log_dir) = map(lambda x: os.path.join(region_out_dir, x),
+                                                            ['reports', 'tmp', 'data_out', 'log'])
+    for dir_name in [reports_dir, working_dir, data_out_dir, log_dir]:
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+    # haplotypes association study
+    (markers, allele_codes, marker_alleles, sample_phenos) = phased_haplos
+    rows = get_markers_rows(markers, region)
+    hap_assoc_engine = HapAssocEngine([markers[row] for row in rows],
+                                      allele_codes[rows],
+                                      [marker_alleles[row] for row in rows],
+                                      sample_phenos,
+                                      maf=HAP_ASSOC_MAF,
+                                      geno=HAP_ASSOC_GENO)
+    info(region + ": " + str(hap_assoc_engine))
+    win_nos = hap_assoc_engine.get_window_nos(window_sizes)
+    chunks_results = map(lambda x: hap_assoc_engine.get_chunk_results(x, window_sizes, win_nos),
+                         hap_assoc_engine.get_chunks())
+    hap_assoc_files = write_assoc_haps(os.path.join(working_dir, region_key + "_tmp_assoc_out"),
+                                       window_sizes,
+                                       chunks_results)
+    # merging windows, odds ratio and haplotypes selection
+    raw_out_file = os.path.join(data_out_dir, "raw_plink_out_w_OR.txt")
+    fltred_out_file = os.path.join(data_out_dir, "filtered_haplotypes_out.txt")
+    sig_windows_out_file = os.path.join(data_out_dir, "significant_windows_out.txt")
+    selected_out_file = os.path.join(working_dir, region_key + "_tmp_selected_haplotypes_out")
+    window_hap_assocs = map(lambda x: str(x) + ":" + hap_assoc_files[x], window_sizes)
+    run_script([HAP_ASSOC2REPORT,
+                '-i', ",".join(window_hap_assocs),
+                '-p', args.p_value_sig_ratio,
+                '-r', raw_out_file,
+                '-f', fltred_out_file,
+                '-s', sig_windows_out_file,
+                '-S', selected_out_file,
+                ])
+    if os.path.getsize(sig_windows_out_file) == 0:
+        info(region + ": no significant window has been found")
+        return None
+    # SNPs information and families haplotypes from the shared data
+    snps_info_file = os.path.join(working_dir, region_key + "_tmp_SNPs_info")
+    if region == ALL_REGIONS:
+        snp_idxs = bed_reader.get_snp_idxs()
+    else:
+        snp_idxs = bed_reader.get_snp_idxs(*parse_region(region))
+    write_snps_info(bed_reader,
+                    snps_info_file,
+                    snp_idxs,
+                    bed_reader.get_sample_idxs().tolist(),
+                    phenos)
+    xls_out_file = os.path.join(reports_dir, region_key + "_report.xlsx")
+    cmd = [PLINK2XLS,
+           '-S', snps_info_file,
+           '-H', selected_out_file,
+           '-F', fltred_out_file,
+           '-p', args.p_value_sig_ratio,
+           '-o', xls_out_file,
+           '-l', os.path.join(log_dir, region_key + "_" + running_time + ".log"),
+           ]
+    if fams_haplos is not None:
+        (fams_markers, fams_gts, fams_tfam_recs) = fams_haplos
+        fams_haplos_file_prefix = os.path.join(working_dir, region_key + "_tmp_families_haplotypes")
+        fams_rows = get_markers_rows(fams_markers, region)
+        write_ped_map_blocks(fams_haplos_file_prefix,
+                             [([fams_markers[row] for row in fams_rows], fams_gts[fams_rows])],
+                             fams_tfam_recs)
+        cmd += ['-f', fams_haplos_file_prefix]
+    if args.special_fams_info is not None:
+        cmd += ['-s', args.special_fams_info]
+    if args.color_regions_info is not None:
+        cmd += ['-C', args.color_regions_info]
+    if args.dev_mode:
+        cmd += ['-D']
+    run_script(cmd)
+    return xls_out_file
+
+def iter_regions_reports(regions):
+    if args.n_jobs <= 1:
+        for region in regions:
+            yield gen_region_report(region)
+        return
+    sys.stderr.flush()
+    pool = multiprocessing.Pool(args.n_jobs)
+    try:
+        for xls_out_file in pool.imap(gen_region_report, regions):
+            yield xls_out_file
+    finally:
+        pool.terminate()
+        pool.join()
+
+# ****************************** main codes ******************************
+regions = args.regions.split(',')
+window_sizes = sorted(set(map(int, args.window_sizes.split(','))))
+running_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+if args.pheno_file is not None:
+    phenos = read_pheno_file(args.pheno_file)
+else:
+    phenos = None
+spans = get_loaded_spans(regions)
+
+bed_reader = PlinkBedReader(args.bfile_prefix)
+info("memory-mapped " + str(bed_reader.n_snps) + " SNPs of " + str(bed_reader.n_samples) + " samples from " + args.bfile_prefix)
+phased_haplos = load_phased_haplos(PlinkTpedReader(args.phased_tfile_prefix),
+                                   spans,
+                                   phenos)
+info("loaded " + str(len(phased_haplos[0])) + " markers of phased haplotypes from " + args.phased_tfile_prefix)
+if args.fams_haplos_tfile_prefix is not None:
+    fams_tped_reader = PlinkTpedReader(args.fams_haplos_tfile_prefix)
+    if args.fam_ids is not None:
+        fams_sample_idxs = fams_tped_reader.get_sample_idxs(args.fam_ids.split(','))
+    else:
+        fams_sample_idxs = fams_tped_reader.get_sample_idxs()
+    (fams_markers, fams_gts) = load_fams_haplos(fams_tped_reader,
+                                                spans,
+                                                fams_sample_idxs)
+    fams_haplos = (fams_markers,
+                   fams_gts,
+                   map(lambda x: fams_tped_reader.tfam_recs[x], fams_sample_idxs))
+    info("loaded " + str(len(fams_markers)) + " markers of " + str(len(fams_sample_idxs)) + " families samples from " + args.fams_haplos_tfile_prefix)
+else:
+    fams_haplos = None
+
+for (region, xls_out_file) in itertools.izip(regions, iter_regions_reports(regions)):
+    if xls_out_file is None:
+        info("no report of region " + region + ", no significant window has been found")
+    else:
+        info("report of region " + region + " is written to " + xls_out_file)
@@ -131,6 +131,7 @@ project_working_dir="$project_dir/tmp"
 if [ ! -d "$project_working_dir" ]; then
     mkdir $project_working_dir
 fi
+project_sheet_cache_dir="$project_working_dir/sheet_cache"
 project_data_out_dir="$project_dir/data_out"
 if [ ! -d "$project_data_out_dir" ]; then
     mkdir $project_data_out_dir
@@ -196,6 +197,7 @@ display_param "ANNOVAR root directory (-A)" "$annovar_root_dir"
 display_param "project output directory (-o)" "$project_dir"
 display_param "  reports directory" "$project_reports_dir"
 display_param "  working directory" "$project_working_dir"
+display_param "  sheet cache directory" "$project_sheet_cache_dir"
 display_param "  data output directory" "$project_data_out_dir"
 display_param "  log directory" "$project_log_dir"
 display_param "slurm log directory (-l)" "$slurm_log_dir"
@@ -608,6 +610,11 @@ function generate_xls_report {
     then
         python_cmd+=" -Z $custom_zygo_codes"
     fi
+    # the summary and the families reports share one binary copy of the
+    # mutations csv
+    python_cmd+=" --master-cache"
+    # unchanged sheets are reused from the previous runs
+    python_cmd+=" --sheet-cache $project_sheet_cache_dir"
     python_cmd+=" -A log,$running_log_file"
     python_cmd+=" -l $running_log_file"
     python_cmd+=" $additional_params"
@@ -695,14 +702,12 @@ info_msg "done generating mutations master data for furture use in any mutations
 
 # -------------------- generating summary report --------------------
 new_sub_section_txt "generating mutations summary report"
-# insert zygosities
-summary_mutations_csv="$project_working_dir/$running_key"_summary.tab.csv
-insert_add_on_data "$tmp_master_data" "$mt_vcf_gt_file" "" "" | remove_oth_from_report > "$summary_mutations_csv"
-info_msg "done preparing raw csv sheet to summarize mutations (csv file: $summary_mutations_csv)"
-
-# generate muations summary xls file
+# insert zygosities and generate muations summary xls file, the summary csv
+# is kept so that the families reports can be made from it
+tmp_summary_mutations="$project_working_dir/$running_key"_tmp_summary_mutations
+insert_add_on_data "$tmp_master_data" "$mt_vcf_gt_file" "" "" | remove_oth_from_report > "$tmp_summary_mutations"
 summary_report_params=" -o $summary_xls_out"
-summary_report_params+=" -s all,$summary_mutations_csv"
+summary_report_params+=" -s all,$tmp_summary_mutations"
 #    python_cmd+=" -c $n_col_main,$(( n_col_main+n_col_mt_vcf_gt ))"
 generate_xls_report "$summary_report_params"
 
@@ -718,43 +723,30 @@ then
         family_xls_out="$project_reports_dir/$running_key"_fam"$family_code".xlsx
 
         new_sub_section_txt "generating family report for family $family_code ($number_of_members member(s))"
-        # for each member in the family generate a sheet for a report
+        # for each member in the family generate a sheet for a report, the
+        # sheets select the member zygosities from the summary csv (and its
+        # master data cache) instead of joining them again
+        unset raw_member_codes
         for (( member_idx=1; member_idx<=$number_of_members; member_idx++ ))
         do
             raw_member_code=${family_info_array[$member_idx]}
             displayed_member_code=${raw_member_code#*-}
             displayed_member_codes[$member_idx]=$displayed_member_code
-            member_mutations_csv=$project_working_dir/"$running_key"_fam"$family_code"_"$displayed_member_code".tab.csv
-            member_mutations_csvs[$member_idx]="$member_mutations_csv"
-            tmp_zygosity=$project_working_dir/"$running_key"_fam"$family_code"_"$displayed_member_code"_tmp_zygosity
-            # get member column index from the zygosities file
-            member_zygo_col_idx=$( get_col_idx $mt_vcf_gt_file $raw_member_code )
-            member_zygo_col_idxs[$member_idx]=$member_zygo_col_idx
-            info_msg "generating zygosities of $displayed_member_code (idx $member_zygo_col_idx) using data from $mt_vcf_gt_file"
-            get_common_zygosities "$mt_vcf_gt_file" "$member_zygo_col_idx" > "$tmp_zygosity"
-            insert_add_on_data "$tmp_master_data" $tmp_zygosity "" "" | remove_oth_from_report > "$member_mutations_csv"
-            info_msg "done preparing raw csv sheet for $displayed_member_code (csv file: $member_mutations_csv)"
+            raw_member_codes[$member_idx]=$raw_member_code
+            info_msg "zygosities of $displayed_member_code will be selected from $tmp_summary_mutations"
         done
-        if [ $number_of_members -gt 1 ]; then
-            concated_member_zygo_col_idx=$(IFS=, ; echo "${member_zygo_col_idxs[*]}")
-            shared_mutations_csv=$project_working_dir/"$running_key"_fam"$family_code"_shared.tab.csv
-            tmp_zygosity=$project_working_dir/"$running_key"_fam"$family_code"_shared_tmp_zygosity
-            info_msg "generating zygosities of all members (idx $concated_member_zygo_col_idx) using data from $mt_vcf_gt_file"
-            get_common_zygosities "$mt_vcf_gt_file" "$concated_member_zygo_col_idx" > "$tmp_zygosity"
-            insert_add_on_data "$tmp_master_data" $tmp_zygosity "" "" | remove_oth_from_report > "$shared_mutations_csv"
-            info_msg "done preparing raw csv sheet for all members (csv file: $shared_mutations_csv)"
-        fi
         ## generate family xls file
         family_report_params=" -o $family_xls_out -i S"
-        family_sheet_params="${displayed_member_codes[1]},${member_mutations_csvs[1]}"
+        family_sheet_params="${displayed_member_codes[1]},$tmp_summary_mutations,${raw_member_codes[1]}"
         for (( member_idx=2; member_idx<=$number_of_members; member_idx++ ))
         do
-            family_sheet_params+=":${displayed_member_codes[$member_idx]},${member_mutations_csvs[$member_idx]}"
+            family_sheet_params+=":${displayed_member_codes[$member_idx]},$tmp_summary_mutations,${raw_member_codes[$member_idx]}"
         done
         if [ $number_of_members -gt 1 ]; then
-            family_report_params+=" -s shared,$shared_mutations_csv:$family_sheet_params"
+            concated_raw_member_codes=$(IFS='|' ; echo "${raw_member_codes[*]}")
+            family_report_params+=" -s \"shared,$tmp_summary_mutations,$concated_raw_member_codes:$family_sheet_params\""
         else
-            family_report_params+=" -s $family_sheet_params"
+            family_report_params+=" -s \"$family_sheet_params\""
         fi
         generate_xls_report "$family_report_params"
     done
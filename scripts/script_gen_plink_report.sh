@@ -8,9 +8,9 @@ TOTAL_RUN_TIME_DEFAULT="7-00:00:00"
 PLINK_REGION_DEFAULT="All"
 PLINK_PHENO_FILE_DEFAULT=""
 FAMILIES_HAPLOTYPES_FILE_DEFAULT=""
+PHASED_HAPLOTYPES_FILE_DEFAULT=""
 PVALUE_SIGNIFICANCE_RATIO_DEFAULT="1e-03"
 USE_CACHED_PLINK_HAP_ASSOC_DEFAULT="Off"
-USE_CACHED_PLINK_EXTRA_INFO_DEFAULT="Off"
 DEVELOPER_MODE_DEFAULT="Off"
 
 usage=$(
@@ -20,18 +20,20 @@ $0 [OPTION]
 option:
 -p {project code}   specify UPPMAX project code (default: no job)
 -T {time}           set a limit on the total run time of the job allocation. (defuault: $TOTAL_RUN_TIME_DEFAULT)
+-j {number}         specify the number of PLINK haplotype windows running at the same time without project code (default: number of CPUs), or the number of processes of the built-in haplotype association engine with -H (default: 1)
+-M {MB}             specify the memory limit of the PLINK haplotype windows running at the same time without project code (default: physical memory)
 -k {name}           specify a name that will act as unique keys of temporary files and default name for unspecified output file names (required)
 -b {file prefix}    specify PLINK input bfile prefix (required)
 -W {window list}    specify PLINK haplotype window sizes for association study (comma separated, e.g., -W 1,2) (required)
 -R {region}         specify PLINK region of interest (default: $PLINK_REGION_DEFAULT)
 -P {file}           specify PLINK phenotype file (default: None)
+-H {file prefix}    specify phased haplotypes tfile prefix to run the built-in haplotype association engine instead of PLINK (default: None)
 -f {file prefix}    specify PLINK families haplotypes database tfile prefix (default: None)
 -I {ids}            specify PLINK tfam family ids (comma separated, e.g., -I fam_8,fam_24) (default: None)
 -s {information}    specify informaiton of families of interest (default: None)
 -S {number}         specify P-value significant ratio (default: $PVALUE_SIGNIFICANCE_RATIO_DEFAULT)
 -C {color info}     specify color information of region of interest of specific family (default: None)
--a                  use cached for PLINK haplotype association study (default: $CACHED_PLINK_HAP_ASSOC_DEFAULT)
--r                  use cached to get PLINK extra information for report (default: $CACHED_PLINK_EXTRA_INFO_DEFAULT) 
+-a                  use cached for PLINK haplotype association study from the working directory without validation, instead of the checksum-keyed cache (default: $CACHED_PLINK_HAP_ASSOC_DEFAULT)
 -D                  indicated to enable developer mode (default: DEVELOPER_MODE_DEFAULT)
 -o {directory}      specify project output directory (required)
 -l {directory}	    specify slurm log directory (required)
@@ -47,7 +49,7 @@ die () {
 }
 
 # parse option
-while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:arDo:l:" OPTION; do
+while getopts ":p:T:j:M:k:b:W:P:H:f:I:s:R:S:C:aDo:l:" OPTION; do
   case "$OPTION" in
     p)
       project_code="$OPTARG"
@@ -55,6 +57,12 @@ while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:arDo:l:" OPTION; do
     T)
       total_run_time="$OPTARG"
       ;;
+    j)
+      local_n_jobs="$OPTARG"
+      ;;
+    M)
+      local_mem_limit="$OPTARG"
+      ;;
     k)
       running_key="$OPTARG"
       ;;
@@ -67,6 +75,9 @@ while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:arDo:l:" OPTION; do
     P)
       plink_pheno_file="$OPTARG"
       ;;
+    H)
+      phased_haplos_tfile_prefix="$OPTARG"
+      ;;
     f)
       plink_fams_haplos_db_tfile_prefix="$OPTARG"
       ;;
@@ -88,9 +99,6 @@ while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:arDo:l:" OPTION; do
     a)
       use_cached_plink_hap_assoc="On"
       ;;
-    r)
-      use_cached_plink_extra_info="On"
-      ;;
     D)
       dev_mode="On"
       ;;
@@ -121,10 +129,10 @@ done
 : ${total_run_time=$TOTAL_RUN_TIME_DEFAULT}
 : ${plink_region=$PLINK_REGION_DEFAULT}
 : ${plink_pheno_file=$PLINK_PHENO_FILE_DEFAULT}
+: ${phased_haplos_tfile_prefix=$PHASED_HAPLOTYPES_FILE_DEFAULT}
 : ${plink_fams_haplos_db_tfile_prefix=$FAMILIES_HAPLOTYPES_FILE_DEFAULT}
 : ${pvalue_significance_ratio=$PVALUE_SIGNIFICANCE_RATIO_DEFAULT}
 : ${use_cached_plink_hap_assoc=$USE_CACHED_PLINK_HAP_ASSOC_DEFAULT}
-: ${use_cached_plink_extra_info=$USE_CACHED_PLINK_EXTRA_INFO_DEFAULT}
 : ${dev_mode=$DEVELOPER_MODE_DEFAULT}
 
 project_reports_dir="$project_out_dir/reports"
@@ -139,6 +147,10 @@ project_data_out_dir="$project_out_dir/data_out"
 if [ ! -d "$project_data_out_dir" ]; then
     mkdir $project_data_out_dir
 fi
+project_cache_dir="$project_out_dir/cache"
+if [ ! -d "$project_cache_dir" ]; then
+    mkdir $project_cache_dir
+fi
 project_log_dir="$project_out_dir/log"
 if [ ! -d "$project_log_dir" ]; then
     mkdir $project_log_dir
@@ -269,12 +281,21 @@ else
     display_param "  start position" "$plink_from_bp"
     display_param "  end position" "$plink_to_bp"
 fi
+display_param "cache directory" "$project_cache_dir"
 display_param "using cached PLINK haplotype association" "$use_cached_plink_hap_assoc"
-display_param "using cached PLINK extra SNPs information" "$use_cached_plink_extra_info"
+if [ -z "$project_code" ]
+then
+    display_param "number of local PLINK haplotype windows jobs (-j)" "${local_n_jobs:-number of CPUs}"
+    display_param "memory limit of local PLINK haplotype windows jobs (-M)" "${local_mem_limit:-physical memory}"
+fi
 if [ ! -z "$plink_pheno_file" ]
 then
     display_param "PLINK phenotype file (-P)" "$plink_pheno_file"
 fi
+if [ ! -z "$phased_haplos_tfile_prefix" ]
+then
+    display_param "phased haplotypes tfile prefix (-H)" "$phased_haplos_tfile_prefix"
+fi
 if [ ! -z "$plink_fams_haplos_db_tfile_prefix" ]
 then
     display_param "families haplotypes database tfile prefix (-f)" "$plink_fams_haplos_db_tfile_prefix"
@@ -302,28 +323,6 @@ then
 fi
 
 # ****************************************  executing  ****************************************
-COL_HAP_ASSOC_LOCUS=1
-COL_HAP_ASSOC_HAPLOTYPE=2
-COL_HAP_ASSOC_F_A=3
-COL_HAP_ASSOC_F_U=4
-COL_HAP_ASSOC_CHISQ=5
-COL_HAP_ASSOC_DF=6
-COL_HAP_ASSOC_P_VALUE=7
-COL_HAP_ASSOC_SNPS=8
-NEW_COL_HAP_ASSOC_P_VALUE=8
-NEW_COL_HAP_ASSOC_SNPS=9
-COL_HAP_ASSOC_INSERTED_OR=6
-
-COL_STAT_CHR=1
-COL_STAT_SNP=2
-COL_STAT_CLST=3
-COL_STAT_N_MISS=4
-COL_STAT_N_GENO=5
-COL_STAT_N_CLUS=6
-COL_STAT_F_MISS=7
-
-COL_TFILE_CHR=1
-COL_TFILE_POS=4
 
 # ---------- General functions --------------
 function submit_cmd {
@@ -353,6 +352,26 @@ function submit_cmd {
     echo ${queue_txt[0]}
 }
 
+# derived data are cached under a key of the size and modification time of
+# their input files together with the parameters used to derive them
+function get_files_signature {
+    for file_name in "$@"
+    do
+        echo -n " $file_name:"`stat -L -c "%s:%Y" "$file_name"`
+    done
+}
+
+function get_cache_key {
+    echo "$1" | md5sum | cut -d' ' -f1
+}
+
+function store_in_cache {
+    src_file=$1
+    cached_file=$2
+
+    cp "$src_file" "$cached_file".$$ && mv "$cached_file".$$ "$cached_file"
+}
+
 function get_job_status {
     job_id=$1
 
@@ -379,15 +398,40 @@ then
     plink_base_cmd+=" --pheno $plink_pheno_file"
 fi
 plink_base_cmd+=" --hap-assoc --geno 0.1 --maf 0.01"
+if [ ! -z "$phased_haplos_tfile_prefix" ]
+then
+    hap_assoc_inputs_sig="$HAP_ASSOC"`get_files_signature "$phased_haplos_tfile_prefix".tped "$phased_haplos_tfile_prefix".tfam`
+else
+    hap_assoc_inputs_sig="plink"`get_files_signature "$plink_input_bfile_prefix".bed "$plink_input_bfile_prefix".bim "$plink_input_bfile_prefix".fam`
+fi
+if [ ! -z "$plink_pheno_file" ]
+then
+    hap_assoc_inputs_sig+=`get_files_signature "$plink_pheno_file"`
+fi
+hap_assoc_inputs_sig+=" $plink_region --geno 0.1 --maf 0.01"
 
 # ---------- generating haplotype association study data for each window --------------
 IFS=',' read -ra list_plink_hap_window_sizes <<< "$plink_hap_window_sizes"
+generated_window_sizes=""
 for (( i=0; i<$((${#list_plink_hap_window_sizes[@]})); i++ ))
 do
     window_size="${list_plink_hap_window_sizes[$i]}"
     job_key="$running_key"_win_$window_size
     tmp_hap_assoc_out_prefix[$i]="$tmp_hap_assoc_out_base_prefix"_$window_size
+    cached_hap_assoc_out_prefix[$i]="$project_cache_dir/hap_assoc_"`get_cache_key "$hap_assoc_inputs_sig --hap-window $window_size"`
+    if [ "$use_cached_plink_hap_assoc" == "Off" ] && [ -f "${cached_hap_assoc_out_prefix[$i]}".assoc.hap ]
+    then
+        info_msg "using cached haplotype association study data of window $window_size (${cached_hap_assoc_out_prefix[$i]}.assoc.hap)"
+        tmp_hap_assoc_out_prefix[$i]="${cached_hap_assoc_out_prefix[$i]}"
+        continue
+    fi
+    generated_window_sizes+=",$window_size"
     submit_job_cmd="$plink_base_cmd --out ${tmp_hap_assoc_out_prefix[$i]} --hap-window $window_size"
+    if [ ! -z "$phased_haplos_tfile_prefix" ]
+    then
+        # all windows are computed at once by the built-in engine below
+        continue
+    fi
     if [ ! -z "$project_code" ]
     then
         if [ "$window_size" -ge "50" ]
@@ -401,14 +445,36 @@ do
     else
         if [ "$use_cached_plink_hap_assoc" == "Off" ]
         then
-            debug_msg "executing: $submit_job_cmd "
-            eval "$submit_job_cmd"
+            # windows are run by a local pool of workers while merging them
+            local_window_cmd="$plink_base_cmd --out {out_prefix} --hap-window {window_size}"
         else
             info_msg "using cache data for haplotype association study window $window_size"
         fi
     fi
 done
-if [ ! -z "$project_code" ]
+if [ ! -z "$phased_haplos_tfile_prefix" ] && [ ! -z "$generated_window_sizes" ]
+then
+    hap_assoc_cmd="python $HAP_ASSOC -t $phased_haplos_tfile_prefix -W ${generated_window_sizes:1} -o $tmp_hap_assoc_out_base_prefix --geno 0.1 --maf 0.01"
+    if [ "$plink_region" != "All" ]
+    then
+        hap_assoc_cmd+=" -R $plink_region"
+    fi
+    if [ ! -z "$plink_pheno_file" ]
+    then
+        hap_assoc_cmd+=" -P $plink_pheno_file"
+    fi
+    if [ ! -z "$local_n_jobs" ]
+    then
+        hap_assoc_cmd+=" -j $local_n_jobs"
+    fi
+    if [ "$use_cached_plink_hap_assoc" == "Off" ]
+    then
+        debug_msg "executing: $hap_assoc_cmd "
+        eval "$hap_assoc_cmd"
+    else
+        info_msg "using cache data for haplotype association study"
+    fi
+elif [ ! -z "$project_code" ]
 then
     PENDING_STATUS="PENDING"
     COMPLETED_STATUS="COMPLETED"
@@ -432,61 +498,58 @@ then
         sleep 10
     done
 fi
-info_msg "done generating haplotype association study data for window size $plink_hap_window_sizes"
+if [ -z "$local_window_cmd" ]
+then
+    info_msg "done generating haplotype association study data for window size $plink_hap_window_sizes"
+fi
 
-# ---------- merging PLINK assoc.hap files --------------
-tmp_merged_hap_assoc="$project_working_dir/$running_key"_tmp_merged_hap_assoc
-head -1 ${tmp_hap_assoc_out_prefix[0]}.assoc.hap > $tmp_merged_hap_assoc
+# ---------- merging PLINK assoc.hap files, calculating odds ratio and filtering haplotypes --------------
+# 1. good quality haplotypes: F_A > F_U and P < 0.05
+# 2. significant haplotypes: P < $pvalue_significance_ratio
+# 3. selected haplotypes: good quality haplotypes sharing any SNP with the significant ones
+tmp_selected_haplotypes_out="$project_working_dir/$running_key"_tmp_selected_haplotypes_out
+tmp_uniq_list_xls_SNPs="$project_working_dir/$running_key"_tmp_uniq_list_xls_SNPs
+window_hap_assocs=""
 for (( i=0; i<$((${#tmp_hap_assoc_out_prefix[@]})); i++ ))
 do
-    grep -v "HAPLOTYPE" ${tmp_hap_assoc_out_prefix[$i]}.assoc.hap | sed s/WIN/WIN${list_plink_hap_window_sizes[$i]}_/g >> $tmp_merged_hap_assoc
+    window_hap_assocs+=",${list_plink_hap_window_sizes[$i]}:${tmp_hap_assoc_out_prefix[$i]}.assoc.hap"
 done
-info_msg "done merging all haplotype assocation study result of all window size (output: $tmp_merged_hap_assoc)"
-
-# ---------- calculating odds ratio --------------
-cal_odds_ratio_cmd="awk '{
-if (\$$COL_HAP_ASSOC_HAPLOTYPE == \"OMNIBUS\" || \$$COL_HAP_ASSOC_F_A == \"1\"  || \$$COL_HAP_ASSOC_F_A == \"0\" || \$$COL_HAP_ASSOC_F_U == \"1\" || \$$COL_HAP_ASSOC_F_U == \"0\") 
-    printf \"%s\t%s\t%s\t%s\t%s\tNA\t%s\t%s\t%s\n\", \$1, \$2, \$3, \$4, \$5, \$6, \$7, \$8
-else if (\$$COL_HAP_ASSOC_HAPLOTYPE == \"HAPLOTYPE\")  
-    printf \"%s\t%s\t%s\t%s\t%s\tOR\t%s\t%s\t%s\n\", \$1, \$2, \$3, \$4, \$5, \$6, \$7, \$8
-else {
-    F_A=strtonum(\$$COL_HAP_ASSOC_F_A)
-    F_U=strtonum(\$$COL_HAP_ASSOC_F_U)
-    odds_ratio=(F_A/(1-F_A))/(F_U/(1-F_U))
-    printf \"%s\t%s\t%s\t%s\t%s\t%0.4f\t%s\t%s\t%s\n\", \$1, \$2, \$3, \$4, \$5, odds_ratio, \$6, \$7, \$8
-    }
-}' $tmp_merged_hap_assoc > $raw_plink_out_with_odds_ratio"
+hap_assoc_report_cmd="python $HAP_ASSOC2REPORT -i ${window_hap_assocs:1}"
+hap_assoc_report_cmd+=" -p $pvalue_significance_ratio"
+hap_assoc_report_cmd+=" -r $raw_plink_out_with_odds_ratio"
+hap_assoc_report_cmd+=" -f $filtered_haplotypes_out"
+hap_assoc_report_cmd+=" -s $significant_windows_out"
+hap_assoc_report_cmd+=" -S $tmp_selected_haplotypes_out"
+hap_assoc_report_cmd+=" -u $tmp_uniq_list_xls_SNPs"
+if [ ! -z "$local_window_cmd" ]
+then
+    hap_assoc_report_cmd+=" -c \"$local_window_cmd\""
+    hap_assoc_report_cmd+=" -g ${generated_window_sizes:1}"
+    hap_assoc_report_cmd+=" --job-input $plink_input_bfile_prefix.bed"
+    if [ ! -z "$local_n_jobs" ]
+    then
+        hap_assoc_report_cmd+=" -j $local_n_jobs"
+    fi
+    if [ ! -z "$local_mem_limit" ]
+    then
+        hap_assoc_report_cmd+=" -M $local_mem_limit"
+    fi
+fi
 debug_msg
-debug_msg "executing: $cal_odds_ratio_cmd "
-eval "$cal_odds_ratio_cmd"
+debug_msg "executing: $hap_assoc_report_cmd "
+if eval "$hap_assoc_report_cmd" && [ "$use_cached_plink_hap_assoc" == "Off" ]
+then
+    for (( i=0; i<$((${#tmp_hap_assoc_out_prefix[@]})); i++ ))
+    do
+        if [ "${tmp_hap_assoc_out_prefix[$i]}" != "${cached_hap_assoc_out_prefix[$i]}" ]
+        then
+            store_in_cache "${tmp_hap_assoc_out_prefix[$i]}".assoc.hap "${cached_hap_assoc_out_prefix[$i]}".assoc.hap
+        fi
+    done
+fi
 info_msg "done calculating odds ratio (output: $raw_plink_out_with_odds_ratio)"
-
-# ---------- filtering haplotype with significant P value, F_A, F_U, and odds ratio --------------
-# 1. F_A > F_U
-# 2. P < 0.05
-filtering_haplotype_cmd="awk '{
-if (\$$COL_HAP_ASSOC_HAPLOTYPE == \"HAPLOTYPE\")  
-    printf \"%s\n\", \$0
-else { 
-    F_A=strtonum(\$$COL_HAP_ASSOC_F_A)
-    F_U=strtonum(\$$COL_HAP_ASSOC_F_U)
-    P_VALUE=strtonum(\$$NEW_COL_HAP_ASSOC_P_VALUE)
-    ORS=strtonum(\$$COL_HAP_ASSOC_INSERTED_OR)
-    if ((F_A > F_U) && (P_VALUE < 0.05))
-        printf \"%s\n\", \$0
-    }
-}' $raw_plink_out_with_odds_ratio | grep -v \"OMNIBUS\" | grep -v \"NA\" > $filtered_haplotypes_out"
-debug_msg
-debug_msg "executing: $filtering_haplotype_cmd "
-eval "$filtering_haplotype_cmd"
 info_msg "done filtering good quality haplotypes (output: $filtered_haplotypes_out)"
 
-# ---------- filtering windows with significant P value below significant threshold --------------
-filter_pvalue_cmd="awk -F'\t' '{if (\$$NEW_COL_HAP_ASSOC_P_VALUE<$pvalue_significance_ratio) printf \"%s\n\", \$0}' $filtered_haplotypes_out > $significant_windows_out"
-debug_msg
-debug_msg "executing: $filter_pvalue_cmd "
-eval "$filter_pvalue_cmd"
-
 number_of_significant_windows=$( cat $significant_windows_out | wc -l )
 if [ "$number_of_significant_windows" -le "0" ]
 then
@@ -497,201 +560,41 @@ then
     exit
 fi
 info_msg "done picking significant haplotypes (p value < $pvalue_significance_ratio) (output: $significant_windows_out)"
-
-# ---------- Using SNPs from windows with significant P value to get significant haplotypes --------------
-tmp_all_list_significant_SNPs="$project_working_dir/$running_key"_tmp_all_list_significant_SNPs
-tmp_significant_haplotypes="$project_working_dir/$running_key"_tmp_significant_haplotypes
-if [ -f "$tmp_significant_haplotypes" ]
-then
-    rm $tmp_significant_haplotypes
-fi
-
-n_list=0
-cut -f"$NEW_COL_HAP_ASSOC_SNPS" "$significant_windows_out" |
-while read list_SNPs_in
-do
-    let n_list++
-#    echo "$list_SNPs_in"
-    IFS='|' read -ra tmp_SNPs <<< "$list_SNPs_in"
-    # get all the significant haplotypes that have any of uniq SNPs
-    for (( i=0; i<$((${#tmp_SNPs[@]})); i++ ))
-    do
-        grep "${tmp_SNPs[$i]}" "$filtered_haplotypes_out" | sed s/WIN/HAP"$n_list"_WIN/g >> "$tmp_significant_haplotypes"
-    done
-done
-
-# uniq the significant haplotypes from above
-tmp_selected_haplotypes_out="$project_working_dir/$running_key"_tmp_selected_haplotypes_out
-get_selected_haplotypes_cmd="head -1 $filtered_haplotypes_out > $tmp_selected_haplotypes_out; sort -k2,$NEW_COL_HAP_ASSOC_SNPS $tmp_significant_haplotypes | uniq -f1 | sort -k1,1 -V >> $tmp_selected_haplotypes_out"
-debug_msg
-debug_msg "executing: $get_selected_haplotypes_cmd "
-eval "$get_selected_haplotypes_cmd"
 info_msg "done selecting haplotypes within the range of the significant ones (output: $tmp_selected_haplotypes_out)"
-
-info_msg
-info_msg "> > > > > > > > > > > > > > > > > > > > Preparing SNPs information for PLINK report < < < < < < < < < < < < < < < < < < < < "
-# ---------- generating list of uniq SNPs based on the filtering good quality haplotypes --------------
-tmp_all_list_xls_SNPs="$project_working_dir/$running_key"_tmp_all_list_xls_SNPs
-if [ -f "$tmp_all_list_xls_SNPs" ]
-then
-    rm $tmp_all_list_xls_SNPs
-fi
-
-cut -f"$NEW_COL_HAP_ASSOC_SNPS" "$filtered_haplotypes_out" |
-while read list_SNPs_in
-do
-    IFS='|' read -ra tmp_SNPs <<< "$list_SNPs_in"
-    for (( i=0; i<$((${#tmp_SNPs[@]})); i++ ))
-    do
-    	echo "${tmp_SNPs[$i]}" >> $tmp_all_list_xls_SNPs
-    done
-done
-
-# uniq list of SNPs from above
-tmp_uniq_list_xls_SNPs="$project_working_dir/$running_key"_tmp_uniq_list_xls_SNPs
-sort "$tmp_all_list_xls_SNPs" | uniq | grep -v "SNPS" > "$tmp_uniq_list_xls_SNPs"
 info_msg "done praparing uniq SNPs codes (output: $tmp_uniq_list_xls_SNPs)"
 
-if [ "$plink_region" != "All" ]
-then
-    if [ ! -z "$plink_from_bp" ]
-    then
-	    plink_base_cmd+=" --chr $plink_chrom --from-bp $plink_from_bp --to-bp $plink_to_bp"
-    else
-	    plink_base_cmd+=" --chr $plink_chrom"
-    fi
-fi
-# extract SNPs position from PLINK binary files
-tmp_extract_SNPs_position_prefix="$project_working_dir/$running_key"_tmp_extract_SNPs_position
-extract_SNPs_position_from_bed_cmd="plink --noweb --bfile $plink_input_bfile_prefix --recode --tab --chr $plink_chrom"
-if [ ! -z "$plink_from_bp" ]
-then
-    extract_SNPs_position_from_bed_cmd+=" --from-bp $plink_from_bp --to-bp $plink_to_bp"
-fi
-extract_SNPs_position_from_bed_cmd+=" --out $tmp_extract_SNPs_position_prefix"
-if [ "$use_cached_plink_extra_info" == "Off" ]
-then
-    debug_msg "executing: $extract_SNPs_position_from_bed_cmd"
-    eval "$extract_SNPs_position_from_bed_cmd"
-fi
-
-# extract SNPs genotyping statistics from PLINK binary files
-tmp_extract_SNPs_stat_prefix="$project_working_dir/$running_key"_tmp_extract_SNPs_stat
-extract_SNPs_stat_from_bed_cmd="plink --noweb --bfile $plink_input_bfile_prefix --missing --chr $plink_chrom"
-if [ ! -z "$plink_from_bp" ]
-then
-    extract_SNPs_stat_from_bed_cmd+=" --from-bp $plink_from_bp --to-bp $plink_to_bp"
-fi
-extract_SNPs_stat_from_bed_cmd+=" --out $tmp_extract_SNPs_stat_prefix --within $plink_pheno_file"
-if [ "$use_cached_plink_extra_info" == "Off" ]
-then
-    debug_msg "executing: $extract_SNPs_stat_from_bed_cmd "
-    eval "$extract_SNPs_stat_from_bed_cmd"
-fi
-if [ "$use_cached_plink_extra_info" != "Off" ]
-then
-    info_msg "using cache data instead of using PLINK binary data to extract SNPs position and missing genotyping rate (PLINK file prefix: $plink_input_bfile_prefix)"
-fi
-
-# generating SNPs info file
-tmp_SNPs_info="$project_working_dir/$running_key"_tmp_SNPs_info
-join_snps_info_cmd="join -t $'\t' -j 1 -o 0,1.2,1.3,2.2,2.3 <( join -t $'\t' -j 1 -o 0,1.2,2.2 <( awk 'BEGIN { printf \"SNP\tF_MISS_A\n\" }{ if (\$$COL_STAT_CLST == \"2\" ) printf \"%s\t%s\n\", \$$COL_STAT_SNP, \$$COL_STAT_F_MISS }' $tmp_extract_SNPs_stat_prefix.lmiss) <( awk 'BEGIN { printf \"SNP\tF_MISS_U\n\" }{ if (\$$COL_STAT_CLST == \"1\" ) printf \"%s\t%s\n\", \$$COL_STAT_SNP, \$$COL_STAT_F_MISS }' $tmp_extract_SNPs_stat_prefix.lmiss )) <( awk -F'\t' 'BEGIN { printf \"SNP\tCHROM\tPOS\n\" }{ printf \"%s\t%s\t%s\n\", \$2, \$1, \$4}' $tmp_extract_SNPs_position_prefix.map ) > $tmp_SNPs_info"
-debug_msg
-debug_msg "executing: $join_snps_info_cmd "
-eval "$join_snps_info_cmd"
-info_msg "done annotating SNPs position and missing genotyping rate (output : $tmp_SNPs_info)"
-
 # ---------- prepare haplotypes families information if indicated --------------
 if [ ! -z "$plink_fams_haplos_db_tfile_prefix" ]
 then
     tmp_fams_haplos_db_file_prefix="$project_working_dir/$running_key"_tmp_families_haplotypes
-    # picking only markers of interest
-    tmp_awk_filter_row_out="$project_working_dir/$running_key"_tmp_awk_filter_row
+    info_msg
+    info_msg "> > > > > > > > > > > > > > > > > > > > Preparing haplotypes families information < < < < < < < < < < < < < < < < < < < < "
+    # picking only markers and individuals of interest, the tped file is
+    # read through its chromosomes index and transposed a block at a time
+    fams_haplos_db_sig="$TPED2PED"`get_files_signature "$plink_fams_haplos_db_tfile_prefix".tped "$plink_fams_haplos_db_tfile_prefix".tfam`
+    cached_fams_haplos_db_file_prefix="$project_cache_dir/fams_haplos_"`get_cache_key "$fams_haplos_db_sig $plink_region $plink_tfam_family_ids"`
+    tped2ped_cmd="python $TPED2PED -t $plink_fams_haplos_db_tfile_prefix -o $tmp_fams_haplos_db_file_prefix"
     if [ "$plink_region" != "All" ]
     then
-	    tmp_awk_filter_row_cmd="awk -F'\t' '{"
-        if [ ! -z "$plink_from_bp" ]
-        then
-	        tmp_awk_filter_row_cmd+=" if ((\$$COL_TFILE_CHR == \"$plink_chrom\" ) && (\$$COL_TFILE_POS > $plink_from_bp) && (\$$COL_TFILE_POS < $plink_to_bp))"
-        else
-	        tmp_awk_filter_row_cmd+=" if (\$$COL_TFILE_CHR == \"$plink_chrom\" )"
-        fi
-	    tmp_awk_filter_row_cmd+=" printf \"%s\n\", \$0}' $plink_fams_haplos_db_tfile_prefix.tped > $tmp_awk_filter_row_out"
-    else
-	    tmp_awk_filter_row_cmd="cp $plink_fams_haplos_db_tfile_prefix.tped $tmp_awk_filter_row_out"
+        tped2ped_cmd+=" -R $plink_region"
     fi
-    info_msg
-    info_msg "> > > > > > > > > > > > > > > > > > > > Preparing haplotypes families information < < < < < < < < < < < < < < < < < < < < "
-    debug_msg
-    debug_msg "executing: $tmp_awk_filter_row_cmd "
-    eval "$tmp_awk_filter_row_cmd"
-
-    # picking only individuals of interest
-    tmp_cut_filter_col_out="$project_working_dir/$running_key"_tmp_cut_filter_col
     if [ ! -z "$plink_tfam_family_ids" ]
     then
-	    # preparing command to generate output tped file
-	    tmp_cut_filter_col_cmd="cut -f1-4"
-	    tmp_row_list=""
-        for (( i=0; i<$((${#tfam_family_ids[@]})); i++ ))
-        do
-	        grep_cmd="grep -nP \"^${tfam_family_ids[$i]}\t\" $plink_fams_haplos_db_tfile_prefix.tfam"
-	        IFS=':' read -ra tmp_extract_individual_col <<< "`eval $grep_cmd`"
-	        tmp_row=${tmp_extract_individual_col[0]}
-	        tmp_row_list+=",$tmp_row"
-	        tmp_cut_filter_col_cmd+=",$((tmp_row+4))"
-        done
-	    tmp_cut_filter_col_cmd+=" $tmp_awk_filter_row_out > $tmp_fams_haplos_db_file_prefix.tped"
-
-	    # generating tfam file
-	    if [ -f "$tmp_fams_haplos_db_file_prefix.tfam" ]
+        tped2ped_cmd+=" -I $plink_tfam_family_ids"
+    fi
+    if [ -f "$cached_fams_haplos_db_file_prefix".ped ] && [ -f "$cached_fams_haplos_db_file_prefix".map ]
+    then
+        info_msg "using cached haplotypes families information ($cached_fams_haplos_db_file_prefix)"
+        tmp_fams_haplos_db_file_prefix="$cached_fams_haplos_db_file_prefix"
+    else
+        debug_msg
+        debug_msg "executing: $tped2ped_cmd "
+        if eval "$tped2ped_cmd"
         then
-            rm "$tmp_fams_haplos_db_file_prefix.tfam"
+            store_in_cache "$tmp_fams_haplos_db_file_prefix".map "$cached_fams_haplos_db_file_prefix".map
+            store_in_cache "$tmp_fams_haplos_db_file_prefix".ped "$cached_fams_haplos_db_file_prefix".ped
         fi
-	    sort_row_list=`echo "$tmp_row_list" | tr "," "\n" | sort -n | tr "\n" " " | sed 's/,$//' | sed 's/^,//'`
-	    for sorted_row in `echo $sort_row_list`; 
-	    do
-	        sed -n "$sorted_row"p $plink_fams_haplos_db_tfile_prefix.tfam >> "$tmp_fams_haplos_db_file_prefix.tfam"
-	    done
-    else
-        # preparing command to generate output tped file
-        tmp_cut_filter_col_cmd+=" cp $tmp_awk_filter_row_out $tmp_fams_haplos_db_file_prefix.tped"
-        
-        # generating tfam file
-        cp $plink_fams_haplos_db_tfile_prefix.tfam "$tmp_fams_haplos_db_file_prefix.tfam"
     fi
-    debug_msg
-    debug_msg "executing: $tmp_cut_filter_col_cmd "
-    eval "$tmp_cut_filter_col_cmd"
-	# generating ped file
-    tmp_transpose_ped="$project_working_dir/$running_key"_tmp_transpose_ped
-    transpose_tped_cmd="awk -F'\t' '{
-        for (i=1; i<=NF; i++)  {
-            a[NR,i] = \$i
-        }
-    }
-    NF>p { p = NF }
-    END {    
-        for(j=1; j<=p; j++) {
-            str=a[1,j]
-            for(i=2; i<=NR; i++){
-                str=str\"\t\"a[i,j];
-            }
-            print str
-        }
-    }' $tmp_fams_haplos_db_file_prefix.tped | grep -v \"1\" | grep -v \"2\" | grep -v \"3\" | grep -v \"4\" | grep -v \"5\" | grep -v \"6\" | grep -v \"7\" | grep -v \"8\" | grep -v \"9\" > $tmp_transpose_ped"
-    debug_msg
-    debug_msg "executing: $transpose_tped_cmd "
-    eval "$transpose_tped_cmd"
-    paste_cmd="paste $tmp_fams_haplos_db_file_prefix.tfam $tmp_transpose_ped > $tmp_fams_haplos_db_file_prefix.ped"
-    debug_msg
-    debug_msg "executing: $paste_cmd "
-    eval "$paste_cmd"
-	# generating map file
-    cut_cmd="cut -f1-4 $tmp_fams_haplos_db_file_prefix.tped > $tmp_fams_haplos_db_file_prefix.map"
-    debug_msg
-    debug_msg "executing: $cut_cmd "
-    eval "$cut_cmd"
     info_msg "done extracting and transposing haplotypes information of families of interest in map/ped format (PLINK file prefix: $tmp_fams_haplos_db_file_prefix)"
 fi
 # ---------- prepare haplotypes families information if indicated --------------
@@ -702,7 +605,17 @@ python_cmd="python $PLINK2XLS"
 #python_cmd+=" -A raw,$raw_plink_out_with_odds_ratio:filtered-assoc.hap,$filtered_haplotypes_out:input,$tmp_selected_haplotypes_out"
 #python_cmd+=" -A filtered-assoc.hap,$filtered_haplotypes_out:input,$tmp_selected_haplotypes_out"
 #python_cmd+=" -A OR,$raw_plink_out_with_odds_ratio:input,$tmp_selected_haplotypes_out"
-python_cmd+=" -S $tmp_SNPs_info"
+# positions and missing genotyping rates of cases and controls are read
+# directly from PLINK binary files
+python_cmd+=" -b $plink_input_bfile_prefix"
+if [ "$plink_region" != "All" ]
+then
+    python_cmd+=" -R $plink_region"
+fi
+if [ ! -z "$plink_pheno_file" ]
+then
+    python_cmd+=" -P $plink_pheno_file"
+fi
 python_cmd+=" -H $tmp_selected_haplotypes_out"
 python_cmd+=" -F $filtered_haplotypes_out"
 if [ ! -z "$plink_fams_haplos_db_tfile_prefix" ]
@@ -12,13 +12,15 @@ cat <<EOF
 usage:
 $0 [OPTION]
 option:
--p {project code}   specify UPPMAX project code (default: no job)
+-p {project code}   specify UPPMAX project code, a job of script_gen_plink_report.sh is submitted for each region (required unless -H is specified)
+-j {number}         specify the number of regions reported at the same time without project code (default: 1)
 -T {time}           set a limit on the total run time of the job allocation. (defuault: $TOTAL_RUN_TIME_DEFAULT)
 -k {name}           specify a name that will act as unique keys of temporary files and default name for unspecified output file names (required)
 -b {file prefix}    specify PLINK input bfile prefix (required)
 -W {window list}    specify PLINK haplotype window sizes for association study (comma separated, e.g., -W 1,2) (required)
 -R {region}         specify PLINK region of interest (default: $PLINK_REGION_DEFAULT)
 -P {file}           specify PLINK phenotype file (default: None)
+-H {file prefix}    specify phased haplotypes tfile prefix, without project code all the regions are reported locally from one load of the genotypes (default: None)
 -f {file prefix}    specify PLINK families haplotypes database tfile prefix (default: None)
 -I {ids}            specify PLINK tfam family ids (comma separated, e.g., -I fam_8,fam_24) (default: None)
 -s {information}    specify informaiton of families of interest (default: None)
@@ -40,12 +42,15 @@ die () {
 subproject_params_prefix=""
 
 # parse option
-while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:Do:l:" OPTION; do
+while getopts ":p:j:T:k:b:W:P:H:f:I:s:R:S:C:Do:l:" OPTION; do
   case "$OPTION" in
     p)
       project_code="$OPTARG"
       subproject_params_prefix+=" -p $OPTARG"
       ;;
+    j)
+      local_n_jobs="$OPTARG"
+      ;;
     T)
       total_run_time="$OPTARG"
       subproject_params_prefix+=" -T $OPTARG"
@@ -62,27 +67,38 @@ while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:Do:l:" OPTION; do
       subproject_params_prefix+=" -W $OPTARG"
       ;;
     P)
+      plink_pheno_file="$OPTARG"
       subproject_params_prefix+=" -P $OPTARG"
       ;;
+    H)
+      phased_haplos_tfile_prefix="$OPTARG"
+      subproject_params_prefix+=" -H $OPTARG"
+      ;;
     f)
+      plink_fams_haplos_db_tfile_prefix="$OPTARG"
       subproject_params_prefix+=" -f $OPTARG"
       ;;
     I)
+      plink_tfam_family_ids="$OPTARG"
       subproject_params_prefix+=" -I $OPTARG"
       ;;
     s)
+      special_families_info="$OPTARG"
       subproject_params_prefix+=" -s $OPTARG"
       ;;
     R)
       plink_regions="$OPTARG"
       ;;
     S)
+      pvalue_significance_ratio="$OPTARG"
       subproject_params_prefix+=" -S $OPTARG"
       ;;
     C)
+      color_regions_info="$OPTARG"
       subproject_params_prefix+=" -C $OPTARG"
       ;;
     D)
+      dev_mode="On"
       subproject_params_prefix+=" -D"
       ;;
     o)
@@ -98,7 +114,7 @@ while getopts ":p:T:k:b:W:P:f:I:s:R:S:C:Do:l:" OPTION; do
   esac
 done
 
-[ ! -z $project_code ] || die "Please specify UPPMAX project code (-p)"
+[ ! -z $project_code ] || [ ! -z $phased_haplos_tfile_prefix ] || die "Please specify UPPMAX project code (-p) or phased haplotypes tfile prefix (-H)"
 [ ! -z $running_key ] || die "Please specify a unique key for this run (-k)"
 [ ! -z $plink_input_bfile_prefix ] || die "Please specify PLINK binary input file prefix (-b)"
 [ ! -z $plink_hap_window_sizes ] || die "Please specify PLINK haplotype window sizes (-W)"
@@ -186,7 +202,12 @@ display_param "parameters" "$params"
 display_param "time stamp" "$time_stamp"
 info_msg
 info_msg "overall configuration"
-display_param "project code (-p)" "$project_code"
+if [ ! -z "$project_code" ]
+then
+    display_param "project code (-p)" "$project_code"
+else
+    display_param "number of local regions jobs (-j)" "${local_n_jobs:-1}"
+fi
 display_param "total run time (-t)" "$total_run_time"
 display_param "running key prefix (-k)" "$running_key"
 display_param "slurm log directory (-l)" "$slurm_log_dir"
@@ -234,6 +255,55 @@ function get_job_status {
 }
 
 # >>>>>> Generating PLINK report
+if [ -z "$project_code" ]
+then
+    # all the regions share one load of the genotypes
+    cmd="python $PLINK_REGIONS2REPORTS"
+    cmd+=" -b $plink_input_bfile_prefix"
+    cmd+=" -H $phased_haplos_tfile_prefix"
+    cmd+=" -W $plink_hap_window_sizes"
+    cmd+=" -R $plink_regions"
+    cmd+=" -k $running_key"
+    cmd+=" -o $project_out_dir"
+    if [ ! -z "$plink_pheno_file" ]
+    then
+        cmd+=" -P $plink_pheno_file"
+    fi
+    if [ ! -z "$plink_fams_haplos_db_tfile_prefix" ]
+    then
+        cmd+=" -f $plink_fams_haplos_db_tfile_prefix"
+    fi
+    if [ ! -z "$plink_tfam_family_ids" ]
+    then
+        cmd+=" -I $plink_tfam_family_ids"
+    fi
+    if [ ! -z "$special_families_info" ]
+    then
+        cmd+=" -s $special_families_info"
+    fi
+    if [ ! -z "$pvalue_significance_ratio" ]
+    then
+        cmd+=" -S $pvalue_significance_ratio"
+    fi
+    if [ ! -z "$color_regions_info" ]
+    then
+        cmd+=" -C $color_regions_info"
+    fi
+    if [ ! -z "$local_n_jobs" ]
+    then
+        cmd+=" -j $local_n_jobs"
+    fi
+    if [ "$dev_mode" == "On" ]
+    then
+        cmd+=" -D"
+    fi
+    info_msg
+    info_msg "executing: $cmd"
+    eval "$cmd"
+    new_section_txt "F I N I S H <$script_name>"
+    exit
+fi
+
 report_job_count=0
 
 ## submit job to generate PLINK report
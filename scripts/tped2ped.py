@@ -0,0 +1,50 @@
+import sys
+import ntpath
+import argparse
+
+from cmm_plink import PlinkTpedReader
+from cmm_plink import parse_region
+
+script_name = ntpath.basename(sys.argv[0])
+
+# ****************************** get arguments ******************************
+argp = argparse.ArgumentParser(description="A script to extract a region of families from a PLINK transposed (.tped/.tfam) families haplotypes database into the .ped/.map files that plink2xls.py reads (-f)")
+argp.add_argument('-t', dest='tfile_prefix',
+                        metavar='FILE PREFIX',
+                        help='PLINK .tped/.tfam input file prefix',
+                        required=True)
+argp.add_argument('-o', dest='out_prefix',
+                        metavar='FILE PREFIX',
+                        help='output .ped/.map file prefix',
+                        required=True)
+argp.add_argument('-R', dest='region',
+                        metavar='REGION',
+                        help='region of interest in <chrom>[:<from bp>-<to bp>] format (default: All)',
+                        default='All')
+argp.add_argument('-I', dest='fam_ids',
+                        metavar='IDS',
+                        help='comma-separated family IDs of the .tfam file to extract (default: all families)',
+                        default=None)
+args = argp.parse_args()
+
+# ****************************** define functions ******************************
+def info(msg):
+    print >> sys.stderr, "## [INFO] " + msg
+
+# ****************************** main codes ******************************
+tped_reader = PlinkTpedReader(args.tfile_prefix)
+info("indexed " + str(len(tped_reader.chroms)) + " chromosome(s) of " + str(tped_reader.n_samples) + " samples in " + args.tfile_prefix)
+if args.region == 'All':
+    (chrom, from_bp, to_bp) = (None, None, None)
+else:
+    (chrom, from_bp, to_bp) = parse_region(args.region)
+if args.fam_ids is not None:
+    fam_ids = args.fam_ids.split(',')
+else:
+    fam_ids = None
+(n_markers, n_samples) = tped_reader.write_ped_map(args.out_prefix,
+                                                   chrom,
+                                                   from_bp,
+                                                   to_bp,
+                                                   fam_ids)
+info(str(n_markers) + " markers of " + str(n_samples) + " samples in region " + args.region + " are written to " + args.out_prefix + ".ped/.map")
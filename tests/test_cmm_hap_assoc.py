@@ -0,0 +1,114 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from cmm_hap_assoc import HapAssocEngine
+from cmm_hap_assoc import OMNIBUS
+from cmm_hap_assoc import STAT_NA
+
+MARKERS = [('1', 'rs1', '0', '1000'),
+           ('1', 'rs2', '0', '1010'),
+           ('1', 'rs3', '0', '1020'),
+           ]
+MARKER_ALLELES = [['0', 'A', 'G'],
+                  ['0', 'C', 'T'],
+                  ['0', 'A', 'T'],
+                  ]
+# markers x haplotypes, two haplotypes of each of the three samples
+ALLELE_CODES = np.array([[1, 2, 1, 1, 2, 2],
+                         [1, 1, 2, 1, 2, 1],
+                         [2, 2, 1, 1, 1, 2],
+                         ], dtype=np.uint8)
+
+
+def get_all_rows(engine, window_sizes):
+    win_nos = engine.get_window_nos(window_sizes)
+    rows = []
+    for chunk in engine.get_chunks():
+        results = engine.get_chunk_results(chunk, window_sizes, win_nos)
+        for window_size in window_sizes:
+            rows += results.get(window_size, [])
+    return rows
+
+
+class TestHapAssocEngineNoTest(unittest.TestCase):
+    """ windows without any testable haplotype are reported with NA """
+
+    def assert_omnibus_na(self, rows, n_windows):
+        omnibus_rows = [row for row in rows if row[1] == OMNIBUS]
+        self.assertEqual(len(omnibus_rows), n_windows)
+        for row in omnibus_rows:
+            self.assertEqual(row[4], STAT_NA)
+            self.assertEqual(row[6], STAT_NA)
+
+    def test_no_phenotypes(self):
+        engine = HapAssocEngine(MARKERS,
+                                ALLELE_CODES,
+                                MARKER_ALLELES,
+                                ['0', '0', '0'])
+        rows = get_all_rows(engine, [1, 2])
+        self.assert_omnibus_na(rows, 5)
+
+    def test_no_haplotype_above_mhf(self):
+        engine = HapAssocEngine(MARKERS,
+                                ALLELE_CODES,
+                                MARKER_ALLELES,
+                                ['2', '1', '2'],
+                                mhf=0.99)
+        rows = get_all_rows(engine, [1, 2, 3])
+        self.assert_omnibus_na(rows, 6)
+        self.assertEqual([row for row in rows if row[1] != OMNIBUS], [])
+
+    def test_cases_and_controls(self):
+        engine = HapAssocEngine(MARKERS,
+                                ALLELE_CODES,
+                                MARKER_ALLELES,
+                                ['2', '1', '2'])
+        rows = get_all_rows(engine, [2])
+        omnibus_rows = [row for row in rows if row[1] == OMNIBUS]
+        self.assertEqual(len(omnibus_rows), 2)
+        for row in omnibus_rows:
+            self.assertNotEqual(row[4], STAT_NA)
+
+
+class TestHapAssocEngineStats(unittest.TestCase):
+    """ statistics of a window computed by hand """
+
+    def setUp(self):
+        self.engine = HapAssocEngine(MARKERS,
+                                     ALLELE_CODES,
+                                     MARKER_ALLELES,
+                                     ['2', '1', '2'])
+
+    def test_two_markers_window(self):
+        # the first window of 2 markers has the haplotypes AC, GC, GT, GC
+        # in cases and AT, AC in controls
+        rows = get_all_rows(self.engine, [2])
+        win_rows = [row for row in rows if row[0] == 'WIN1']
+        self.assertEqual(win_rows,
+                         [['WIN1', OMNIBUS, STAT_NA, STAT_NA, '3.75', '3', '0.2898', 'rs1|rs2'],
+                          ['WIN1', 'AC', '0.25', '0.5', '0.375', '1', '0.5403', 'rs1|rs2'],
+                          ['WIN1', 'AT', '0', '0.5', '2.4', '1', '0.1213', 'rs1|rs2'],
+                          ['WIN1', 'GC', '0.5', '0', '1.5', '1', '0.2207', 'rs1|rs2'],
+                          ['WIN1', 'GT', '0.25', '0', '0.6', '1', '0.4386', 'rs1|rs2'],
+                          ])
+
+    def test_windows_across_chunks(self):
+        window_sizes = [1, 2, 3]
+        win_nos = self.engine.get_window_nos(window_sizes)
+        chunks_rows = dict((window_size, []) for window_size in window_sizes)
+        for chunk in self.engine.get_chunks(chunk_size=1):
+            results = self.engine.get_chunk_results(chunk, window_sizes, win_nos)
+            for window_size in window_sizes:
+                chunks_rows[window_size] += results.get(window_size, [])
+        for window_size in window_sizes:
+            self.assertEqual(chunks_rows[window_size],
+                             get_all_rows(self.engine, [window_size]))
+        self.assertEqual(len([row for row in chunks_rows[2] if row[1] == OMNIBUS]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
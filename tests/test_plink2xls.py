@@ -0,0 +1,86 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+PLINK2XLS = os.path.join(SCRIPTS_DIR, 'plink2xls.py')
+
+HAP_ASSOC_HEADER = "LOCUS\tHAPLOTYPE\tF_A\tF_U\tCHISQ\tOR\tDF\tP\tSNPS"
+HAPLOS = ["WIN1_1\tA\t0.7000\t0.2000\t6.906\t1.0747\t1\t0.0003\trs1",
+          "WIN2_1\tAC\t0.6000\t0.3000\t5.439\t2.4971\t1\t0.0002\trs1|rs2",
+          "WIN2_2\tTG\t0.5000\t0.4000\t4.102\t1.5000\t1\t0.0004\trs2|rs3",
+          ]
+SNPS_INFO = ["SNP\tF_MISS_A\tF_MISS_U\tCHROM\tPOS",
+             "rs1\t0.01\t0.02\t1\t1000",
+             "rs2\t0.01\t0.02\t1\t1010",
+             "rs3\t0.01\t0.02\t1\t1020",
+             ]
+MAP = ["1\trs1\t0\t1000",
+       "1\trs2\t0\t1010",
+       "1\trs3\t0\t1020",
+       ]
+# fam_a carries A on both haplotypes at rs1, its second haplotype has T at
+# rs2 and misses rs3
+PED = ["fam_a\tfam_a\t0\t0\t1\t2\tA A\tC T\tG 0",
+       "fam_b\tfam_b\t0\t0\t1\t1\tG G\tC C\tG G",
+       ]
+
+
+def write_lines(file_name, lines):
+    with open(file_name, 'w') as out_file:
+        for line in lines:
+            out_file.write(line + "\n")
+
+
+class TestExportMatches(unittest.TestCase):
+    """ the haplotypes matches exported with --export-matches """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_path(self, file_name):
+        return os.path.join(self.tmp_dir, file_name)
+
+    def run_plink2xls(self):
+        write_lines(self.get_path('snps_info.txt'), SNPS_INFO)
+        write_lines(self.get_path('haplos.txt'), [HAP_ASSOC_HEADER] + HAPLOS)
+        write_lines(self.get_path('fams.map'), MAP)
+        write_lines(self.get_path('fams.ped'), PED)
+        matches_file = self.get_path('matches.tsv')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable,
+                                   PLINK2XLS,
+                                   '-o', self.get_path('out.xlsx'),
+                                   '-S', self.get_path('snps_info.txt'),
+                                   '-H', self.get_path('haplos.txt'),
+                                   '-F', self.get_path('haplos.txt'),
+                                   '-f', self.get_path('fams'),
+                                   '-l', self.get_path('log.txt'),
+                                   '--export-matches', matches_file,
+                                   ],
+                                  cwd=SCRIPTS_DIR,
+                                  stderr=devnull)
+        with open(matches_file) as in_file:
+            return [line.rstrip("\n").split("\t") for line in in_file]
+
+    def test_matches_of_both_ploids(self):
+        rows = self.run_plink2xls()
+        # FAMILY, PLOID, LOCUS, N_MARKERS, FIRST_BP, LAST_BP
+        matches = [(row[0], row[1], row[2], row[6], row[7], row[8])
+                   for row in rows[1:]]
+        self.assertEqual(sorted(matches),
+                         [('fam_a', '0', 'WIN1_1', '1', '1000', '1000'),
+                          ('fam_a', '0', 'WIN2_1', '2', '1000', '1010'),
+                          ('fam_a', '1', 'WIN1_1', '1', '1000', '1000'),
+                          ('fam_a', '1', 'WIN2_2', '1', '1010', '1010'),
+                          ])
+
+
+if __name__ == '__main__':
+    unittest.main()